@@ -3,15 +3,24 @@
 ####################################################################################################
 
 import os
+import sys
 import json
 import glob
+import time
+import queue
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 from dotenv import load_dotenv
 
 from langchain_community.document_loaders import PyPDFLoader, Docx2txtLoader
 
-from pdf2image import convert_from_path
+from pdf2image import convert_from_path, pdfinfo_from_path
 import pytesseract
 
+# Worker kill helpers are shared with the server's loader
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "serverCodes"))
+from rag_procs import own_process_group, kill_worker
+
 load_dotenv()
 
 ####################################################################################################
@@ -28,103 +37,223 @@ pytesseract.pytesseract.tesseract_cmd = (
     or r"C:\Program Files\Tesseract-OCR\tesseract.exe"
 )
 
+# OCR renders OCR_WINDOW pages at a time per worker instead of the whole PDF
+OCR_DPI = int(os.getenv("OCR_DPI", "300"))
+OCR_WINDOW = int(os.getenv("OCR_WINDOW", "2"))
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", str(os.cpu_count() or 1)))
+
+# Files are extracted in parallel, one process per file, with a time limit
+LOAD_WORKERS = int(os.getenv("LOAD_WORKERS", str(os.cpu_count() or 1)))
+LOAD_TIMEOUT = float(os.getenv("LOAD_TIMEOUT", "900"))  # seconds per file
+
 os.makedirs(PDF_FOLDER, exist_ok=True)
 os.makedirs(DATASET_FOLDER, exist_ok=True)
 
 ####################################################################################################
-# MAIN LOADER
+# STREAMING OCR
 ####################################################################################################
 
-def run_loader():
-    if os.path.exists(OUTPUT_FILE):
-        os.remove(OUTPUT_FILE)
+def ocr_window(path, first, last):
+    images = convert_from_path(path, dpi=OCR_DPI, first_page=first, last_page=last)
 
-    files = (
-        glob.glob(f"{PDF_FOLDER}/*.pdf")
-        + glob.glob(f"{PDF_FOLDER}/*.txt")
-        + glob.glob(f"{PDF_FOLDER}/*.docx")
-    )
+    pages = []
+    for i, img in enumerate(images):
+        img = img.convert("L")  # 🔑 grayscale
 
-    if not files:
-        raise RuntimeError("❌ No files found")
+        text = pytesseract.image_to_string(
+            img,
+            config="--oem 3 --psm 6"
+        )
+        pages.append({"page": first - 1 + i, "text": text})
+    return pages
 
-    total_blocks = 0
+def iter_ocr_pages(path, workers=OCR_WORKERS):
+    total = pdfinfo_from_path(path)["Pages"]
+    windows = [
+        (f, min(f + OCR_WINDOW - 1, total))
+        for f in range(1, total + 1, OCR_WINDOW)
+    ]
 
-    for path in files:
-        filename = os.path.basename(path)
-        print(f"📄 Processing: {filename}")
+    # One worker (or one window): no pool to start, OCR in this process
+    if workers <= 1 or len(windows) == 1:
+        for first, last in windows:
+            yield from ocr_window(path, first, last)
+        return
 
-        records = []
+    # Bounded in-flight windows; pages come back as each window finishes
+    windows = iter(windows)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        running = set()
+        while True:
+            while len(running) < 2 * workers:
+                nxt = next(windows, None)
+                if nxt is None:
+                    break
+                running.add(pool.submit(ocr_window, path, *nxt))
 
-        # ================= TXT =================
-        if path.endswith(".txt"):
-            text = open(path, encoding="utf-8", errors="ignore").read()
-            if text.count(" ") >= 20:
-                records.append({
-                    "source": path,
-                    "text": text
-                })
+            if not running:
+                return
 
-        # ================= DOCX =================
-        elif path.endswith(".docx"):
-            text = Docx2txtLoader(path).load()[0].page_content
-            if text.count(" ") >= 20:
-                records.append({
-                    "source": path,
-                    "text": text
-                })
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield from future.result()
 
-        # ================= PDF =================
-        else:
-            # ---------- TRY PyPDF ----------
+####################################################################################################
+# PER-FILE EXTRACTION
+####################################################################################################
+
+def extract_file(path, ocr_workers=OCR_WORKERS):
+    records = []
+
+    # ================= TXT =================
+    if path.endswith(".txt"):
+        text = open(path, encoding="utf-8", errors="ignore").read()
+        if text.count(" ") >= 20:
+            records.append({
+                "source": path,
+                "text": text
+            })
+
+    # ================= DOCX =================
+    elif path.endswith(".docx"):
+        text = Docx2txtLoader(path).load()[0].page_content
+        if text.count(" ") >= 20:
+            records.append({
+                "source": path,
+                "text": text
+            })
+
+    # ================= PDF =================
+    else:
+        # ---------- TRY PyPDF ----------
+        pdf_docs = []
+        try:
+            pdf_docs = PyPDFLoader(path).load()
+        except Exception:
             pdf_docs = []
-            try:
-                pdf_docs = PyPDFLoader(path).load()
-            except Exception:
-                pdf_docs = []
 
-            for d in pdf_docs:
-                if d.page_content.count(" ") < 20:
+        for d in pdf_docs:
+            if d.page_content.count(" ") < 20:
+                continue
+            records.append({
+                "source": path,
+                "page": d.metadata.get("page"),
+                "text": d.page_content
+            })
+
+        # ---------- FORCE OCR IF NO USABLE TEXT ----------
+        if not records:
+            print(f"   ⚠️ No usable text in {os.path.basename(path)} — forcing OCR")
+
+            for p in iter_ocr_pages(path, ocr_workers):
+                if p["text"].count(" ") < 20:
                     continue
+
                 records.append({
                     "source": path,
-                    "page": d.metadata.get("page"),
-                    "text": d.page_content
+                    "page": p["page"],
+                    "text": p["text"]
                 })
 
-            # ---------- FORCE OCR IF NO USABLE TEXT ----------
-            if not records:
-                print("   ⚠️ No usable text found — forcing OCR")
+            records.sort(key=lambda r: r["page"])
+
+    return records
+
+def extract_worker(path, ocr_workers, out):
+    # Own process group, so a timeout also kills this file's OCR pool
+    # (POSIX only; on Windows just the worker is killed)
+    own_process_group()
+    started = time.perf_counter()
+    try:
+        records = extract_file(path, ocr_workers)
+        out.put((path, records, time.perf_counter() - started, None))
+    except Exception as e:
+        out.put((path, [], time.perf_counter() - started, str(e)))
+
+def iter_extracted(files):
+    # One process per file (at most LOAD_WORKERS at once), killed after
+    # LOAD_TIMEOUT. Yields (path, records, seconds, error) as files finish.
+    out = multiprocessing.Queue()
+    todo = list(files)
+    running = {}
+    ocr_workers = max(1, OCR_WORKERS // max(1, min(LOAD_WORKERS, len(todo))))
+
+    try:
+        while todo or running:
+            while todo and len(running) < LOAD_WORKERS:
+                path = todo.pop(0)
+                proc = multiprocessing.Process(target=extract_worker, args=(path, ocr_workers, out))
+                proc.start()
+                running[path] = (proc, time.monotonic() + LOAD_TIMEOUT)
+
+            try:
+                path, records, seconds, error = out.get(timeout=0.5)
+                if path in running:
+                    running.pop(path)[0].join()
+                    yield path, records, seconds, error
+            except queue.Empty:
+                pass
+
+            now = time.monotonic()
+            for path, (proc, deadline) in list(running.items()):
+                if now > deadline:
+                    kill_worker(proc)
+                    del running[path]
+                    yield path, [], LOAD_TIMEOUT, f"timed out after {LOAD_TIMEOUT:.0f}s"
+                elif proc.exitcode not in (None, 0):
+                    del running[path]
+                    yield path, [], 0.0, f"worker exited with code {proc.exitcode}"
+    finally:
+        # Stopped early (error / Ctrl+C): don't leave extractors behind
+        for proc, _ in running.values():
+            kill_worker(proc)
+
+####################################################################################################
+# MAIN LOADER
+####################################################################################################
+
+def run_loader():
+    if os.path.exists(OUTPUT_FILE):
+        os.remove(OUTPUT_FILE)
+
+    files = (
+        glob.glob(f"{PDF_FOLDER}/*.pdf")
+        + glob.glob(f"{PDF_FOLDER}/*.txt")
+        + glob.glob(f"{PDF_FOLDER}/*.docx")
+    )
 
-                images = convert_from_path(path, dpi=300)
+    if not files:
+        raise RuntimeError("❌ No files found")
 
-                for i, img in enumerate(images):
-                    img = img.convert("L")  # 🔑 grayscale
+    total_blocks = 0
+    failed = 0
+    total_bytes = sum(os.path.getsize(p) for p in files)
+    started = time.perf_counter()
 
-                    text = pytesseract.image_to_string(
-                        img,
-                        config="--oem 3 --psm 6"
-                    )
+    print(f"📄 Processing {len(files)} files with {LOAD_WORKERS} workers")
 
-                    if text.count(" ") < 20:
-                        continue
+    # ================= WRITE OUTPUT (single buffered writer) =================
+    with open(OUTPUT_FILE, "w", encoding="utf-8", buffering=1 << 20) as f:
+        for path, records, seconds, error in iter_extracted(files):
+            filename = os.path.basename(path)
 
-                    records.append({
-                        "source": path,
-                        "page": i,
-                        "text": text
-                    })
+            if error:
+                failed += 1
+                print(f"   ❌ {filename}: {error}")
+                continue
 
-        # ================= WRITE OUTPUT =================
-        for r in records:
-            with open(OUTPUT_FILE, "a", encoding="utf-8") as f:
+            for r in records:
                 f.write(json.dumps(r, ensure_ascii=False) + "\n")
-            total_blocks += 1
+            total_blocks += len(records)
+
+            print(f"   ✓ {filename}: {len(records)} text blocks in {seconds:.1f}s")
 
-        print(f"   ✓ Extracted {len(records)} text blocks")
+    elapsed = max(time.perf_counter() - started, 1e-9)
 
     print("\n✅ LOADING COMPLETE")
     print(f"🧱 Text blocks written: {total_blocks}")
+    print(f"📚 Files loaded: {len(files) - failed}/{len(files)}")
+    print(f"⏱️ {elapsed:.1f}s | {len(files) / elapsed:.2f} files/s | {total_bytes / elapsed / 2**20:.2f} MB/s")
     print(f"📁 Output file: {OUTPUT_FILE}")
     print("➡ Next: run `2_chunking_embedding_ingestion.py`")
 
@@ -2,15 +2,27 @@
 # 2_chunking_embedding_ingestion.py — ABSOLUTELY SAFE, ACCURACY-FIRST
 ####################################################################################################
 
-import os, json, re, shutil, multiprocessing
+import os, sys, json, re, shutil, uuid, multiprocessing
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
 from tqdm import tqdm
+import numpy as np
 import tiktoken
 
 from langchain_community.vectorstores import FAISS
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_ollama import OllamaEmbeddings
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
+# The index, chunk store, embedding cache and lazy-loading modules are
+# shared with the server; one copy lives in serverCodes
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "serverCodes"))
+
+from embedding_cache import CachedEmbeddings
+from rag_index import INDEX_TYPE, build_index
+from rag_chunkstore import save_store
+from rag_store import new_version_dir, publish, collect_garbage
+
 load_dotenv()
 
 # ================= CONFIG =================
@@ -30,10 +42,14 @@ CHUNK_OVERLAP = 200
 MAX_TOKENS = 250
 MAX_CHARS = 1500   # secondary hard guard
 
+# 🚀 EMBEDDING THROUGHPUT
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))   # batches in flight
+
 # ================= SETUP =================
 
 encoder = tiktoken.get_encoding("cl100k_base")
-embeddings = OllamaEmbeddings(model=EMBEDDING_MODEL)
+embeddings = CachedEmbeddings(OllamaEmbeddings(model=EMBEDDING_MODEL), EMBEDDING_MODEL)
 
 splitter = RecursiveCharacterTextSplitter(
     chunk_size=CHUNK_SIZE,
@@ -86,12 +102,68 @@ def process(item):
 
     return out
 
+# ================= EMBEDDING =================
+
+def embed_batch(texts, offset):
+    # One Ollama round trip per batch. A failing batch is bisected so
+    # only the chunk(s) Ollama actually rejects get skipped.
+    try:
+        vectors = embeddings.embed_documents(texts)
+        return list(range(offset, offset + len(texts))), vectors
+    except Exception as e:
+        if len(texts) == 1:
+            print(f"⚠️ Skipping chunk {offset} due to embedding error: {e}")
+            return [], []
+
+    mid = len(texts) // 2
+    left_idx, left_vec = embed_batch(texts[:mid], offset)
+    right_idx, right_vec = embed_batch(texts[mid:], offset + mid)
+    return left_idx + right_idx, left_vec + right_vec
+
+def embed_all(texts):
+    vectors = None
+    ok = np.zeros(len(texts), dtype=bool)
+
+    with ThreadPoolExecutor(max_workers=EMBED_CONCURRENCY) as pool:
+        futures = {
+            pool.submit(embed_batch, texts[i:i + EMBED_BATCH_SIZE], i):
+                len(texts[i:i + EMBED_BATCH_SIZE])
+            for i in range(0, len(texts), EMBED_BATCH_SIZE)
+        }
+
+        with tqdm(total=len(texts), desc="Embedding") as bar:
+            for future in as_completed(futures):
+                idx, vecs = future.result()
+                if idx:
+                    if vectors is None:
+                        vectors = np.empty((len(texts), len(vecs[0])), dtype=np.float32)
+                    vectors[idx] = np.asarray(vecs, dtype=np.float32)
+                    ok[idx] = True
+                bar.update(futures[future])
+
+    if vectors is None:
+        return None, ok
+    return vectors[ok], ok
+
+def build_store(docs, vectors):
+    # Bulk-add the accumulated vectors instead of one add per chunk;
+    # INDEX_TYPE picks flat / ivf_flat / ivf_pq / hnsw
+    index = build_index(vectors)
+
+    ids = [str(uuid.uuid4()) for _ in docs]
+    return FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=InMemoryDocstore(dict(zip(ids, docs))),
+        index_to_docstore_id=dict(enumerate(ids))
+    )
+
 # ================= INGESTION =================
 
 def run_ingestion():
-    if os.path.exists(DB_PATH):
-        shutil.rmtree(DB_PATH)
-
+    # Builds into a new version under DB_PATH/versions and only then flips
+    # DB_PATH/CURRENT, so the chatbot / API keep serving the old index
+    # until the new one is complete
     items = [
         json.loads(l)
         for l in open(DATASET_FILE, encoding="utf-8")
@@ -107,33 +179,31 @@ def run_ingestion():
 
     print(f"🔹 Total safe chunks: {len(docs)}")
 
-    # ================= SAFE EMBEDDING (ONE-BY-ONE) =================
-
-    db = None
-    embedded = 0
-
-    for doc in docs:
-        try:
-            if db is None:
-                db = FAISS.from_documents([doc], embeddings)
-            else:
-                db.add_documents([doc])
+    # ================= BATCHED EMBEDDING =================
 
-            embedded += 1
-            print(f"✓ Embedded {embedded}/{len(docs)}")
+    vectors, ok = embed_all([d.page_content for d in docs])
 
-        except Exception as e:
-            print("⚠️ Skipping chunk due to embedding error")
-            continue
-
-    if db is None:
+    if vectors is None:
         raise RuntimeError("❌ No embeddings succeeded")
 
-    db.save_local(DB_PATH)
+    docs = [d for d, keep in zip(docs, ok) if keep]
+    db = build_store(docs, vectors)
+
+    folder = new_version_dir(DB_PATH)
+    try:
+        save_store(db, folder)
+    except Exception:
+        shutil.rmtree(folder, ignore_errors=True)
+        raise
+    publish(DB_PATH, folder)
+    collect_garbage(DB_PATH)
 
     print("\n✅ FAISS built successfully")
-    print(f"📦 Embedded chunks: {embedded}")
-    print(f"📁 DB Path: {DB_PATH}")
+    print(f"📦 Embedded chunks: {len(docs)} | skipped: {int((~ok).sum())}")
+    st = embeddings.stats()
+    print(f"🧮 Embedding cache | hits: {st['hits']} | misses: {st['misses']} | hit rate: {st['hit_rate']}")
+    print(f"🗂️ Index type: {INDEX_TYPE}")
+    print(f"📁 DB Path: {folder}")
 
 # ================= ENTRY =================
 
@@ -3,53 +3,149 @@
 ####################################################################################################
 
 from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi.responses import StreamingResponse
+import asyncio
+import importlib
+import json
 import shutil
+import sys
+import threading
+import time
 import uuid
 import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
-from langchain_community.vectorstores import FAISS
 from langchain_ollama import OllamaEmbeddings
-from langchain.chat_models import init_chat_model
 
 from dotenv import load_dotenv
 
-from loading_pdfs import run_loader
-from ingestion import run_ingestion
+# The index, chunk store, embedding cache and lazy-loading modules are
+# shared with the server; one copy lives in serverCodes
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "serverCodes"))
+
+from embedding_cache import CachedEmbeddings
+from rag_store import StoreManager
+from rag_lazy import lazy
 
 
 load_dotenv()
 
 app = FastAPI(title="Local RAG with Ollama")
 
-PDF_DIR = "pdfs"
+PDF_DIR = os.getenv("PDF_FOLDER", "pdfs")
 os.makedirs(PDF_DIR, exist_ok=True)
 
-_embeddings = None
-_db = None
-_llm = None
+####################################################################################################
+# RAG COMPONENTS
+####################################################################################################
+# Loaded on first use (off the event loop). Ingestion publishes a new
+# index version; the ingest worker loads it and swaps it in, so requests
+# keep answering from the old one meanwhile and never pay the reload.
 
+embeddings = CachedEmbeddings(
+    OllamaEmbeddings(model=os.getenv("EMBEDDING_MODEL")),
+    os.getenv("EMBEDDING_MODEL")
+)
 
-def load_rag():
-    global _embeddings, _db, _llm
 
-    if _db is not None:
-        return
+def make_store():
+    return StoreManager(os.getenv("DATABASE_LOCATION", "faiss_db"), embeddings)
 
-    _embeddings = OllamaEmbeddings(model=os.getenv("EMBEDDING_MODEL"))
-    _db = FAISS.load_local(
-        os.getenv("DATABASE_LOCATION"),
-        _embeddings,
-        allow_dangerous_deserialization=True
-    )
 
-    _llm = init_chat_model(
+def make_llm():
+    from langchain.chat_models import init_chat_model
+    return init_chat_model(
         os.getenv("CHAT_MODEL"),
         model_provider=os.getenv("MODEL_PROVIDER"),
         temperature=0.3
     )
 
 
-@app.post("/upload")
+store = lazy("index", make_store)
+llm = lazy("llm", make_llm)
+
+
+async def load_rag():
+    try:
+        version = (await asyncio.to_thread(store.get)).current()
+        model = await asyncio.to_thread(llm.get)
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"RAG not ready: {e}")
+    if version is None:
+        raise HTTPException(status_code=503, detail="RAG not ready: no index built yet")
+    return version.db, model
+
+####################################################################################################
+# INGESTION JOBS
+####################################################################################################
+# /upload saves the file and returns a job id at once; the loader and
+# ingestion scripts run on a single background worker (ingestion rebuilds
+# the whole index, so jobs never overlap). Uploads that arrive while a
+# job is still queued join it instead of queueing another full rebuild.
+
+JOB_HISTORY = int(os.getenv("JOB_HISTORY", "200"))
+
+ingest_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest")
+jobs = OrderedDict()
+jobs_lock = threading.Lock()
+queued_job = None
+
+
+def new_job(filename):
+    # Returns the queued job this file joins, or a new one to submit
+    global queued_job
+
+    with jobs_lock:
+        if queued_job is not None:
+            queued_job["files"].append(filename)
+            return queued_job, False
+
+        job = {
+            "id": uuid.uuid4().hex,
+            "status": "queued",
+            "files": [filename],
+            "created": time.time(),
+            "started": None,
+            "finished": None,
+            "error": None
+        }
+        jobs[job["id"]] = job
+        while len(jobs) > JOB_HISTORY:
+            jobs.popitem(last=False)
+        queued_job = job
+        return job, True
+
+
+def run_job(job):
+    global queued_job
+
+    with jobs_lock:
+        if queued_job is job:
+            queued_job = None
+        job["status"], job["started"] = "running", time.time()
+
+    try:
+        # The pipeline scripts are numbered, so import them by name
+        importlib.import_module("1_loading_pdfs").run_loader()
+        importlib.import_module("2_chunking_embedding_ingestion").run_ingestion()
+        if store.ready:
+            store.get().refresh()
+        status, error = "done", None
+    except Exception as e:
+        status, error = "failed", str(e)
+        print(f"❌ Ingestion job {job['id']} failed: {e}")
+
+    with jobs_lock:
+        job["status"], job["error"], job["finished"] = status, error, time.time()
+
+
+def save_upload(src, path):
+    with open(path, "wb") as f:
+        shutil.copyfileobj(src, f, 1 << 20)
+
+
+@app.post("/upload", status_code=202)
 async def upload_pdf(file: UploadFile = File(...)):
     if not file.filename.lower().endswith(".pdf"):
         raise HTTPException(status_code=400, detail="Only PDF files allowed")
@@ -57,26 +153,31 @@ async def upload_pdf(file: UploadFile = File(...)):
     filename = f"{uuid.uuid4()}.pdf"
     path = os.path.join(PDF_DIR, filename)
 
-    with open(path, "wb") as f:
-        shutil.copyfileobj(file.file, f)
+    await asyncio.to_thread(save_upload, file.file, path)
 
-    run_loader()
-    run_ingestion()
+    job, created = new_job(filename)
+    if created:
+        ingest_pool.submit(run_job, job)
 
-    global _db
-    _db = None  # force reload after ingestion
+    return {"status": job["status"], "job_id": job["id"], "file": filename}
 
-    return {"status": "ingested", "file": filename}
 
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    with jobs_lock:
+        job = jobs.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="Unknown job")
+        return {**job, "files": list(job["files"])}
 
-@app.post("/chat")
-async def chat(query: str):
-    load_rag()
-
-    docs = _db.similarity_search(query, k=6)
-    context = "\n\n".join(d.page_content for d in docs)
+####################################################################################################
+# CHAT
+####################################################################################################
+# Embedding and generation use the async clients; the FAISS search runs
+# in a worker thread, so the event loop never blocks on a request.
 
-    prompt = f"""
+def build_prompt(context, query):
+    return f"""
 Use only the context below.
 
 CONTEXT:
@@ -88,5 +189,47 @@ QUESTION:
 ANSWER:
 """
 
-    response = _llm.invoke(prompt)
+
+async def retrieve(index, query):
+    vector = await embeddings.aembed_query(query)
+    docs = await asyncio.to_thread(index.similarity_search_by_vector, vector, k=6)
+    return "\n\n".join(d.page_content for d in docs)
+
+
+@app.post("/chat")
+async def chat(query: str):
+    index, model = await load_rag()
+    context = await retrieve(index, query)
+
+    response = await model.ainvoke(build_prompt(context, query))
     return {"answer": response.content}
+
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.api_route("/chat/stream", methods=["GET", "POST"])
+async def chat_stream(query: str):
+    # Server-sent events: "delta" per generated piece, then "done" (or
+    # "error"); a client that disconnects closes the model stream
+    index, model = await load_rag()
+
+    async def events():
+        parts = []
+        try:
+            context = await retrieve(index, query)
+            async for chunk in model.astream(build_prompt(context, query)):
+                if chunk.content:
+                    parts.append(chunk.content)
+                    yield sse("delta", {"text": chunk.content})
+        except Exception as e:
+            yield sse("error", {"message": str(e)})
+            return
+        yield sse("done", {"answer": "".join(parts).strip()})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
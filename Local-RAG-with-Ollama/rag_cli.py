@@ -1,34 +1,60 @@
 import os
 import re
+import sys
+import time
 from dotenv import load_dotenv
 
-from langchain_community.vectorstores import FAISS
 from langchain_ollama import OllamaEmbeddings
-from langchain.chat_models import init_chat_model
 from langchain_core.messages import AIMessage, HumanMessage
-from sentence_transformers import CrossEncoder
+
+# The index, chunk store, embedding cache and lazy-loading modules are
+# shared with the server; one copy lives in serverCodes
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "serverCodes"))
+
+from embedding_cache import CachedEmbeddings
+from rag_index import tune_index
+from rag_chunkstore import load_store
+from rag_store import current_version_dir
+from rag_lazy import lazy, warm_up, mark, print_startup_report
 
 # ================= ENV =================
 load_dotenv()
 
 # ================= VECTOR STORE =================
-embeddings = OllamaEmbeddings(model=os.getenv("EMBEDDING_MODEL"))
-
-db = FAISS.load_local(
-    os.getenv("DATABASE_LOCATION"),
-    embeddings,
-    allow_dangerous_deserialization=True
+embeddings = CachedEmbeddings(
+    OllamaEmbeddings(model=os.getenv("EMBEDDING_MODEL")),
+    os.getenv("EMBEDDING_MODEL")
 )
 
+# Index, model and LLM load in the background while the prompt is up;
+# the reranker only when a question first needs it
+def make_db():
+    folder = current_version_dir(os.getenv("DATABASE_LOCATION", "faiss_db"))
+    if folder is None:
+        raise RuntimeError("No index found, run 2_chunking_embedding_ingestion.py first")
+    db = load_store(folder, embeddings)
+    tune_index(db.index)
+    return db
+
+db = lazy("index", make_db)
+
 # ================= RERANKER =================
-reranker = CrossEncoder("cross-encoder/ms-marco-MiniLM-L-6-v2")
+def make_reranker():
+    from sentence_transformers import CrossEncoder
+    return CrossEncoder("cross-encoder/ms-marco-MiniLM-L-6-v2")
+
+reranker = lazy("reranker", make_reranker)
 
 # ================= LLM =================
-llm = init_chat_model(
-    os.getenv("CHAT_MODEL"),
-    model_provider=os.getenv("MODEL_PROVIDER"),
-    temperature=0.0
-)
+def make_llm():
+    from langchain.chat_models import init_chat_model
+    return init_chat_model(
+        os.getenv("CHAT_MODEL"),
+        model_provider=os.getenv("MODEL_PROVIDER"),
+        temperature=0.0
+    )
+
+llm = lazy("llm", make_llm)
 
 # ================= CHAT STATE =================
 messages = [
@@ -98,7 +124,7 @@ CURRENT QUESTION:
 REWRITTEN QUESTION:
 """
 
-    rewritten = llm.invoke(prompt).content.strip()
+    rewritten = llm.get().invoke(prompt).content.strip()
     return rewritten if rewritten else question
 
 # =========================================================
@@ -116,14 +142,14 @@ def needs_rerank(query: str) -> bool:
 # =========================================================
 def retrieve(query: str):
     dense_k = 25 if len(query.split()) >= 5 else 35
-    dense = db.similarity_search(query, k=dense_k)
+    dense = db.get().similarity_search(query, k=dense_k)
 
     if not needs_rerank(query) or len(query.split()) < 6:
         return dense[:8]
 
     dense = dense[:15]
     pairs = [[query, d.page_content] for d in dense]
-    scores = reranker.predict(pairs)
+    scores = reranker.get().predict(pairs)
 
     ranked = sorted(zip(scores, dense), key=lambda x: x[0], reverse=True)
     return [d for _, d in ranked[:8]]
@@ -131,8 +157,10 @@ def retrieve(query: str):
 # =========================================================
 # CLI LOOP
 # =========================================================
+warm_up(["index", "llm"])
+
 print("\n📄 Document-Agnostic RAG (CLI Mode)")
-print("Type 'exit' to quit.\n")
+print("Type 'exit' to quit, 'profile' for startup timings.\n")
 
 while True:
     question = input(">> ").strip()
@@ -140,6 +168,12 @@ while True:
     if question.lower() in ("exit", "quit"):
         break
 
+    if question.lower() == "profile":
+        print_startup_report()
+        continue
+
+    started = time.perf_counter()
+
     # 🔴 HARD GIBBERISH BLOCK
     if is_gibberish(question):
         print("\nInvalid or unclear question. Please rephrase.\n")
@@ -205,7 +239,7 @@ QUESTION:
 ANSWER:
 """
 
-    response = llm.invoke(prompt)
+    response = llm.get().invoke(prompt)
     final_answer = response.content.strip()
 
     print("\n" + final_answer)
@@ -217,3 +251,4 @@ ANSWER:
 
     print()
     messages.append(AIMessage(final_answer))
+    mark("first_query", started)
@@ -0,0 +1,166 @@
+import os
+import re
+import asyncio
+import sqlite3
+import hashlib
+import threading
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# =========================================================
+# CONFIG
+# =========================================================
+CACHE_PATH = os.getenv(
+    "EMBEDDING_CACHE_PATH",
+    os.path.join(os.getenv("DATASET_STORAGE_FOLDER", "datasets"), "embedding_cache.sqlite")
+)
+
+SQLITE_MAX_PARAMS = 500
+
+# =========================================================
+# CACHED EMBEDDINGS
+# =========================================================
+# Wraps any LangChain Embeddings and memoises vectors on disk, keyed by
+# (model name, sha256 of whitespace-normalised text). Rows of any other
+# model are purged on open, so switching EMBEDDING_MODEL invalidates
+# the cache without manual cleanup. The connection is opened lazily per
+# process, so forked ingestion workers never share a SQLite handle. The
+# async methods await the wrapped model's async API and do their SQLite
+# reads / writes in a worker thread, so they never block an event loop.
+class CachedEmbeddings(Embeddings):
+    def __init__(self, underlying: Embeddings, model: str, path: str = CACHE_PATH):
+        self.underlying = underlying
+        self.model = model or ""
+        self.path = path
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._conn = None
+        self._pid = None
+
+    def db(self):
+        # Caller holds self.lock
+        if self._conn is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "model TEXT, hash TEXT, vector BLOB, PRIMARY KEY (model, hash))"
+            )
+            conn.execute("DELETE FROM embeddings WHERE model != ?", (self.model,))
+            conn.commit()
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    @staticmethod
+    def key(text: str) -> str:
+        text = re.sub(r"\s+", " ", text).strip()
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def lookup(self, keys):
+        found = {}
+        unique = list(set(keys))
+        with self.lock:
+            for i in range(0, len(unique), SQLITE_MAX_PARAMS):
+                part = unique[i:i + SQLITE_MAX_PARAMS]
+                rows = self.db().execute(
+                    f"SELECT hash, vector FROM embeddings WHERE model = ? "
+                    f"AND hash IN ({','.join('?' * len(part))})",
+                    [self.model, *part]
+                )
+                for h, blob in rows:
+                    found[h] = np.frombuffer(blob, dtype=np.float32).tolist()
+        return found
+
+    def store(self, pairs):
+        with self.lock:
+            conn = self.db()
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, hash, vector) VALUES (?, ?, ?)",
+                [(self.model, h, np.asarray(v, dtype=np.float32).tobytes()) for h, v in pairs]
+            )
+            conn.commit()
+
+    @staticmethod
+    def missing(keys, texts, found):
+        # key -> text of the distinct texts the cache did not have
+        out = {}
+        for k, t in zip(keys, texts):
+            if k not in found and k not in out:
+                out[k] = t
+        return out
+
+    def count(self, total, missed):
+        with self.lock:
+            self.misses += missed
+            self.hits += total - missed
+
+    def embed_documents(self, texts):
+        keys = [self.key(t) for t in texts]
+        found = self.lookup(keys)
+        missing = self.missing(keys, texts, found)
+
+        if missing:
+            vectors = self.underlying.embed_documents(list(missing.values()))
+            fresh = list(zip(missing.keys(), vectors))
+            self.store(fresh)
+            found.update(fresh)
+
+        self.count(len(texts), len(missing))
+        return [found[k] for k in keys]
+
+    def embed_query(self, text):
+        k = self.key(text)
+        found = self.lookup([k])
+
+        if k in found:
+            self.count(1, 0)
+            return found[k]
+
+        vector = self.underlying.embed_query(text)
+        self.store([(k, vector)])
+        self.count(1, 1)
+        return vector
+
+    async def aembed_documents(self, texts):
+        keys = [self.key(t) for t in texts]
+        found = await asyncio.to_thread(self.lookup, keys)
+        missing = self.missing(keys, texts, found)
+
+        if missing:
+            vectors = await self.underlying.aembed_documents(list(missing.values()))
+            fresh = list(zip(missing.keys(), vectors))
+            await asyncio.to_thread(self.store, fresh)
+            found.update(fresh)
+
+        self.count(len(texts), len(missing))
+        return [found[k] for k in keys]
+
+    async def aembed_query(self, text):
+        k = self.key(text)
+        found = await asyncio.to_thread(self.lookup, [k])
+
+        if k in found:
+            self.count(1, 0)
+            return found[k]
+
+        vector = await self.underlying.aembed_query(text)
+        await asyncio.to_thread(self.store, [(k, vector)])
+        self.count(1, 1)
+        return vector
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0
+            }
+
+    def reset_stats(self):
+        with self.lock:
+            self.hits = 0
+            self.misses = 0
@@ -1,7 +1,16 @@
 import os
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
 import pytesseract
 from PIL import Image
-from pdf2image import convert_from_path
+from pdf2image import convert_from_path, pdfinfo_from_path
+
+# Scanned PDFs are rendered a few pages at a time (first_page/last_page)
+# and OCR'd across a process pool, so RAM stays bounded by
+# OCR_WORKERS * OCR_WINDOW page images instead of the whole document.
+OCR_DPI = int(os.getenv("OCR_DPI", "300"))
+OCR_WINDOW = int(os.getenv("OCR_WINDOW", "2"))
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", str(os.cpu_count() or 1)))
 
 def ocr_image(image_path: str)->str:
     if not os.path.exists(image_path):
@@ -11,14 +20,48 @@ def ocr_image(image_path: str)->str:
     text = pytesseract.image_to_string(img, lang="eng")
     return text.strip()
 
-def ocr_pdf(pdf_path:str)->str:
+def ocr_window(pdf_path: str, first: int, last: int, dpi: int = OCR_DPI)->list:
+    images = convert_from_path(pdf_path, dpi=dpi, first_page=first, last_page=last)
+
+    pages = []
+    for i, img in enumerate(images):
+        text = pytesseract.image_to_string(img, lang="eng")
+        # 0-based like PyPDFLoader's "page" metadata
+        pages.append({"page": first - 1 + i, "text": text.strip()})
+        img.close()
+    return pages
+
+def iter_ocr_pages(pdf_path: str, workers: int = OCR_WORKERS, window: int = OCR_WINDOW):
     if not os.path.exists(pdf_path):
         raise FileNotFoundError(pdf_path)
-    pages = convert_from_path(pdf_path)
-    full_text=[]
-
-    for i, page in enumerate(pages):
-        page_text = pytesseract.image_to_string(page, lang="eng")
-        if page_text.strip():
-            full_text.append(page_text)
-    return "\n".join(full_text)
\ No newline at end of file
+
+    total = pdfinfo_from_path(pdf_path)["Pages"]
+    windows = [(f, min(f + window - 1, total)) for f in range(1, total + 1, window)]
+
+    if workers <= 1 or len(windows) == 1:
+        for first, last in windows:
+            yield from ocr_window(pdf_path, first, last)
+        return
+
+    # Keep at most two windows per worker in flight; pages are yielded
+    # as soon as their window finishes, not in page order.
+    todo = iter(windows)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        running = set()
+        while True:
+            while len(running) < 2 * workers:
+                nxt = next(todo, None)
+                if nxt is None:
+                    break
+                running.add(pool.submit(ocr_window, pdf_path, *nxt))
+
+            if not running:
+                return
+
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield from future.result()
+
+def ocr_pdf(pdf_path:str)->str:
+    pages = sorted(iter_ocr_pages(pdf_path), key=lambda p: p["page"])
+    return "\n".join(p["text"] for p in pages if p["text"])
@@ -0,0 +1,118 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from langchain_core.embeddings import Embeddings
+
+# =========================================================
+# CONFIG
+# =========================================================
+QUERY_EMBED_CACHE = int(os.getenv("QUERY_EMBED_CACHE", "2048"))
+QUERY_EMBED_WINDOW_MS = float(os.getenv("QUERY_EMBED_WINDOW_MS", "5"))
+QUERY_EMBED_BATCH = int(os.getenv("QUERY_EMBED_BATCH", "32"))
+
+# =========================================================
+# BATCHED QUERY EMBEDDINGS
+# =========================================================
+# Query-side front for the embedder:
+#   - in-memory LRU of query vectors, so repeats skip Ollama and SQLite
+#   - concurrent misses from different sessions wait up to
+#     QUERY_EMBED_WINDOW_MS and go out as one embed_documents call;
+#     identical texts in flight share one slot
+# Document embedding passes straight through. The batching thread is
+# started on first use, never at import.
+class BatchedQueryEmbeddings(Embeddings):
+    def __init__(self, underlying: Embeddings, cache_size=QUERY_EMBED_CACHE,
+                 window_ms=QUERY_EMBED_WINDOW_MS, max_batch=QUERY_EMBED_BATCH):
+        self.underlying = underlying
+        self.cache_size = cache_size
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+
+        self.lock = threading.Lock()
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.batches = 0
+        self.embedded = 0
+
+        self.cond = threading.Condition()
+        self.pending = OrderedDict()      # text -> Future
+        self._worker = None
+
+    def embed_documents(self, texts):
+        return self.underlying.embed_documents(texts)
+
+    def embed_query(self, text):
+        with self.lock:
+            vector = self.cache.get(text)
+            if vector is not None:
+                self.cache.move_to_end(text)
+                self.hits += 1
+                return vector
+            self.misses += 1
+
+        vector = self.submit(text).result()
+
+        with self.lock:
+            self.cache[text] = vector
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return vector
+
+    def submit(self, text) -> Future:
+        with self.cond:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self.run, name="query-embed", daemon=True)
+                self._worker.start()
+
+            future = self.pending.get(text)
+            if future is None:
+                future = self.pending[text] = Future()
+                self.cond.notify()
+            return future
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.pending:
+                    self.cond.wait()
+
+                # Give other sessions a few ms to join this batch
+                deadline = time.monotonic() + self.window
+                while len(self.pending) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.cond.wait(remaining)
+
+                batch = []
+                while self.pending and len(batch) < self.max_batch:
+                    batch.append(self.pending.popitem(last=False))
+
+            texts = [t for t, _ in batch]
+            try:
+                vectors = self.underlying.embed_documents(texts)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            with self.lock:
+                self.batches += 1
+                self.embedded += len(texts)
+            for (_, future), vector in zip(batch, vectors):
+                future.set_result(vector)
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0,
+                "batches": self.batches,
+                "avg_batch": round(self.embedded / self.batches, 2) if self.batches else 0.0
+            }
@@ -0,0 +1,161 @@
+import os
+import re
+import time
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# =========================================================
+# CONFIG
+# =========================================================
+# ANSWER_CACHE_SIZE=0 turns the cache off
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "512"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+
+# Cosine similarity of query embeddings above which two questions
+# count as the same one; set >1 to keep only exact matches
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.95"))
+
+# Identifiers and numbers ("TKT-1", "AI-202", "20", "v2.1"): questions that
+# differ in one of these ask about different things however close their
+# embeddings are, so a semantic hit needs the same set of them
+IDENT_RE = re.compile(r"[\w\-./]*\d[\w\-./]*|\w+[-_][\w\-_]+")
+
+# =========================================================
+# ANSWER CACHE (exact + near-duplicate)
+# =========================================================
+#   tier 1: normalized question + scope + index version
+#   tier 2: nearest cached question (same scope / version / identifiers)
+#           by embedding
+#
+# The scope is whatever else shapes the answer (role, partition,
+# document filter). Entries carry the index version folder they were
+# answered from; one that meets a different live version is dropped.
+
+def normalize(question: str) -> str:
+    q = re.sub(r"[^\w\s]", " ", question.lower())
+    return " ".join(q.split())
+
+def identifiers(question: str) -> frozenset:
+    return frozenset(t.strip("-./").lower() for t in IDENT_RE.findall(question))
+
+class CachedAnswer:
+    def __init__(self, answer, citations, version, vector, cost, idents=frozenset()):
+        self.answer = answer
+        self.citations = citations
+        self.version = version
+        self.vector = vector
+        self.idents = idents
+        self.cost = cost
+        self.created = time.monotonic()
+
+class AnswerCache:
+    def __init__(self, max_size=ANSWER_CACHE_SIZE, ttl=ANSWER_CACHE_TTL,
+                 similarity=ANSWER_CACHE_SIMILARITY):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.similarity = similarity
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.reset_stats()
+
+    @property
+    def enabled(self):
+        return self.max_size > 0
+
+    @staticmethod
+    def unit(vector):
+        v = np.asarray(vector, dtype="float32")
+        n = np.linalg.norm(v)
+        return v / n if n else v
+
+    def _live(self, key, entry, version):
+        # Caller holds the lock; drops expired / superseded entries
+        if (self.ttl > 0 and time.monotonic() - entry.created > self.ttl) or entry.version != version:
+            del self.entries[key]
+            return False
+        return True
+
+    def get(self, question, scope, version, vector_fn=None):
+        # Returns (CachedAnswer | None, "exact" | "semantic" | None, vector).
+        # vector_fn() embeds the question (None if it can't); it is only
+        # called past an exact miss, outside the lock. One call is one
+        # lookup, so a miss is counted once, after the last tier
+        if not self.enabled:
+            return None, None, None
+
+        key = (normalize(question), scope)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self._live(key, entry, version):
+                self.entries.move_to_end(key)
+                self.exact_hits += 1
+                return entry, "exact", None
+
+        vector = vector_fn() if vector_fn is not None else None
+
+        with self.lock:
+            if vector is not None and self.similarity <= 1:
+                best, best_key = self.similarity, None
+                q = self.unit(vector)
+                idents = identifiers(question)
+                for k, e in list(self.entries.items()):
+                    if k[1] != scope or not self._live(k, e, version) or e.vector is None:
+                        continue
+                    if e.idents != idents:
+                        continue
+                    score = float(np.dot(q, e.vector))
+                    if score >= best:
+                        best, best_key = score, k
+
+                if best_key is not None:
+                    self.entries.move_to_end(best_key)
+                    self.semantic_hits += 1
+                    return self.entries[best_key], "semantic", vector
+
+            self.misses += 1
+            return None, None, vector
+
+    def put(self, question, scope, version, answer, citations, vector=None, cost=0.0):
+        if not self.enabled:
+            return
+
+        entry = CachedAnswer(
+            answer, citations, version,
+            self.unit(vector) if vector is not None else None,
+            cost,
+            identifiers(question)
+        )
+        with self.lock:
+            key = (normalize(question), scope)
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def record_saving(self, entry, spent):
+        with self.lock:
+            self.saved += max(0.0, entry.cost - spent)
+
+    def stats(self):
+        with self.lock:
+            hits = self.exact_hits + self.semantic_hits
+            total = hits + self.misses
+            return {
+                "size": len(self.entries),
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": round(hits / total, 3) if total else 0.0,
+                "saved_ms": round(self.saved * 1000)
+            }
+
+    def reset_stats(self):
+        with self.lock:
+            self.exact_hits = 0
+            self.semantic_hits = 0
+            self.misses = 0
+            self.saved = 0.0
+
+answers = AnswerCache()
@@ -0,0 +1,760 @@
+import os
+import io
+import re
+import sys
+import json
+import time
+import math
+import zlib
+import random
+import shutil
+import hashlib
+import itertools
+import argparse
+import resource
+import tempfile
+import threading
+import zipfile
+import multiprocessing
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from xml.sax.saxutils import escape
+
+import numpy as np
+
+# =========================================================
+# OFFLINE BENCHMARK
+# =========================================================
+# Measures ingestion throughput and query latency without real models:
+#
+#   python rag_bench.py --files 40 --pages 8 --clients 8 --queries 10 \
+#       --json bench.json [--baseline previous.json]
+#
+# A stand-in for the Ollama HTTP API (deterministic hashed bag-of-words
+# vectors, canned answers, configurable latency) runs in its own process
+# and the RAG modules talk to it through OLLAMA_HOST. A synthetic
+# TXT / PDF / DOCX corpus is generated into a scratch folder, then
+#
+#   load        rag_load extraction        files/s, MB/s
+#   ingest      full + incremental ingest  chunks/s, per-stage time
+#   query       answer_query, N clients    p50/p95/p99
+#   stream      stream_answer, N clients   first token + total p50/p95/p99
+#   server      websocket server, N query clients + uploaders
+#
+# run in that order, with the peak RSS so far sampled after each phase
+# (rss.phases; rss.self_mb / children_mb is the whole run). With --baseline
+# the run exits non-zero when a headline number regresses past
+# --tolerance. `python rag_bench.py --stub-only` just serves the stub, e.g.
+# for running server.py against it by hand.
+
+# =========================================================
+# STUB OLLAMA
+# =========================================================
+def stub_vector(text, dims):
+    # Signed feature hashing of the words: similar texts, similar vectors
+    v = np.zeros(dims, dtype="float32")
+    for w in re.findall(r"\w+", text.lower()):
+        h = zlib.crc32(w.encode("utf-8"))
+        v[h % dims] += 1.0 if h & 0x80000000 else -1.0
+    n = np.linalg.norm(v)
+    if not n:
+        v[0], n = 1.0, 1.0
+    return (v / n).tolist()
+
+def stub_answer(prompt, tokens):
+    # Echoes words of the question, padded to a fixed length
+    question = prompt.rsplit("QUESTION", 1)[-1]
+    words = re.findall(r"[A-Za-z0-9-]+", question) or ["answer"]
+    return [(" " if i else "") + words[i % len(words)] for i in range(tokens)]
+
+class StubOllama(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config = None
+    slots = None
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, payload, status=200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_chunk(self, payload):
+        data = json.dumps(payload).encode("utf-8") + b"\n"
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            cfg = self.config
+            self.send_json({"models": [{"name": cfg["embed_model"]}, {"name": cfg["chat_model"]}]})
+        elif self.path == "/api/version":
+            self.send_json({"version": "0.0.0-bench"})
+        else:
+            self.send_json({"status": "Ollama is running"})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}")
+        cfg = self.config
+
+        # Ollama runs a bounded number of requests at once per model
+        with self.slots:
+            if self.path == "/api/embed":
+                texts = body.get("input") or []
+                texts = [texts] if isinstance(texts, str) else texts
+                time.sleep((cfg["embed_ms"] + cfg["embed_item_ms"] * len(texts)) / 1000)
+                self.send_json({
+                    "model": body.get("model"),
+                    "embeddings": [stub_vector(t, cfg["dims"]) for t in texts]
+                })
+
+            elif self.path == "/api/embeddings":
+                time.sleep((cfg["embed_ms"] + cfg["embed_item_ms"]) / 1000)
+                self.send_json({"embedding": stub_vector(body.get("prompt", ""), cfg["dims"])})
+
+            elif self.path in ("/api/chat", "/api/generate"):
+                self.generate(body)
+
+            elif self.path == "/api/show":
+                self.send_json({"modelfile": "", "parameters": "", "details": {}})
+
+            else:
+                self.send_json({"error": f"unknown endpoint {self.path}"}, status=404)
+
+    def generate(self, body):
+        cfg = self.config
+        chat = self.path == "/api/chat"
+        prompt = body["messages"][-1]["content"] if chat else body.get("prompt", "")
+        tokens = stub_answer(prompt, cfg["chat_tokens"])
+
+        def message(text, done):
+            out = {"model": body.get("model"), "created_at": "1970-01-01T00:00:00Z", "done": done}
+            if chat:
+                out["message"] = {"role": "assistant", "content": text}
+            else:
+                out["response"] = text
+            if done:
+                out.update(done_reason="stop", prompt_eval_count=len(prompt.split()), eval_count=len(tokens))
+            return out
+
+        time.sleep(cfg["first_token_ms"] / 1000)
+        if not body.get("stream", True):
+            time.sleep(cfg["token_ms"] * len(tokens) / 1000)
+            self.send_json(message("".join(tokens), True))
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for t in tokens:
+                self.send_chunk(message(t, False))
+                time.sleep(cfg["token_ms"] / 1000)
+            self.send_chunk(message("", True))
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # Client cancelled the stream, like a dropped Ollama request
+            self.close_connection = True
+
+def run_stub(config, port, ready=None):
+    StubOllama.config = config
+    StubOllama.slots = threading.BoundedSemaphore(config["parallel"])
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubOllama)
+    server.daemon_threads = True
+    if ready is not None:
+        ready.put(server.server_address[1])
+    server.serve_forever()
+
+def start_stub(config):
+    # Own process, so stub CPU / memory stay out of the measurements
+    ctx = multiprocessing.get_context("fork")
+    ready = ctx.Queue()
+    proc = ctx.Process(target=run_stub, args=(config, 0, ready), name="stub-ollama", daemon=True)
+    proc.start()
+    return proc, ready.get(timeout=30)
+
+# =========================================================
+# SYNTHETIC CORPUS
+# =========================================================
+# Filler text with one fact per paragraph ("The rated torque of gearbox
+# GB-1042 is 37 Nm."), so questions have a passage that answers them.
+VOCABULARY = (
+    "system pressure valve housing flange seal bearing shaft rotor stator "
+    "coolant circuit sensor signal controller harness bracket fastener "
+    "inspection procedure maintenance component assembly tolerance surface "
+    "clearance alignment lubricant filter manifold duct panel frame load "
+    "cycle fatigue crack corrosion coating thread torque washer gasket "
+    "pump motor gear drive coupling spring damper piston cylinder port "
+    "operator technician record limit range nominal reading calibration "
+    "replace verify install remove adjust measure check secure clean"
+).split()
+
+PARTS = [
+    ("pump unit", "PU"), ("valve assembly", "VA"), ("actuator", "AC"),
+    ("heat exchanger", "HX"), ("gearbox", "GB"), ("compressor", "CP")
+]
+PROPERTIES = [
+    ("maximum operating pressure", "bar"), ("rated torque", "Nm"),
+    ("service interval", "hours"), ("inspection temperature", "degrees"),
+    ("nominal voltage", "volts"), ("flow rate", "litres per minute")
+]
+# Questions that trip rag_query.needs_rerank, used with --rerank
+RERANK_TEMPLATE = "List all details recorded for the {prop} of the {part} {code}"
+QUESTION_TEMPLATE = "What is the {prop} of the {part} {code}?"
+
+def make_fact(rng):
+    part, prefix = rng.choice(PARTS)
+    prop, unit = rng.choice(PROPERTIES)
+    code = f"{prefix}-{rng.randint(1000, 9999)}"
+    value = rng.randint(2, 900)
+    return {
+        "part": part, "code": code, "prop": prop,
+        "sentence": f"The {prop} of the {part} {code} is {value} {unit}."
+    }
+
+def make_page(rng, words, facts):
+    paragraphs = []
+    while words > 0:
+        n = min(words, rng.randint(60, 120))
+        text = " ".join(rng.choice(VOCABULARY) for _ in range(n))
+        fact = make_fact(rng)
+        facts.append(fact)
+        paragraphs.append(text.capitalize() + ". " + fact["sentence"])
+        words -= n
+    return paragraphs
+
+def wrap(text, width=95):
+    lines, line = [], ""
+    for w in text.split():
+        if line and len(line) + len(w) + 1 > width:
+            lines.append(line)
+            line = w
+        else:
+            line = f"{line} {w}" if line else w
+    return lines + ([line] if line else [])
+
+def write_txt(path, pages):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n\n".join("\n\n".join(p) for p in pages))
+
+def write_pdf(path, pages):
+    # Minimal text-only PDF (Helvetica, one content stream per page)
+    def pdf_string(s):
+        return "(" + s.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") + ")"
+
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for paragraphs in pages:
+        lines = [l for p in paragraphs for l in wrap(p) + [""]][:62]
+        content = "BT /F1 10 Tf 12 TL 50 790 Td " + " ".join(f"{pdf_string(l)} Tj T*" for l in lines) + " ET"
+        data = content.encode("latin-1", "replace")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(data), data))
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % (len(objects))
+        )
+        kids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        " ".join(f"{k} 0 R" for k in kids).encode(), len(kids)
+    )
+
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for i, obj in enumerate(objects, 1):
+        offsets.append(out.tell())
+        out.write(b"%d 0 obj\n%s\nendobj\n" % (i, obj))
+    xref = out.tell()
+    out.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    for o in offsets:
+        out.write(b"%010d 00000 n \n" % o)
+    out.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+    with open(path, "wb") as f:
+        f.write(out.getvalue())
+
+def write_docx(path, pages):
+    # Minimal WordprocessingML package, enough for docx2txt / Word
+    body = "".join(
+        f'<w:p><w:r><w:t xml:space="preserve">{escape(p)}</w:t></w:r></w:p>'
+        for paragraphs in pages for p in paragraphs
+    )
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as z:
+        z.writestr("[Content_Types].xml",
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/word/document.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+            '</Types>')
+        z.writestr("_rels/.rels",
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '<Relationship Id="rId1" Target="word/document.xml" '
+            'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+            '</Relationships>')
+        z.writestr("word/document.xml",
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+            f'<w:body>{body}</w:body></w:document>')
+
+WRITERS = {"txt": write_txt, "pdf": write_pdf, "docx": write_docx}
+
+def write_document(path, rng, pages, words, facts):
+    WRITERS[path.rsplit(".", 1)[-1]](path, [make_page(rng, words, facts) for _ in range(pages)])
+
+def make_corpus(folder, files, pages, words, kinds, seed):
+    # Returns (paths, facts); the same seed always gives the same corpus
+    rng = random.Random(seed)
+    os.makedirs(folder, exist_ok=True)
+    paths, facts = [], []
+    for i in range(files):
+        path = os.path.join(folder, f"bench_{i:04d}.{kinds[i % len(kinds)]}")
+        write_document(path, rng, pages, words, facts)
+        paths.append(path)
+    return paths, facts
+
+def make_questions(facts, n, repeat, rerank, seed):
+    # n questions for each query phase; apart from the `repeat` share
+    # (answer cache hits) no fact is asked twice until all have been
+    rng = random.Random(seed)
+    template = RERANK_TEMPLATE if rerank else QUESTION_TEMPLATE
+    pool = list(facts)
+    rng.shuffle(pool)
+    fresh = (template.format(**pool[i % len(pool)]) for i in itertools.count())
+
+    questions = []
+    for _ in range(3):
+        asked = []
+        for _ in range(n):
+            asked.append(rng.choice(asked) if asked and rng.random() < repeat else next(fresh))
+        questions += asked
+    return questions
+
+# =========================================================
+# MEASUREMENT HELPERS
+# =========================================================
+def percentiles(samples):
+    # Nearest-rank percentiles in ms
+    if not samples:
+        return {"count": 0}
+    s = sorted(samples)
+    pick = lambda q: round(s[max(0, math.ceil(q * len(s)) - 1)] * 1000, 1)
+    return {
+        "count": len(s),
+        "mean_ms": round(sum(s) / len(s) * 1000, 1),
+        "p50_ms": pick(0.50), "p95_ms": pick(0.95), "p99_ms": pick(0.99),
+        "max_ms": round(s[-1] * 1000, 1)
+    }
+
+def peak_rss():
+    # ru_maxrss is in KB on Linux; children = largest waited-for child
+    return {
+        "self_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "children_mb": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1)
+    }
+
+def pick_question(questions, phase, c, i, per_client):
+    # Phases draw from separate thirds, so one doesn't warm another's cache
+    third = len(questions) // 3
+    return questions[phase * third + (c * per_client + i) % third]
+
+def run_clients(clients, per_client, fn):
+    # fn(client, i) -> list of (name, seconds); returns {name: [seconds]}
+    samples, lock, errors = {}, threading.Lock(), []
+
+    def client(c):
+        for i in range(per_client):
+            try:
+                result = fn(c, i)
+            except Exception as e:
+                errors.append(str(e))
+                continue
+            with lock:
+                for name, seconds in result:
+                    samples.setdefault(name, []).append(seconds)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(c,)) for c in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    out = {name: percentiles(s) for name, s in samples.items()}
+    out["qps"] = round(clients * per_client / elapsed, 2)
+    out["errors"] = len(errors)
+    if errors:
+        print(f"⚠️ {len(errors)} failed requests, first: {errors[0]}")
+    return out
+
+def stage_percentiles(kind):
+    # Server-side per-stage histograms from rag_metrics
+    from rag_metrics import metrics
+    prefix = f"rag_stage_seconds{{kind={kind},stage="
+    return {
+        key[len(prefix):-1]: {k: v for k, v in h.items() if k != "avg"}
+        for key, h in metrics.snapshot()["histograms"].items() if key.startswith(prefix)
+    }
+
+# =========================================================
+# PHASES
+# =========================================================
+def bench_load(files):
+    from rag_load import iter_extracted
+
+    size = sum(os.path.getsize(p) for p in files)
+    blocks, failed = 0, 0
+    started = time.perf_counter()
+    for path, records, seconds, error in iter_extracted(files):
+        failed += bool(error)
+        blocks += len(records)
+    elapsed = time.perf_counter() - started
+    return {
+        "files": len(files), "failed": failed, "blocks": blocks,
+        "seconds": round(elapsed, 2),
+        "files_per_sec": round(len(files) / elapsed, 2),
+        "mb_per_sec": round(size / elapsed / 2**20, 2)
+    }
+
+def ingest_result(summary):
+    if not summary:
+        return {"chunks": 0}
+    seconds = summary["spans"]["total"]
+    chunks = summary["counts"].get("chunks_added", 0)
+    return {
+        "chunks": chunks,
+        "seconds": round(seconds, 2),
+        "chunks_per_sec": round(chunks / seconds, 1) if seconds else None,
+        "stages": summary["spans"],
+        "counts": summary["counts"]
+    }
+
+def bench_ingest(files, args):
+    import rag_ingest
+
+    full = ingest_result(rag_ingest.ingest_files(files))
+
+    # Rewrite a share of the corpus and pick the changes up incrementally
+    rng = random.Random(args.seed + 1)
+    touched = rng.sample(files, max(1, int(len(files) * args.touch)))
+    for path in touched:
+        write_document(path, rng, args.pages, args.words, [])
+    incremental = ingest_result(rag_ingest.ingest_incremental())
+    incremental["files"] = len(touched)
+    return {"full": full, "incremental": incremental}
+
+def bench_query(questions, args):
+    import rag_query
+    from rag_store import DEFAULT_PARTITION
+
+    rag_query.partitions.refresh(DEFAULT_PARTITION)
+    rag_query.answer_query("What is the warm up check?", session_id="bench-warmup")
+
+    def ask(c, i):
+        started = time.perf_counter()
+        rag_query.answer_query(pick_question(questions, 0, c, i, args.queries),
+                               session_id=f"bench-{c}")
+        return [("latency", time.perf_counter() - started)]
+
+    return run_clients(args.clients, args.queries, ask)
+
+def bench_stream(questions, args):
+    import rag_query
+
+    def ask(c, i):
+        started = time.perf_counter()
+        first = None
+        question = pick_question(questions, 1, c, i, args.queries)
+        for kind, payload in rag_query.stream_answer(question, session_id=f"bench-stream-{c}"):
+            if kind == "delta" and first is None:
+                first = time.perf_counter()
+        done = time.perf_counter()
+        return [("first_token", (first or done) - started), ("latency", done - started)]
+
+    return run_clients(args.clients, args.queries, ask)
+
+def bench_server(questions, args, server):
+    import asyncio
+    import websockets
+    from rag_upload import HEADER, UPLOAD_CHUNK_SIZE
+
+    samples = {}
+    errors = []
+
+    def add(name, seconds):
+        samples.setdefault(name, []).append(seconds)
+
+    async def query_client(url, c):
+        async with websockets.connect(url, max_size=None) as ws:
+            for i in range(args.queries):
+                question = pick_question(questions, 2, c, i, args.queries)
+                started = time.perf_counter()
+                first = None
+                await ws.send(json.dumps({"type": "query", "stream": True, "question": question,
+                                          "thread_id": f"bench-ws-{c}", "query_id": f"{c}-{i}"}))
+                while True:
+                    msg = json.loads(await ws.recv())
+                    if msg["type"] == "answer_delta" and first is None:
+                        first = time.perf_counter()
+                    elif msg["type"] in ("answer", "error", "cancelled"):
+                        break
+                done = time.perf_counter()
+                if msg["type"] == "error":
+                    errors.append(msg.get("message"))
+                    continue
+                add("first_token", (first or done) - started)
+                add("latency", done - started)
+
+    async def upload_client(url, u):
+        rng = random.Random(args.seed + 100 + u)
+        path = os.path.join(args.workdir, f"upload_{u}.pdf")
+        write_document(path, rng, args.pages, args.words, [])
+        data = open(path, "rb").read()
+
+        async with websockets.connect(url, max_size=None) as ws:
+            started = time.perf_counter()
+            await ws.send(json.dumps({
+                "type": "file_meta", "chunked": True, "filename": os.path.basename(path),
+                "size": len(data), "sha256": hashlib.sha256(data).hexdigest()
+            }))
+            ready = json.loads(await ws.recv())
+            if ready["type"] != "upload_ready":
+                errors.append(ready.get("message"))
+                return
+            for offset in range(ready["offset"], len(data), UPLOAD_CHUNK_SIZE):
+                header = HEADER.pack(ready["channel"], offset)
+                await ws.send(header + data[offset:offset + UPLOAD_CHUNK_SIZE])
+            while True:
+                msg = json.loads(await ws.recv())
+                if msg["type"] in ("status", "error"):
+                    break
+            if msg["type"] == "error":
+                errors.append(msg.get("message"))
+            else:
+                add("upload_to_ingested", time.perf_counter() - started)
+
+    async def run():
+        server.start_ingest_queue()
+        async with websockets.serve(server.handler, "127.0.0.1", 0, max_size=server.WS_MAX_MESSAGE) as ws_server:
+            port = ws_server.sockets[0].getsockname()[1]
+            url = f"ws://127.0.0.1:{port}"
+            started = time.perf_counter()
+            await asyncio.gather(
+                *[query_client(url, c) for c in range(args.clients)],
+                *[upload_client(url, u) for u in range(args.uploads)]
+            )
+            return time.perf_counter() - started
+
+    elapsed = asyncio.run(run())
+    out = {name: percentiles(s) for name, s in samples.items()}
+    out["qps"] = round(args.clients * args.queries / elapsed, 2)
+    out["errors"] = len(errors)
+    if errors:
+        print(f"⚠️ {len(errors)} failed server requests, first: {errors[0]}")
+    return out
+
+# =========================================================
+# REPORT / BASELINE
+# =========================================================
+# (path, True if higher is better)
+HEADLINE = [
+    (("load", "mb_per_sec"), True),
+    (("ingest", "full", "chunks_per_sec"), True),
+    (("ingest", "incremental", "chunks_per_sec"), True),
+    (("query", "latency", "p95_ms"), False),
+    (("stream", "first_token", "p95_ms"), False),
+    (("server", "latency", "p95_ms"), False),
+    (("server", "upload_to_ingested", "p95_ms"), False),
+    (("rss", "self_mb"), False)
+]
+
+def lookup(result, path):
+    for key in path:
+        if not isinstance(result, dict) or key not in result:
+            return None
+        result = result[key]
+    return result
+
+def compare(result, baseline, tolerance):
+    regressions = []
+    for path, higher_is_better in HEADLINE:
+        now, before = lookup(result, path), lookup(baseline, path)
+        if not now or not before:
+            continue
+        change = (now - before) / before
+        if (-change if higher_is_better else change) > tolerance:
+            regressions.append(f"{'.'.join(path)}: {before} → {now} ({change:+.0%})")
+    return regressions
+
+def print_report(result):
+    print("\n📊 Benchmark")
+    for path, _ in HEADLINE:
+        value = lookup(result, path)
+        if value is not None:
+            print(f"   {'.'.join(path):<40} {value}")
+    for phase in ("query", "stream", "server"):
+        for name, p in (result.get(phase) or {}).items():
+            if isinstance(p, dict) and p.get("count"):
+                print(f"   {phase}.{name:<33} p50 {p['p50_ms']} | p95 {p['p95_ms']} | p99 {p['p99_ms']} ms")
+    for phase, r in (result.get("rss") or {}).get("phases", {}).items():
+        print(f"   rss after {phase:<30} self {r['self_mb']} | children {r['children_mb']} MB")
+
+# =========================================================
+# MAIN
+# =========================================================
+PHASES = ["load", "ingest", "query", "stream", "server"]
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Offline RAG benchmark against a stub Ollama")
+    p.add_argument("--phases", default=",".join(PHASES))
+    p.add_argument("--workdir", help="scratch folder (default: a temp dir, removed afterwards)")
+    p.add_argument("--seed", type=int, default=7)
+
+    corpus = p.add_argument_group("corpus")
+    corpus.add_argument("--files", type=int, default=20)
+    corpus.add_argument("--pages", type=int, default=5)
+    corpus.add_argument("--words", type=int, default=400, help="words per page")
+    corpus.add_argument("--kinds", default="txt,pdf,docx")
+    corpus.add_argument("--touch", type=float, default=0.1, help="share of files changed for the incremental run")
+
+    load = p.add_argument_group("load")
+    load.add_argument("--clients", type=int, default=8)
+    load.add_argument("--queries", type=int, default=10, help="queries per client")
+    load.add_argument("--repeat", type=float, default=0.2, help="share of repeated questions")
+    load.add_argument("--rerank", action="store_true", help="ask questions that go through the cross-encoder")
+    load.add_argument("--uploads", type=int, default=2, help="concurrent uploaders in the server phase")
+
+    stub = p.add_argument_group("stub ollama")
+    stub.add_argument("--stub-only", action="store_true")
+    stub.add_argument("--port", type=int, default=11434, help="stub port with --stub-only")
+    stub.add_argument("--dims", type=int, default=768)
+    stub.add_argument("--embed-ms", type=float, default=15, help="latency per embed request")
+    stub.add_argument("--embed-item-ms", type=float, default=1, help="latency per embedded text")
+    stub.add_argument("--first-token-ms", type=float, default=150)
+    stub.add_argument("--token-ms", type=float, default=10)
+    stub.add_argument("--chat-tokens", type=int, default=40)
+    stub.add_argument("--parallel", type=int, default=4, help="requests the stub serves at once")
+
+    out = p.add_argument_group("output")
+    out.add_argument("--json", help="write the results here")
+    out.add_argument("--baseline", help="results of an earlier run to compare with")
+    out.add_argument("--tolerance", type=float, default=0.2)
+    return p.parse_args(argv)
+
+def stub_config(args):
+    return {
+        "dims": args.dims, "embed_ms": args.embed_ms, "embed_item_ms": args.embed_item_ms,
+        "first_token_ms": args.first_token_ms, "token_ms": args.token_ms,
+        "chat_tokens": args.chat_tokens, "parallel": args.parallel,
+        "embed_model": "bench-embed", "chat_model": "bench-chat"
+    }
+
+def main(argv=None):
+    args = parse_args(argv)
+    config = stub_config(args)
+
+    if args.stub_only:
+        print(f"🧪 Stub Ollama on http://127.0.0.1:{args.port} | models: bench-embed, bench-chat")
+        run_stub(config, args.port)
+        return 0
+
+    phases = [p.strip() for p in args.phases.split(",") if p.strip()]
+    scratch = args.workdir is None
+    args.workdir = args.workdir or tempfile.mkdtemp(prefix="rag-bench-")
+    docs = os.path.join(args.workdir, "docs")
+
+    # Before anything forks or starts threads
+    stub, port = start_stub(config)
+    print(f"🧪 Stub Ollama on port {port} | workdir: {args.workdir}")
+
+    # The RAG modules read these at import
+    os.environ.update({
+        "OLLAMA_HOST": f"http://127.0.0.1:{port}",
+        "EMBEDDING_MODEL": config["embed_model"],
+        "CHAT_MODEL": config["chat_model"],
+        "MODEL_PROVIDER": "ollama",
+        "PDF_FOLDER": docs,
+        "DATASET_STORAGE_FOLDER": os.path.join(args.workdir, "datasets"),
+        "DATABASE_LOCATION": os.path.join(args.workdir, "faiss_db"),
+        "METRICS_PORT": "0"
+    })
+
+    files, facts = make_corpus(docs, args.files, args.pages, args.words,
+                               [k.strip() for k in args.kinds.split(",")], args.seed)
+    questions = make_questions(facts, args.clients * args.queries, args.repeat, args.rerank, args.seed)
+    size = sum(os.path.getsize(p) for p in files)
+    print(f"📚 Corpus: {len(files)} files | {len(facts)} facts | {size / 2**20:.1f} MB")
+
+    result = {
+        "config": {k: v for k, v in vars(args).items() if k not in ("json", "baseline", "workdir")},
+        "corpus": {"files": len(files), "facts": len(facts), "mb": round(size / 2**20, 2)}
+    }
+
+    server = None
+    try:
+        if "server" in phases:
+            # Like server.main: start the ingestion process up front
+            import server
+            server.start_ingest_pool()
+
+        # ru_maxrss only grows: each sample is the peak up to that phase's end
+        rss = {}
+        if "load" in phases:
+            print("\n⏱️ load")
+            result["load"] = bench_load(files)
+            rss["load"] = peak_rss()
+        if "ingest" in phases:
+            print("\n⏱️ ingest")
+            result["ingest"] = bench_ingest(files, args)
+            rss["ingest"] = peak_rss()
+        elif set(phases) & {"query", "stream", "server"}:
+            import rag_ingest
+            rag_ingest.ingest_files(files)
+        if "query" in phases:
+            print("\n⏱️ query")
+            result["query"] = bench_query(questions, args)
+            rss["query"] = peak_rss()
+        if "stream" in phases:
+            print("\n⏱️ stream")
+            result["stream"] = bench_stream(questions, args)
+            rss["stream"] = peak_rss()
+        if "server" in phases:
+            print("\n⏱️ server")
+            result["server"] = bench_server(questions, args, server)
+            rss["server"] = peak_rss()
+
+        result["stages"] = stage_percentiles("query")
+        result["rss"] = {**peak_rss(), "phases": rss}
+    finally:
+        if server is not None and server.ingest_pool is not None:
+            server.ingest_pool.shutdown(cancel_futures=True)
+        stub.terminate()
+        if scratch:
+            shutil.rmtree(args.workdir, ignore_errors=True)
+
+    print_report(result)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+        print(f"💾 Results written to {args.json}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(result, json.load(f), args.tolerance)
+        if regressions:
+            print(f"❌ {len(regressions)} regression(s) beyond {args.tolerance:.0%}:")
+            for r in regressions:
+                print(f"   {r}")
+            return 1
+        print(f"✅ No regressions beyond {args.tolerance:.0%}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,169 @@
+import os
+import json
+import mmap
+import uuid
+import shutil
+import hashlib
+from collections.abc import Mapping
+
+import numpy as np
+import faiss
+from langchain_core.documents import Document
+from langchain_community.docstore.base import Docstore
+from langchain_community.vectorstores import FAISS
+
+# =========================================================
+# COMPACT CHUNK STORE
+# =========================================================
+# Read-side replacement for index.pkl. Everything is memory-mapped, so
+# N query processes share one copy of the pages through the OS page
+# cache and a cold start deserialises nothing:
+#
+#   chunks.bin          record i = JSON {"id", "text", "metadata"}
+#   chunks.offsets.npy  uint64[n + 1] byte offsets of the records
+#   chunks.keys.npy     uint64[n] sorted 64-bit hashes of chunk ids
+#   chunks.pos.npy      int64[n] FAISS position of each sorted key
+#
+# Record i is the chunk at FAISS position i. index.pkl is still written
+# for the ingestion side, which needs a mutable docstore.
+
+STORE_FILES = ("chunks.bin", "chunks.offsets.npy", "chunks.keys.npy", "chunks.pos.npy")
+# Everything save_store writes; anything else in the folder is carried over
+OWN_FILES = STORE_FILES + ("index.faiss", "index.pkl")
+
+MMAP_FLAGS = faiss.IO_FLAG_MMAP | getattr(faiss, "IO_FLAG_MMAP_IFC", 0) | faiss.IO_FLAG_READ_ONLY
+
+def id_key(chunk_id: str) -> int:
+    return int.from_bytes(hashlib.blake2b(chunk_id.encode("utf-8"), digest_size=8).digest(), "little")
+
+def write_chunk_store(db, folder):
+    n = len(db.index_to_docstore_id)
+    offsets = np.zeros(n + 1, dtype=np.uint64)
+    keys = np.zeros(n, dtype=np.uint64)
+
+    with open(os.path.join(folder, "chunks.bin"), "wb", buffering=1 << 20) as f:
+        for i in range(n):
+            chunk_id = db.index_to_docstore_id[i]
+            doc = db.docstore.search(chunk_id)
+            blob = json.dumps(
+                {"id": chunk_id, "text": doc.page_content, "metadata": doc.metadata},
+                ensure_ascii=False
+            ).encode("utf-8")
+            f.write(blob)
+            offsets[i + 1] = offsets[i] + len(blob)
+            keys[i] = id_key(chunk_id)
+
+    order = np.argsort(keys, kind="stable")
+    np.save(os.path.join(folder, "chunks.offsets.npy"), offsets)
+    np.save(os.path.join(folder, "chunks.keys.npy"), keys[order])
+    np.save(os.path.join(folder, "chunks.pos.npy"), order.astype(np.int64))
+
+def save_store(db, folder):
+    # Everything is written to a sibling directory that then takes the
+    # place of `folder` as a whole, so a reader never pairs chunks of one
+    # save with offsets or vectors of another; readers that still map the
+    # old files keep their inodes. Other files already in `folder`
+    # (manifest, lexical index) move across first. Close any connection
+    # to them before saving.
+    folder = os.path.abspath(folder)
+    tag = uuid.uuid4().hex[:8]
+    scratch = f"{folder}.save-{tag}"
+    os.makedirs(scratch)
+    try:
+        db.save_local(scratch)
+        write_chunk_store(db, scratch)
+
+        if not os.path.isdir(folder):
+            os.rename(scratch, folder)
+        elif not os.listdir(folder):
+            os.rmdir(folder)
+            os.rename(scratch, folder)
+        else:
+            for name in os.listdir(folder):
+                if name not in OWN_FILES:
+                    os.replace(os.path.join(folder, name), os.path.join(scratch, name))
+            old = f"{folder}.old-{tag}"
+            os.rename(folder, old)
+            os.rename(scratch, folder)
+            shutil.rmtree(old, ignore_errors=True)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+class ChunkStore:
+    def __init__(self, folder):
+        self.offsets = np.load(os.path.join(folder, "chunks.offsets.npy"), mmap_mode="r")
+        self.keys = np.load(os.path.join(folder, "chunks.keys.npy"), mmap_mode="r")
+        self.pos = np.load(os.path.join(folder, "chunks.pos.npy"), mmap_mode="r")
+
+        with open(os.path.join(folder, "chunks.bin"), "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def record(self, i):
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        return json.loads(self.data[start:end])
+
+    def position(self, chunk_id):
+        key = np.uint64(id_key(chunk_id))
+        j = int(np.searchsorted(self.keys, key))
+        while j < len(self.keys) and self.keys[j] == key:
+            p = int(self.pos[j])
+            if self.record(p)["id"] == chunk_id:
+                return p
+            j += 1
+        return None
+
+class MappedDocstore(Docstore):
+    def __init__(self, store: ChunkStore):
+        self.store = store
+
+    def search(self, search: str):
+        p = self.store.position(search)
+        if p is None:
+            return f"ID {search} not found."
+        r = self.store.record(p)
+        return Document(id=r["id"], page_content=r["text"], metadata=r["metadata"])
+
+    def delete(self, ids):
+        raise TypeError("Memory-mapped chunk store is read-only; load with mapped=False to modify it")
+
+class MappedIds(Mapping):
+    # Stands in for FAISS.index_to_docstore_id without building the dict
+    def __init__(self, store: ChunkStore):
+        self.store = store
+
+    def __getitem__(self, i):
+        i = int(i)
+        if not 0 <= i < len(self.store):
+            raise KeyError(i)
+        return self.store.record(i)["id"]
+
+    def __iter__(self):
+        return iter(range(len(self.store)))
+
+    def __len__(self):
+        return len(self.store)
+
+# =========================================================
+# LOADING
+# =========================================================
+INDEX_MMAP = os.getenv("INDEX_MMAP", "1") == "1"
+
+def has_chunk_store(folder):
+    return all(os.path.exists(os.path.join(folder, n)) for n in STORE_FILES)
+
+def load_store(folder, embeddings, mapped=INDEX_MMAP):
+    if not mapped or not has_chunk_store(folder):
+        return FAISS.load_local(folder, embeddings, allow_dangerous_deserialization=True)
+
+    index = faiss.read_index(os.path.join(folder, "index.faiss"), MMAP_FLAGS)
+    store = ChunkStore(folder)
+    return FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=MappedDocstore(store),
+        index_to_docstore_id=MappedIds(store)
+    )
@@ -0,0 +1,129 @@
+import os
+import re
+
+from rag_lazy import lazy
+
+# =========================================================
+# CONFIG
+# =========================================================
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+
+# Share of a passage's word shingles already in the context above which
+# it is dropped as a repeat
+CONTEXT_DEDUP_THRESHOLD = float(os.getenv("CONTEXT_DEDUP_THRESHOLD", "0.8"))
+
+SHINGLE = 3
+MIN_OVERLAP = 20
+
+def make_encoder():
+    import tiktoken
+    return tiktoken.get_encoding("cl100k_base")
+
+encoder = lazy("tokenizer", make_encoder)
+
+# =========================================================
+# CONTEXT BUILDER
+# =========================================================
+# Turns ranked chunks into the CONTEXT block of the prompt:
+#   1. neighbouring chunks of the same source/page (consecutive chunk ids,
+#      "name:hash:i") are stitched together, dropping the splitter overlap
+#   2. passages that repeat another one (re-uploads, boilerplate) are dropped
+#   3. passages are packed in rank order until CONTEXT_TOKEN_BUDGET is spent
+
+def chunk_position(doc):
+    # (source key, index) from the ingest chunk id, or None
+    if not doc.id:
+        return None
+    prefix, _, index = doc.id.rpartition(":")
+    return (prefix, int(index)) if prefix and index.isdigit() else None
+
+def join_overlapping(a, b):
+    # The splitter repeats up to CHUNK_OVERLAP chars of `a` at the start of `b`
+    head = b[:MIN_OVERLAP]
+    if len(head) == MIN_OVERLAP:
+        start = a.find(head, max(0, len(a) - 2 * len(b)))
+        while start != -1:
+            if b.startswith(a[start:]):
+                return a[:start] + b
+            start = a.find(head, start + 1)
+    return a + "\n" + b
+
+class Passage:
+    def __init__(self, rank, doc):
+        self.rank = rank
+        self.source = os.path.basename(doc.metadata.get("source", ""))
+        self.page = doc.metadata.get("page")
+        self.text = doc.page_content
+        self.position = chunk_position(doc)
+        self.last = self.position
+
+    def label(self):
+        return f"{self.source} | Page {self.page + 1 if self.page is not None else '?'}"
+
+    def citation(self):
+        return f"{self.source} – Page {self.page + 1}" if self.page is not None else self.source
+
+def shingles(text):
+    words = re.findall(r"\w+", text.lower())
+    return {tuple(words[i:i + SHINGLE]) for i in range(max(1, len(words) - SHINGLE + 1))}
+
+def merge_adjacent(docs):
+    # Group chunks per (source key, page), stitch consecutive runs; each
+    # merged passage keeps the best rank of its members
+    passages = [Passage(rank, d) for rank, d in enumerate(docs)]
+    groups = {}
+    loose = []
+    for p in passages:
+        if p.position is None:
+            loose.append(p)
+        else:
+            groups.setdefault((p.position[0], p.page), []).append(p)
+
+    merged = list(loose)
+    for members in groups.values():
+        members.sort(key=lambda p: p.position[1])
+        current = members[0]
+        for p in members[1:]:
+            if p.position[1] == current.last[1]:
+                current.rank = min(current.rank, p.rank)    # duplicate hit
+            elif p.position[1] == current.last[1] + 1:
+                current.text = join_overlapping(current.text, p.text)
+                current.last = p.position
+                current.rank = min(current.rank, p.rank)
+            else:
+                merged.append(current)
+                current = p
+        merged.append(current)
+
+    return sorted(merged, key=lambda p: p.rank)
+
+def drop_duplicates(passages, threshold=CONTEXT_DEDUP_THRESHOLD):
+    kept, seen = [], []
+    for p in passages:
+        sh = shingles(p.text)
+        if any(len(sh & s) / len(sh) >= threshold for s in seen):
+            continue
+        kept.append(p)
+        seen.append(sh)
+    return kept
+
+def build_context(docs, budget=CONTEXT_TOKEN_BUDGET):
+    # Returns (context text, sorted citations, tokens used)
+    enc = encoder.get()
+    context, citations, used = [], set(), 0
+
+    for p in drop_duplicates(merge_adjacent(docs)):
+        block = f"[{p.label()}]\n{p.text}\n\n"
+        tokens = enc.encode(block)
+
+        if used + len(tokens) > budget:
+            if context:
+                continue            # a smaller passage further down may still fit
+            tokens = tokens[:budget]
+            block = enc.decode(tokens) + "\n\n"
+
+        context.append(block)
+        citations.add(p.citation())
+        used += len(tokens)
+
+    return "".join(context), sorted(citations), used
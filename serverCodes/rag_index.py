@@ -0,0 +1,208 @@
+import os
+import math
+import time
+
+import numpy as np
+import faiss
+
+# =========================================================
+# CONFIG
+# =========================================================
+# flat     exact search, raw float32 per chunk (default)
+# ivf_flat inverted lists, exact vectors, probes IVF_NPROBE lists
+# ivf_pq   inverted lists + product quantisation, ~PQ_M bytes per chunk
+# hnsw     graph index, best latency/recall, no cheap deletes
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+INDEX_TYPE = os.getenv("INDEX_TYPE", "flat").lower()
+# Fail at startup, not after a rebuild has extracted and embedded everything
+if INDEX_TYPE not in INDEX_TYPES:
+    raise ValueError(f"Unknown INDEX_TYPE '{INDEX_TYPE}', expected one of {INDEX_TYPES}")
+
+IVF_NLIST = int(os.getenv("IVF_NLIST", "0"))          # 0 = 4 * sqrt(n)
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "16"))
+PQ_M = int(os.getenv("PQ_M", "16"))
+PQ_NBITS = 8
+HNSW_M = int(os.getenv("HNSW_M", "32"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "200"))
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "64"))
+TRAIN_SAMPLE = int(os.getenv("INDEX_TRAIN_SAMPLE", "100000"))
+
+# k-means needs enough points per centroid; below this stay flat
+MIN_POINTS_PER_CENTROID = 39
+
+# =========================================================
+# BUILD
+# =========================================================
+def make_index(kind, dim, n):
+    if kind == "flat":
+        return faiss.IndexFlatL2(dim)
+
+    if kind == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, HNSW_M)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        return index
+
+    nlist = IVF_NLIST or int(4 * math.sqrt(n))
+    nlist = max(1, min(nlist, n // MIN_POINTS_PER_CENTROID))
+    quantizer = faiss.IndexFlatL2(dim)
+
+    if kind == "ivf_flat":
+        return faiss.IndexIVFFlat(quantizer, dim, nlist)
+
+    if kind == "ivf_pq":
+        m = PQ_M
+        while dim % m:
+            m -= 1
+        return faiss.IndexIVFPQ(quantizer, dim, nlist, m, PQ_NBITS)
+
+    raise ValueError(f"Unknown INDEX_TYPE '{kind}', expected one of {INDEX_TYPES}")
+
+def min_vectors(kind):
+    if kind == "ivf_pq":
+        return MIN_POINTS_PER_CENTROID * (1 << PQ_NBITS)
+    if kind == "ivf_flat":
+        return MIN_POINTS_PER_CENTROID
+    return 1
+
+def build_index(vectors, kind=INDEX_TYPE):
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    n, dim = vectors.shape
+
+    if n < min_vectors(kind):
+        print(f"⚠️ {n} vectors is too few to train '{kind}', using flat index")
+        kind = "flat"
+
+    index = make_index(kind, dim, n)
+
+    if not index.is_trained:
+        sample = vectors
+        if n > TRAIN_SAMPLE:
+            rng = np.random.default_rng(0)
+            sample = vectors[rng.choice(n, TRAIN_SAMPLE, replace=False)]
+        started = time.perf_counter()
+        index.train(sample)
+        print(f"🏋️ Trained {kind} on {len(sample)} vectors in {time.perf_counter() - started:.1f}s")
+
+    index.add(vectors)
+    tune_index(index)
+    return index
+
+# =========================================================
+# QUERY-TIME TUNING
+# =========================================================
+def index_kind(index):
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf_flat"
+    return "flat"
+
+def tune_index(index, nprobe=IVF_NPROBE, ef_search=HNSW_EF_SEARCH):
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIVF):
+        index.nprobe = nprobe
+    elif isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = ef_search
+
+# =========================================================
+# MAINTENANCE ON A LANGCHAIN FAISS STORE
+# =========================================================
+# LangChain's FAISS.delete renumbers positions after remove_ids, which
+# only matches what IndexFlat does. Other index types are rebuilt from
+# the remaining chunks instead, with vectors coming from the embedding
+# cache, so nothing is re-sent to Ollama.
+
+def store_vectors(db, embeddings):
+    if index_kind(db.index) == "flat":
+        return db.index.reconstruct_n(0, db.index.ntotal)
+
+    texts = [
+        db.docstore.search(db.index_to_docstore_id[i]).page_content
+        for i in range(len(db.index_to_docstore_id))
+    ]
+    return np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+
+def convert_store(db, embeddings, kind=INDEX_TYPE):
+    if db.index.ntotal == 0:
+        return
+    db.index = build_index(store_vectors(db, embeddings), kind)
+
+def remove_chunks(db, ids, embeddings):
+    kind = index_kind(db.index)
+    if kind == "flat":
+        db.delete(ids)
+        return
+
+    drop = set(ids)
+    keep = [cid for _, cid in sorted(db.index_to_docstore_id.items()) if cid not in drop]
+    db.docstore.delete(list(drop))
+    db.index_to_docstore_id = dict(enumerate(keep))
+
+    if keep:
+        convert_store(db, embeddings, kind)
+    else:
+        db.index = make_index("flat", db.index.d, 0)
+
+# =========================================================
+# RECALL vs LATENCY REPORT
+# =========================================================
+SWEEPS = {
+    "ivf_flat": ("nprobe", [1, 4, 16, 64]),
+    "ivf_pq": ("nprobe", [1, 4, 16, 64]),
+    "hnsw": ("efSearch", [16, 32, 64, 128])
+}
+
+def search_timed(index, queries, k):
+    found = []
+    started = time.perf_counter()
+    for q in queries:
+        _, ids = index.search(q[None, :], k)
+        found.append(ids[0])
+    return np.array(found), (time.perf_counter() - started) * 1000 / len(queries)
+
+def recall_report(vectors, k=8, n_queries=200):
+    # Held-out chunks act as queries; flat search over the rest is truth
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    rng = np.random.default_rng(0)
+    order = rng.permutation(len(vectors))
+    queries = vectors[order[:n_queries]]
+    base = vectors[order[n_queries:]]
+
+    flat = build_index(base, "flat")
+    truth, flat_ms = search_timed(flat, queries, k)
+
+    print(f"\n📊 Recall@{k} vs latency | {len(base)} vectors | {len(queries)} queries")
+    print(f"{'index':<10}{'param':<14}{'recall':>8}{'ms/query':>10}{'size MB':>10}")
+    print(f"{'flat':<10}{'-':<14}{1.0:>8.3f}{flat_ms:>10.3f}{faiss.serialize_index(flat).nbytes / 2**20:>10.1f}")
+
+    for kind, (param, values) in SWEEPS.items():
+        if len(base) < min_vectors(kind):
+            print(f"{kind:<10}skipped: needs {min_vectors(kind)} vectors")
+            continue
+
+        index = build_index(base, kind)
+        size = faiss.serialize_index(index).nbytes / 2**20
+        for v in values:
+            tune_index(index, nprobe=v, ef_search=v)
+            found, ms = search_timed(index, queries, k)
+            recall = np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth)])
+            print(f"{kind:<10}{f'{param}={v}':<14}{recall:>8.3f}{ms:>10.3f}{size:>10.1f}")
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from langchain_community.vectorstores import FAISS
+    from langchain_ollama import OllamaEmbeddings
+    from embedding_cache import CachedEmbeddings
+    from rag_store import current_version_dir
+
+    load_dotenv()
+    model = os.getenv("EMBEDDING_MODEL")
+    embeddings = CachedEmbeddings(OllamaEmbeddings(model=model), model)
+    folder = current_version_dir(os.getenv("DATABASE_LOCATION", "faiss_db"))
+    if folder is None:
+        raise SystemExit("❌ No index found, run ingestion first")
+    db = FAISS.load_local(folder, embeddings, allow_dangerous_deserialization=True)
+    recall_report(store_vectors(db, embeddings))
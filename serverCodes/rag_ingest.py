@@ -1,12 +1,24 @@
-import os, json, re, shutil, multiprocessing
+import os, json, re, time, shutil, hashlib, queue, threading, multiprocessing
 from dotenv import load_dotenv
 from tqdm import tqdm
+import numpy as np
 import tiktoken
 
 from langchain_community.vectorstores import FAISS
 from langchain_ollama import OllamaEmbeddings
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
+from rag_load import PDF_FOLDER, list_files, iter_extracted
+from embedding_cache import CachedEmbeddings
+from rag_lexical import LexicalIndex
+from rag_index import INDEX_TYPE, convert_store, remove_chunks
+from rag_chunkstore import save_store
+from rag_metrics import traced, bound, current_trace, span, count
+from rag_store import (
+    DEFAULT_PARTITION, partition_root,
+    current_version_dir, new_version_dir, publish, collect_garbage
+)
+
 load_dotenv()
 
 DB_PATH = os.getenv("DATABASE_LOCATION", "faiss_db")
@@ -18,7 +30,7 @@ CHUNK_OVERLAP = 200
 MAX_TOKENS = 600
 
 encoder = tiktoken.get_encoding("cl100k_base")
-embeddings = OllamaEmbeddings(model=EMBEDDING_MODEL)
+embeddings = CachedEmbeddings(OllamaEmbeddings(model=EMBEDDING_MODEL), EMBEDDING_MODEL)
 
 splitter = RecursiveCharacterTextSplitter(
     chunk_size=CHUNK_SIZE,
@@ -64,22 +76,411 @@ def process(item):
             out.append(d)
     return out
 
-def ingest_documents():
-    if os.path.exists(DB_PATH):
-        shutil.rmtree(DB_PATH)
+# ================= MANIFEST =================
+# Per-file record of what is in the FAISS store, so uploads only
+# re-embed the files that actually changed:
+#   { source: {"size", "mtime", "hash", "ids": [chunk ids]} }
+# Stored inside each index version, next to the data it describes.
+
+MANIFEST_NAME = "manifest.json"
+LEXICAL_NAME = "lexical.sqlite"
+
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def load_manifest(folder):
+    path = os.path.join(folder, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def save_manifest(manifest, folder):
+    path = os.path.join(folder, MANIFEST_NAME)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, path)
+
+def manifest_entry(path):
+    st = os.stat(path)
+    return {
+        "size": st.st_size,
+        "mtime": st.st_mtime,
+        "hash": file_hash(path),
+        "ids": []
+    }
+
+def chunk_id(entry, source, i):
+    return f"{os.path.basename(source)}:{entry['hash'][:12]}:{i}"
+
+def is_unchanged(path, entry):
+    # Cheap stat check first, only hash when size/mtime moved
+    st = os.stat(path)
+    if st.st_size == entry["size"] and st.st_mtime == entry["mtime"]:
+        return True
+    if file_hash(path) == entry["hash"]:
+        entry["mtime"] = st.st_mtime
+        return True
+    return False
+
+# ================= STREAMING PIPELINE =================
+# records -> process() -> labelled chunks -> batches -> embed -> index
+#
+# Chunking runs in a producer thread, embedding in EMBED_CONCURRENCY
+# worker threads, and the calling thread is the only one touching the
+# FAISS store. Stages are joined by queues of QUEUE_DEPTH batches, so a
+# slow embedder stalls extraction instead of buffering the corpus.
+
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))
+QUEUE_DEPTH = int(os.getenv("INGEST_QUEUE_DEPTH", "8"))
+CHUNK_WINDOW = 64   # records handed to the chunking pool at a time
+
+# ================= PROGRESS =================
+# Optional callback(event dict) for the running ingestion, set by the job
+# queue in the ingestion process (rag_jobs) to stream events to uploaders
+PROGRESS_SECONDS = float(os.getenv("INGEST_PROGRESS_SECONDS", "1"))
+progress = None
+
+def report(**event):
+    if progress is not None:
+        progress(event)
+
+def report_ocr(path, pages):
+    report(stage="ocr", file=os.path.basename(path), pages=pages)
+
+def iter_dataset():
+    with open(DATASET_FILE, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+def iter_chunks(records, pool=None):
+    window = []
+    for r in records:
+        window.append(r)
+        if len(window) == CHUNK_WINDOW:
+            for docs in (pool.imap(process, window) if pool else map(process, window)):
+                yield from docs
+            window = []
+    for docs in (pool.imap(process, window) if pool else map(process, window)):
+        yield from docs
+
+def label_chunks(docs, manifest):
+    for d in docs:
+        source = d.metadata["source"]
+        if source not in manifest:
+            manifest[source] = manifest_entry(source)
+        entry = manifest[source]
+        entry["ids"].append(chunk_id(entry, source, len(entry["ids"])))
+        yield entry["ids"][-1], d
+
+def iter_batches(items, size=EMBED_BATCH_SIZE):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def embed_batch(batch):
+    # Bisect failing batches so only the chunk Ollama rejects is lost
+    try:
+        vectors = embeddings.embed_documents([d.page_content for _, d in batch])
+        return batch, np.asarray(vectors, dtype=np.float32)
+    except Exception as e:
+        if len(batch) == 1:
+            print(f"⚠️ Skipping chunk {batch[0][0]} | {e}")
+            return [], None
+
+    mid = len(batch) // 2
+    left, lv = embed_batch(batch[:mid])
+    right, rv = embed_batch(batch[mid:])
+    parts = [v for v in (lv, rv) if v is not None]
+    return left + right, (np.vstack(parts) if parts else None)
+
+def add_to_store(db, lexical, batch, vectors):
+    pairs = list(zip([d.page_content for _, d in batch], vectors))
+    metadatas = [d.metadata for _, d in batch]
+    ids = [i for i, _ in batch]
+
+    lexical.add(ids, [d.page_content for _, d in batch])
+    if db is None:
+        return FAISS.from_embeddings(pairs, embeddings, metadatas=metadatas, ids=ids)
+    db.add_embeddings(pairs, metadatas=metadatas, ids=ids)
+    return db
+
+def run_pipeline(db, lexical, records, manifest, pool=None):
+    # Stage spans are summed busy time across threads; *_wait spans are
+    # time a stage sat blocked on its neighbour's queue
+    trace = current_trace()
+    batches = queue.Queue(maxsize=QUEUE_DEPTH)
+    embedded = queue.Queue(maxsize=QUEUE_DEPTH)
+    errors = []
+
+    # Set when any stage fails: the others stop waiting on its queues
+    # instead of blocking forever on a put / get nobody will answer
+    stop = threading.Event()
+
+    def put(q, item):
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.2)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def get(q):
+        while not stop.is_set():
+            try:
+                return q.get(timeout=0.2)
+            except queue.Empty:
+                pass
+        return None
+
+    def fail(e):
+        errors.append(e)
+        stop.set()
+
+    def produce():
+        chunks = iter_batches(label_chunks(iter_chunks(records, pool), manifest))
+        try:
+            with bound(trace):
+                for batch in chunks:
+                    with span("chunk_queue_wait"):
+                        if not put(batches, batch):
+                            break
+        except Exception as e:
+            fail(e)
+        finally:
+            # Closing the record generator early ends its extraction
+            # processes (rag_load.iter_extracted)
+            chunks.close()
+            if hasattr(records, "close"):
+                records.close()
+            for _ in range(EMBED_CONCURRENCY):
+                put(batches, None)
 
-    items = [json.loads(l) for l in open(DATASET_FILE, encoding="utf-8") if l.strip()]
+    def embed():
+        try:
+            with bound(trace):
+                while True:
+                    with span("embed_wait"):
+                        batch = get(batches)
+                    if batch is None:
+                        break
+                    with span("embed"):
+                        item = embed_batch(batch)
+                    if not put(embedded, item):
+                        break
+        except Exception as e:
+            fail(e)
+        finally:
+            put(embedded, None)
 
+    workers = [threading.Thread(target=produce, daemon=True)]
+    workers += [threading.Thread(target=embed, daemon=True) for _ in range(EMBED_CONCURRENCY)]
+    for t in workers:
+        t.start()
+
+    added = skipped = 0
+    finished = 0
+    reported = time.monotonic()
+    try:
+        with tqdm(desc="Embedding", unit="chunk") as bar:
+            while finished < EMBED_CONCURRENCY:
+                with span("index_wait"):
+                    item = get(embedded)
+                if item is None:
+                    if stop.is_set():
+                        break
+                    finished += 1
+                    continue
+
+                batch, vectors = item
+                if batch:
+                    with span("index_add"):
+                        db = add_to_store(db, lexical, batch, vectors)
+                    added += len(batch)
+                bar.update(len(batch))
+
+                if time.monotonic() - reported >= PROGRESS_SECONDS:
+                    reported = time.monotonic()
+                    report(stage="embed", chunks=added)
+    finally:
+        # Also reached when add_to_store raises: release the other stages
+        stop.set()
+        for t in workers:
+            t.join()
+    if errors:
+        raise errors[0]
+
+    # Chunks dropped by the embedder must not stay in the manifest
+    if db is not None:
+        known = set(db.index_to_docstore_id.values())
+        for entry in manifest.values():
+            kept = [i for i in entry["ids"] if i in known]
+            skipped += len(entry["ids"]) - len(kept)
+            entry["ids"] = kept
+
+    count("chunks_added", added)
+    count("chunks_skipped", skipped)
+    report(stage="embed", chunks=added, done=True)
+    return db, added, skipped
+
+# ================= FULL REBUILD =================
+# Every run writes a new version under <partition root>/versions and
+# publishes it only once complete; servers pick it up without a restart
+# (rag_store). A partition's files live in PDF_FOLDER/partitions/<name>
+# and its index in DB_PATH/partitions/<name>; the default one is the
+# top-level folders.
+
+def report_cache():
+    st = embeddings.stats()
+    print(f"🧮 Embedding cache | hits: {st['hits']} | misses: {st['misses']} | hit rate: {st['hit_rate']}")
+
+def finish_version(db, lexical, manifest, root, folder):
+    report(stage="save")
+    with span("save"):
+        lexical.close()
+        save_store(db, folder)
+        save_manifest(manifest, folder)
+    with span("publish"):
+        publish(root, folder)
+        collect_garbage(root)
+
+def extracted(path, recs, seconds):
+    current_trace().add("extract", seconds)
+    count("files_extracted")
+    report(stage="extracted", file=os.path.basename(path), blocks=len(recs))
+    print(f"📄 Extracted {os.path.basename(path)} | {len(recs)} blocks | {seconds:.1f}s")
+
+def rebuild(records, root=DB_PATH):
+    embeddings.reset_stats()
+    folder = new_version_dir(root)
+    lexical = LexicalIndex(os.path.join(folder, LEXICAL_NAME))
+
+    manifest = {}
     with multiprocessing.Pool(min(8, multiprocessing.cpu_count())) as pool:
-        results = list(tqdm(pool.imap(process, items), total=len(items)))
+        db, added, skipped = run_pipeline(None, lexical, records, manifest, pool)
 
-    docs = [d for sub in results for d in sub]
-    if not docs:
+    if db is None:
+        shutil.rmtree(folder, ignore_errors=True)
         raise RuntimeError("No chunks created")
 
-    db = FAISS.from_documents(docs[:500], embeddings)
-    for i in range(500, len(docs), 500):
-        db.add_documents(docs[i:i + 500])
+    # Chunks stream into a flat index; ANN types are trained once at the end
+    if INDEX_TYPE != "flat":
+        with span("convert_index"):
+            convert_store(db, embeddings, INDEX_TYPE)
+
+    finish_version(db, lexical, manifest, root, folder)
+    print(f"✅ FAISS built | {added} chunks | {skipped} skipped | index: {INDEX_TYPE}")
+    report_cache()
+
+def ingest_documents():
+    # Rebuild from the data.txt written by rag_load.load_documents
+    rebuild(iter_dataset())
+
+def ingest_files(files=None, partition=DEFAULT_PARTITION):
+    # Rebuild straight from the source files, no data.txt round trip.
+    # Returns the run's trace summary for the caller to record.
+    with traced("ingest", record=False, partition=partition, mode="full") as trace:
+        files = files or list_files(partition_root(PDF_FOLDER, partition))
+        count("files_changed", len(files))
+        report(stage="start", mode="full", files=len(files))
+
+        def records():
+            for path, recs, seconds, error in iter_extracted(files, on_progress=report_ocr):
+                if error:
+                    count("files_failed")
+                    print(f"❌ {os.path.basename(path)} | {error}")
+                    continue
+                extracted(path, recs, seconds)
+                yield from recs
+
+        rebuild(records(), partition_root(DB_PATH, partition))
+    return trace.summary()
+
+# ================= INCREMENTAL =================
+
+def ingest_incremental(partition=DEFAULT_PARTITION):
+    # Returns the run's trace summary (None if nothing had to change)
+    root = partition_root(DB_PATH, partition)
+    current = current_version_dir(root)
+    manifest = load_manifest(current) if current else {}
+
+    if not manifest:
+        print(f"📦 No manifest found for {partition}, running full rebuild")
+        return ingest_files(partition=partition)
+
+    files = list_files(partition_root(PDF_FOLDER, partition))
+    present = set(files)
+
+    changed = [p for p in files if p not in manifest or not is_unchanged(p, manifest[p])]
+    removed = [p for p in manifest if p not in present]
+
+    if not changed and not removed:
+        # Published versions are never written to, so refreshed mtimes of
+        # touched-but-identical files are not persisted; they are re-hashed
+        # next time until a real change publishes a new manifest
+        print("✅ FAISS up to date | nothing to ingest")
+        return None
+
+    with traced("ingest", record=False, partition=partition, mode="incremental") as trace:
+        count("files_changed", len(changed))
+        count("files_removed", len(removed))
+        report(stage="start", mode="incremental", files=len(changed), removed=len(removed))
+
+        # 🔹 Start the new version from a copy of the live one
+        embeddings.reset_stats()
+        with span("load"):
+            folder = new_version_dir(root)
+            if os.path.exists(os.path.join(current, LEXICAL_NAME)):
+                live = LexicalIndex(os.path.join(current, LEXICAL_NAME), readonly=True)
+                live.copy_to(os.path.join(folder, LEXICAL_NAME))
+                live.close()
+            else:
+                print(f"⚠️ {current} has no lexical index, the new version starts an empty one")
+            lexical = LexicalIndex(os.path.join(folder, LEXICAL_NAME))
+
+            db = FAISS.load_local(current, embeddings, allow_dangerous_deserialization=True)
+            known = set(db.index_to_docstore_id.values())
+
+        # 🔹 Drop vectors of changed / deleted files
+        stale = [i for p in changed + removed for i in manifest.get(p, {}).get("ids", []) if i in known]
+        if stale:
+            with span("remove_stale"):
+                remove_chunks(db, stale, embeddings)
+                lexical.delete(stale)
+            count("chunks_removed", len(stale))
+        for p in removed:
+            del manifest[p]
+
+        # 🔹 Stream only new / changed files through the pipeline
+        def records():
+            for path, recs, seconds, error in iter_extracted(changed, on_progress=report_ocr):
+                if error:
+                    # Dropped from the manifest, so the next run retries it
+                    manifest.pop(path, None)
+                    count("files_failed")
+                    print(f"❌ {os.path.basename(path)} | {error}")
+                    continue
+
+                manifest[path] = manifest_entry(path)
+                extracted(path, recs, seconds)
+                yield from recs
+
+        db, added, skipped = run_pipeline(db, lexical, records(), manifest)
 
-    db.save_local(DB_PATH)
-    print(f"✅ FAISS built | {len(docs)} chunks")
+        finish_version(db, lexical, manifest, root, folder)
+        print(f"✅ FAISS updated | +{added} / -{len(stale)} chunks | {len(removed)} files removed")
+        report_cache()
+    return trace.summary()
@@ -0,0 +1,231 @@
+import os
+import time
+import uuid
+import sqlite3
+import threading
+import multiprocessing
+
+import rag_ingest
+
+# =========================================================
+# CONFIG
+# =========================================================
+INGEST_QUEUE_PATH = os.getenv(
+    "INGEST_QUEUE_PATH",
+    os.path.join(os.getenv("DATASET_STORAGE_FOLDER", "datasets"), "ingest_jobs.sqlite")
+)
+
+# Uploads arriving within this window of each other share one index update
+INGEST_COALESCE_MS = float(os.getenv("INGEST_COALESCE_MS", "500"))
+INGEST_MAX_QUEUED = int(os.getenv("INGEST_MAX_QUEUED", "1000"))
+INGEST_JOB_HISTORY = int(os.getenv("INGEST_JOB_HISTORY", "1000"))
+# Runs of a batch that killed the ingestion process before its jobs fail
+INGEST_MAX_ATTEMPTS = int(os.getenv("INGEST_MAX_ATTEMPTS", "3"))
+
+# Lower runs first
+INTERACTIVE = 0
+BULK = 10
+
+# =========================================================
+# INGESTION JOB QUEUE
+# =========================================================
+# Jobs live in SQLite, so queued work survives a restart (jobs that were
+# running are queued again on open). One job is one file to ingest into
+# a partition, or a bulk re-index of a whole partition (path NULL).
+#
+# The server takes one batch at a time (single writer): the head job by
+# priority / age plus every other queued job of its partition, run as a
+# single incremental update; a bulk batch runs a full rebuild and only
+# once no interactive job is waiting. Enqueueing a file that is already
+# queued returns that job; one that is being processed right now with
+# the same size / mtime returns the running job. A batch whose run took
+# the ingestion process down is queued again, up to INGEST_MAX_ATTEMPTS.
+
+class QueueFull(RuntimeError):
+    pass
+
+def fingerprint(path):
+    try:
+        st = os.stat(path)
+    except (TypeError, OSError):
+        return None
+    return f"{st.st_size}:{st.st_mtime_ns}"
+
+class JobQueue:
+    def __init__(self, path=INGEST_QUEUE_PATH, max_queued=INGEST_MAX_QUEUED, history=INGEST_JOB_HISTORY):
+        self.max_queued = max_queued
+        self.history = history
+        self.lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, partition TEXT, path TEXT, priority INTEGER, "
+            "status TEXT, fingerprint TEXT, batch TEXT, "
+            "created REAL, started REAL, finished REAL, error TEXT, attempts INTEGER DEFAULT 0)"
+        )
+        columns = {r["name"] for r in self.conn.execute("PRAGMA table_info(jobs)")}
+        if "attempts" not in columns:
+            self.conn.execute("ALTER TABLE jobs ADD COLUMN attempts INTEGER DEFAULT 0")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, priority, created)")
+
+        recovered = self.conn.execute(
+            "UPDATE jobs SET status = 'queued', batch = NULL, started = NULL WHERE status = 'running'"
+        ).rowcount
+        self.conn.commit()
+        if recovered:
+            print(f"♻️ Re-queued {recovered} interrupted ingestion jobs")
+
+    def _one(self, sql, *args):
+        row = self.conn.execute(sql, args).fetchone()
+        return dict(row) if row else None
+
+    def enqueue(self, partition, path=None, priority=INTERACTIVE):
+        # Returns (job, created); raises QueueFull
+        fp = fingerprint(path)
+        with self.lock:
+            job = self._one(
+                "SELECT * FROM jobs WHERE status = 'queued' AND partition = ? AND path IS ?",
+                partition, path
+            )
+            if job is not None:
+                if priority < job["priority"]:
+                    self.conn.execute("UPDATE jobs SET priority = ? WHERE id = ?", (priority, job["id"]))
+                    self.conn.commit()
+                    job["priority"] = priority
+                return job, False
+
+            job = self._one(
+                "SELECT * FROM jobs WHERE status = 'running' AND partition = ? AND path IS ? "
+                "AND fingerprint IS ?",
+                partition, path, fp
+            )
+            if job is not None and path is not None:
+                return job, False
+
+            queued = self.conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+            if queued >= self.max_queued:
+                raise QueueFull(f"{queued} ingestion jobs already queued")
+
+            job = {
+                "id": uuid.uuid4().hex, "partition": partition, "path": path,
+                "priority": priority, "status": "queued", "fingerprint": fp, "batch": None,
+                "created": time.time(), "started": None, "finished": None, "error": None,
+                "attempts": 0
+            }
+            self.conn.execute(
+                "INSERT INTO jobs VALUES (:id, :partition, :path, :priority, :status, :fingerprint, "
+                ":batch, :created, :started, :finished, :error, :attempts)", job
+            )
+            self.conn.commit()
+            return job, True
+
+    def next_batch(self):
+        # Claims the next batch: (batch id, partition, "incremental" | "full", jobs) or None
+        with self.lock:
+            head = self._one("SELECT * FROM jobs WHERE status = 'queued' ORDER BY priority, created LIMIT 1")
+            if head is None:
+                return None
+
+            if head["priority"] < BULK:
+                mode = "incremental"
+                rows = self.conn.execute(
+                    "SELECT * FROM jobs WHERE status = 'queued' AND partition = ? AND priority < ?",
+                    (head["partition"], BULK)
+                )
+            else:
+                mode = "full"
+                rows = self.conn.execute(
+                    "SELECT * FROM jobs WHERE status = 'queued' AND partition = ?", (head["partition"],)
+                )
+            jobs = [dict(r) for r in rows]
+
+            batch, now = uuid.uuid4().hex, time.time()
+            self.conn.executemany(
+                "UPDATE jobs SET status = 'running', batch = ?, started = ?, fingerprint = ? WHERE id = ?",
+                [(batch, now, fingerprint(j["path"]), j["id"]) for j in jobs]
+            )
+            self.conn.commit()
+            for j in jobs:
+                j.update(status="running", batch=batch, started=now)
+            return batch, head["partition"], mode, jobs
+
+    def finish(self, batch, error=None):
+        with self.lock:
+            self.conn.execute(
+                "UPDATE jobs SET status = ?, finished = ?, error = ? WHERE batch = ?",
+                ("failed" if error else "done", time.time(), error, batch)
+            )
+            # Keep only the newest finished jobs
+            self.conn.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed') AND id NOT IN ("
+                "SELECT id FROM jobs WHERE status IN ('done', 'failed') ORDER BY finished DESC LIMIT ?)",
+                (self.history,)
+            )
+            self.conn.commit()
+
+    def retry(self, batch, error, max_attempts=INGEST_MAX_ATTEMPTS):
+        # Queues the batch's jobs again (same priority and age, so they are
+        # next); returns False and fails them once out of attempts
+        with self.lock:
+            attempts = self.conn.execute(
+                "SELECT MAX(attempts) FROM jobs WHERE batch = ?", (batch,)
+            ).fetchone()[0] or 0
+            if attempts + 1 >= max_attempts:
+                retried = False
+            else:
+                self.conn.execute(
+                    "UPDATE jobs SET status = 'queued', batch = NULL, started = NULL, "
+                    "attempts = attempts + 1 WHERE batch = ?", (batch,)
+                )
+                self.conn.commit()
+                retried = True
+        if not retried:
+            self.finish(batch, error)
+        return retried
+
+    def get(self, job_id):
+        with self.lock:
+            return self._one("SELECT * FROM jobs WHERE id = ?", job_id)
+
+    def stats(self):
+        with self.lock:
+            rows = self.conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        out = {"queued": 0, "running": 0, "done": 0, "failed": 0}
+        out.update({status: n for status, n in rows})
+        return out
+
+# =========================================================
+# INGESTION PROCESS SIDE
+# =========================================================
+# The server starts the ingestion process with a fresh interpreter
+# (forkserver / spawn) and hands it the queue that carries (batch id,
+# event) back through init_worker. (batch id, None) closes a batch's
+# events: it is queued after all of them, so the server can wait for it
+# before sending the final status.
+#
+# The process would otherwise inherit its own start method, and every
+# extraction worker / OCR or chunking pool it starts would re-import the
+# server's main module; it forks them, as a standalone rag_ingest run does.
+progress_events = None
+
+def init_worker(events):
+    # ProcessPoolExecutor initializer
+    global progress_events
+    progress_events = events
+    if "fork" in multiprocessing.get_all_start_methods():
+        multiprocessing.set_start_method("fork", force=True)
+
+def run_batch(batch, partition, mode):
+    # Runs in the ingestion process; returns the run's trace summary
+    rag_ingest.progress = lambda event: progress_events.put((batch, event))
+    try:
+        if mode == "full":
+            return rag_ingest.ingest_files(partition=partition)
+        return rag_ingest.ingest_incremental(partition)
+    finally:
+        rag_ingest.progress = None
+        progress_events.put((batch, None))
@@ -0,0 +1,119 @@
+import os
+import time
+import threading
+
+# =========================================================
+# LAZY COMPONENTS
+# =========================================================
+# Heavy pieces (index, chat model, reranker, tokenizer, ...) are built on
+# first use instead of at import, so a server can bind its port at once
+# and warm them up in the background. A failed load is reported and
+# retried by the next caller.
+STARTED = time.perf_counter()
+
+# Components loaded in the background at startup; the rest load on demand
+WARMUP_COMPONENTS = [
+    c.strip() for c in os.getenv("WARMUP_COMPONENTS", "index,embedder,llm,tokenizer").split(",")
+    if c.strip()
+]
+
+components = {}
+marks = {}
+marks_lock = threading.Lock()
+
+class LazyComponent:
+    def __init__(self, name, factory):
+        self.name = name
+        self.factory = factory
+        self.lock = threading.Lock()
+        self.value = None
+        self.state = "idle"
+        self.error = None
+        self.load_ms = None
+
+    @property
+    def ready(self):
+        return self.state == "ready"
+
+    def get(self):
+        if self.state == "ready":
+            return self.value
+
+        with self.lock:
+            if self.state != "ready":
+                self.state = "loading"
+                started = time.perf_counter()
+                try:
+                    self.value = self.factory()
+                except Exception as e:
+                    self.state, self.error = "failed", str(e)
+                    print(f"❌ {self.name} failed to load: {e}")
+                    raise
+                self.load_ms = round((time.perf_counter() - started) * 1000)
+                self.state, self.error = "ready", None
+                print(f"✅ {self.name} ready in {self.load_ms} ms")
+        return self.value
+
+    def warm(self):
+        thread = threading.Thread(target=self._warm, name=f"warm-{self.name}", daemon=True)
+        thread.start()
+        return thread
+
+    def _warm(self):
+        try:
+            self.get()
+        except Exception:
+            pass
+
+    def report(self):
+        out = {"state": self.state, "load_ms": self.load_ms}
+        if self.error:
+            out["error"] = self.error
+        return out
+
+def lazy(name, factory) -> LazyComponent:
+    component = components[name] = LazyComponent(name, factory)
+    return component
+
+# =========================================================
+# WARM-UP / STARTUP PROFILE
+# =========================================================
+def mark(name, since=STARTED):
+    # Records ms between `since` and now, first call wins
+    with marks_lock:
+        marks.setdefault(name, round((time.perf_counter() - since) * 1000))
+
+def warm_up(names=None):
+    names = WARMUP_COMPONENTS if names is None else names
+    threads = [components[n].warm() for n in names if n in components]
+
+    def report_when_done():
+        for t in threads:
+            t.join()
+        mark("warmup_done")
+        print_startup_report()
+
+    threading.Thread(target=report_when_done, name="warm-report", daemon=True).start()
+
+def is_ready(names=None):
+    names = WARMUP_COMPONENTS if names is None else names
+    return all(components[n].ready for n in names if n in components)
+
+def startup_report():
+    with marks_lock:
+        profile = dict(marks)
+    return {
+        "ready": is_ready(),
+        "uptime_ms": round((time.perf_counter() - STARTED) * 1000),
+        "profile_ms": profile,
+        "components": {n: c.report() for n, c in components.items()}
+    }
+
+def print_startup_report():
+    report = startup_report()
+    print("⏱️ Startup profile:")
+    for name, ms in report["profile_ms"].items():
+        print(f"   {name:<24} {ms:>8} ms")
+    for name, c in report["components"].items():
+        load = f"{c['load_ms']} ms" if c["load_ms"] is not None else "-"
+        print(f"   [{c['state']:<7}] {name:<14} {load}")
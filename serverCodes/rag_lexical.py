@@ -0,0 +1,145 @@
+import os
+import re
+import sqlite3
+import pathlib
+import threading
+
+# =========================================================
+# LEXICAL (BM25) INDEX
+# =========================================================
+# SQLite FTS5 keeps a persistent inverted index next to index.faiss and
+# ranks with its built-in bm25(). Unlike rank_bm25, which rescans every
+# document per query and has to be rebuilt on change, it supports
+# incremental add/delete and answers in milliseconds at 1M+ chunks.
+#
+# FTS rows use integer rowids; chunk_ids maps them to the same chunk
+# ids the FAISS docstore and the ingest manifest use. A published index
+# version is opened read-only (immutable), so reading it never creates
+# a database or -wal / -shm files in it.
+
+SQLITE_MAX_PARAMS = 500
+
+# '-' and '_' keep part numbers and ticket ids ("AB-123", "TKT_5567") as
+# one token. '.' and '/' split, so sentence punctuation never sticks to a
+# token ("TKT-5567." indexes as "tkt-5567"); query terms are matched as
+# quoted phrases, so "v2.1" or "AB-123/4" still hit their adjacent pieces.
+TOKENIZER = "unicode61 tokenchars '-_'"
+TOKEN_RE = re.compile(r"[\w\-./]+")
+
+class LexicalIndex:
+    def __init__(self, path, readonly=False):
+        self.path = path
+        self.readonly = readonly
+        self.lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+
+    def db(self):
+        # Caller holds self.lock; one connection per process
+        if self._conn is None or self._pid != os.getpid():
+            if self.readonly:
+                uri = pathlib.Path(self.path).absolute().as_uri() + "?mode=ro&immutable=1"
+                self._conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+                self._pid = os.getpid()
+                return self._conn
+
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS chunk_ids ("
+                "rowid INTEGER PRIMARY KEY AUTOINCREMENT, id TEXT UNIQUE)"
+            )
+            conn.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS chunks USING fts5(text, tokenize = \"{TOKENIZER}\")"
+            )
+            conn.commit()
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def add(self, ids, texts):
+        with self.lock:
+            conn = self.db()
+            for chunk_id, text in zip(ids, texts):
+                old = conn.execute("SELECT rowid FROM chunk_ids WHERE id = ?", (chunk_id,)).fetchone()
+                if old:
+                    conn.execute("DELETE FROM chunks WHERE rowid = ?", old)
+                    conn.execute("DELETE FROM chunk_ids WHERE rowid = ?", old)
+                rowid = conn.execute(
+                    "INSERT INTO chunk_ids (id) VALUES (?)", (chunk_id,)
+                ).lastrowid
+                conn.execute("INSERT INTO chunks (rowid, text) VALUES (?, ?)", (rowid, text))
+            conn.commit()
+
+    def delete(self, ids):
+        with self.lock:
+            conn = self.db()
+            for i in range(0, len(ids), SQLITE_MAX_PARAMS):
+                part = ids[i:i + SQLITE_MAX_PARAMS]
+                marks = ",".join("?" * len(part))
+                rowids = [r for (r,) in conn.execute(
+                    f"SELECT rowid FROM chunk_ids WHERE id IN ({marks})", part
+                )]
+                if rowids:
+                    conn.execute(
+                        f"DELETE FROM chunks WHERE rowid IN ({','.join('?' * len(rowids))})",
+                        rowids
+                    )
+                conn.execute(f"DELETE FROM chunk_ids WHERE id IN ({marks})", part)
+            conn.commit()
+
+    def search(self, query, k):
+        # Terms without a word character ("...", "/") tokenize to nothing
+        terms = {t.lower() for t in TOKEN_RE.findall(query) if re.search(r"\w", t)}
+        if not terms:
+            return []
+
+        # OR of quoted terms: no FTS syntax can leak in from user input
+        match = " OR ".join('"' + t.replace('"', '""') + '"' for t in sorted(terms))
+        with self.lock:
+            rows = self.db().execute(
+                "SELECT c.id FROM chunks JOIN chunk_ids c ON c.rowid = chunks.rowid "
+                "WHERE chunks MATCH ? ORDER BY bm25(chunks) LIMIT ?",
+                (match, k)
+            ).fetchall()
+        return [r[0] for r in rows]
+
+    def copy_to(self, path):
+        # Consistent snapshot via the SQLite backup API; a copy of an index
+        # built with an older tokenizer is re-tokenized on the way
+        with self.lock:
+            dst = sqlite3.connect(path)
+            try:
+                self.db().backup(dst)
+                retokenize(dst)
+            finally:
+                dst.close()
+
+    def close(self):
+        with self.lock:
+            if self._conn is not None and self._pid == os.getpid():
+                self._conn.close()
+            self._conn = None
+
+def retokenize(conn):
+    (sql,) = conn.execute("SELECT sql FROM sqlite_master WHERE name = 'chunks'").fetchone()
+    if TOKENIZER in sql:
+        return
+    conn.execute("DROP TABLE IF EXISTS chunks_new")
+    conn.execute(f"CREATE VIRTUAL TABLE chunks_new USING fts5(text, tokenize = \"{TOKENIZER}\")")
+    conn.execute("INSERT INTO chunks_new (rowid, text) SELECT rowid, text FROM chunks")
+    conn.execute("DROP TABLE chunks")
+    conn.execute("ALTER TABLE chunks_new RENAME TO chunks")
+    conn.commit()
+
+# =========================================================
+# RECIPROCAL RANK FUSION
+# =========================================================
+RRF_K = int(os.getenv("RRF_K", "60"))
+
+def rrf_fuse(*rankings, k=RRF_K):
+    scores = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
@@ -1,89 +1,177 @@
-import os, json, glob
+import os, json, glob, time, queue, multiprocessing
 from dotenv import load_dotenv
 from langchain_community.document_loaders import PyPDFLoader, Docx2txtLoader
-from ocr_utils import ocr_pdf
+from ocr_utils import iter_ocr_pages, OCR_WORKERS
+from rag_procs import own_process_group, kill_worker
 
 load_dotenv()
 
-PDF_FOLDER = "/home/nomathematician/Aerothon26/Local-RAG-with-Ollama/pdfs/engineering"
+PDF_FOLDER = os.getenv(
+    "PDF_FOLDER", "/home/nomathematician/Aerothon26/Local-RAG-with-Ollama/pdfs/engineering"
+)
 DATASET_FOLDER = os.getenv("DATASET_STORAGE_FOLDER", "datasets")
 OUTPUT_FILE = os.path.join(DATASET_FOLDER, "data.txt")
 
+# Files are extracted in parallel, one process per file, each with a
+# hard time limit. OCR workers are split between concurrent files.
+LOAD_WORKERS = int(os.getenv("LOAD_WORKERS", str(os.cpu_count() or 1)))
+LOAD_TIMEOUT = float(os.getenv("LOAD_TIMEOUT", "900"))  # seconds per file
+
 os.makedirs(PDF_FOLDER, exist_ok=True)
 os.makedirs(DATASET_FOLDER, exist_ok=True)
 
-def load_documents():
+def list_files(folder=PDF_FOLDER):
+    return (
+        glob.glob(f"{folder}/*.pdf") +
+        glob.glob(f"{folder}/*.txt") +
+        glob.glob(f"{folder}/*.docx")
+    )
+
+def extract_file(path, ocr_workers=OCR_WORKERS, on_page=None):
+    # on_page(n) is called after each OCR'd page with the count so far
+    # ---------------- TXT ----------------
+    if path.endswith(".txt"):
+        text = open(path, encoding="utf-8", errors="ignore").read()
+        if text.count(" ") < 20:
+            return []
+        return [{"source": path, "text": text}]
+
+    # ---------------- DOCX ----------------
+    if path.endswith(".docx"):
+        text = Docx2txtLoader(path).load()[0].page_content
+        if text.count(" ") < 20:
+            return []
+        return [{"source": path, "text": text}]
+
+    # ---------------- PDF ----------------
+    records = []
+    pages = []
+
+    # 🔹 Try normal PDF parsing
+    try:
+        pages = PyPDFLoader(path).load()
+    except Exception as e:
+        print(f"⚠️ PyPDFLoader failed, will try OCR: {os.path.basename(path)} | {e}")
+
+    # 🔹 Use extracted text if available
+    for d in pages:
+        if not d.page_content:
+            continue
+        if d.page_content.count(" ") < 20:
+            continue
+
+        records.append({
+            "source": path,
+            "page": d.metadata.get("page"),
+            "text": d.page_content
+        })
+
+    # 🔹 Fallback to OCR if no usable text
+    if not records:
+        try:
+            for n, p in enumerate(iter_ocr_pages(path, workers=ocr_workers), 1):
+                if on_page is not None:
+                    on_page(n)
+                if p["text"].count(" ") < 20:
+                    continue
+                records.append({
+                    "source": path,
+                    "page": p["page"],
+                    "text": p["text"]
+                })
+            records.sort(key=lambda r: r["page"])
+            print(f"🧠 OCR used for: {os.path.basename(path)} | {len(records)} pages")
+        except Exception as e:
+            print(f"❌ OCR failed: {os.path.basename(path)} | {e}")
+
+    return records
+
+# ---------------- PARALLEL EXTRACTION ----------------
+
+def _extract_worker(path, ocr_workers, out):
+    # Own process group, so a timeout also kills this file's OCR pool
+    own_process_group()
+    started = time.perf_counter()
+    on_page = lambda n: out.put(("page", path, n))
+    try:
+        records = extract_file(path, ocr_workers, on_page)
+        out.put(("done", path, records, time.perf_counter() - started, None))
+    except Exception as e:
+        out.put(("done", path, [], time.perf_counter() - started, str(e)))
+
+def iter_extracted(files, workers=LOAD_WORKERS, timeout=LOAD_TIMEOUT, on_progress=None):
+    # Yields (path, records, seconds, error) as each file finishes;
+    # on_progress(path, pages) reports OCR progress in between. Closing
+    # the generator early kills the files still being extracted.
+    out = multiprocessing.Queue()
+    todo = list(files)
+    running = {}
+    ocr_workers = max(1, OCR_WORKERS // max(1, min(workers, len(todo))))
+
+    try:
+        while todo or running:
+            while todo and len(running) < workers:
+                path = todo.pop(0)
+                proc = multiprocessing.Process(target=_extract_worker, args=(path, ocr_workers, out))
+                proc.start()
+                running[path] = (proc, time.monotonic() + timeout)
+
+            try:
+                kind, path, *result = out.get(timeout=0.5)
+                if kind == "page":
+                    if on_progress is not None and path in running:
+                        on_progress(path, result[0])
+                elif path in running:
+                    records, seconds, error = result
+                    running.pop(path)[0].join()
+                    yield path, records, seconds, error
+            except queue.Empty:
+                pass
+
+            now = time.monotonic()
+            for path, (proc, deadline) in list(running.items()):
+                if now > deadline:
+                    kill_worker(proc)
+                    del running[path]
+                    yield path, [], timeout, f"timed out after {timeout:.0f}s"
+                elif proc.exitcode not in (None, 0):
+                    del running[path]
+                    yield path, [], 0.0, f"worker exited with code {proc.exitcode}"
+    finally:
+        for proc, _ in running.values():
+            kill_worker(proc)
+
+def load_documents(files=None):
     if os.path.exists(OUTPUT_FILE):
         os.remove(OUTPUT_FILE)
 
-    files = (
-        glob.glob(f"{PDF_FOLDER}/*.pdf") +
-        glob.glob(f"{PDF_FOLDER}/*.txt") +
-        glob.glob(f"{PDF_FOLDER}/*.docx")
-    )
+    files = files or list_files()
 
     if not files:
         raise RuntimeError("No files found")
 
     count = 0
-
-    for path in files:
-        # ---------------- TXT ----------------
-        if path.endswith(".txt"):
-            text = open(path, encoding="utf-8", errors="ignore").read()
-            if text.count(" ") < 20:
-                continue
-            records = [{"source": path, "text": text}]
-
-        # ---------------- DOCX ----------------
-        elif path.endswith(".docx"):
-            text = Docx2txtLoader(path).load()[0].page_content
-            if text.count(" ") < 20:
+    failed = 0
+    size = sum(os.path.getsize(p) for p in files)
+    started = time.perf_counter()
+
+    # ---------------- WRITE (single buffered writer) ----------------
+    with open(OUTPUT_FILE, "w", encoding="utf-8", buffering=1 << 20) as f:
+        for path, records, seconds, error in iter_extracted(files):
+            name = os.path.basename(path)
+            if error:
+                failed += 1
+                print(f"❌ {name} | {error}")
                 continue
-            records = [{"source": path, "text": text}]
 
-        # ---------------- PDF ----------------
-        else:
-            records = []
-            pages = []
-
-            # 🔹 Try normal PDF parsing
-            try:
-                pages = PyPDFLoader(path).load()
-            except Exception as e:
-                print(f"⚠️ PyPDFLoader failed, will try OCR: {os.path.basename(path)} | {e}")
-
-            # 🔹 Use extracted text if available
-            for d in pages:
-                if not d.page_content:
-                    continue
-                if d.page_content.count(" ") < 20:
-                    continue
-
-                records.append({
-                    "source": path,
-                    "page": d.metadata.get("page"),
-                    "text": d.page_content
-                })
-
-            # 🔹 Fallback to OCR if no usable text
-            if not records:
-                try:
-                    ocr_text = ocr_pdf(path)
-                    if ocr_text and ocr_text.count(" ") >= 20:
-                        records.append({
-                            "source": path,
-                            "page": None,
-                            "text": ocr_text
-                        })
-                        print(f"🧠 OCR used for: {os.path.basename(path)}")
-                except Exception as e:
-                    print(f"❌ OCR failed: {os.path.basename(path)} | {e}")
-
-        # ---------------- WRITE ----------------
-        for r in records:
-            with open(OUTPUT_FILE, "a", encoding="utf-8") as f:
+            for r in records:
                 f.write(json.dumps(r, ensure_ascii=False) + "\n")
-            count += 1
-
-    print(f"✅ Loaded {count} text blocks")
+            count += len(records)
+            print(f"📄 {name} | {len(records)} blocks | {seconds:.1f}s")
+
+    elapsed = max(time.perf_counter() - started, 1e-9)
+    print(
+        f"✅ Loaded {count} text blocks from {len(files) - failed}/{len(files)} files "
+        f"in {elapsed:.1f}s | {len(files) / elapsed:.2f} files/s | "
+        f"{size / elapsed / 2**20:.2f} MB/s"
+    )
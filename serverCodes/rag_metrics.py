@@ -0,0 +1,277 @@
+import os
+import json
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# =========================================================
+# CONFIG
+# =========================================================
+# Prometheus text endpoint on http://METRICS_HOST:METRICS_PORT/metrics
+# (METRICS_PORT=0 turns it off). Local only by default.
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+
+# One JSON line per finished query / ingestion with all of its spans
+METRICS_LOG = os.getenv("METRICS_LOG", "0") == "1"
+
+SECONDS_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900
+)
+COUNT_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 50000)
+
+# =========================================================
+# HISTOGRAMS
+# =========================================================
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the q-th observation
+        if not self.count:
+            return None
+        rank, seen = q * self.count, 0
+        for bound, n in zip(self.buckets + (float("inf"),), self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "avg": round(self.sum / self.count, 4) if self.count else None,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99)
+        }
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}      # (name, labels) -> Histogram
+        self.counters = {}        # (name, labels) -> float
+        self.collectors = {}      # prefix -> fn returning {name: number}
+
+    def observe(self, name, value, buckets=SECONDS_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = Histogram(buckets)
+            hist.observe(value)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def collect(self, prefix, fn):
+        # fn() is called at scrape time, numeric values become gauges
+        self.collectors[prefix] = fn
+
+    def record(self, summary):
+        # Folds a finished Trace summary (possibly from another process)
+        if not summary:
+            return
+        kind = summary["kind"]
+        self.inc("rag_requests_total", kind=kind, status=summary.get("status", "ok"))
+        for stage, seconds in summary["spans"].items():
+            self.observe("rag_stage_seconds", seconds, kind=kind, stage=stage)
+        for name, value in summary["counts"].items():
+            self.observe(f"rag_{kind}_{name}", value, buckets=COUNT_BUCKETS)
+        if METRICS_LOG:
+            print(json.dumps(summary), flush=True)
+
+    def gauges(self):
+        out = {}
+        for prefix, fn in list(self.collectors.items()):
+            try:
+                values = fn() or {}
+            except Exception:
+                continue
+            for name, value in values.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    out[f"rag_{prefix}_{name}"] = value
+        return out
+
+    def snapshot(self):
+        def key(name, labels):
+            return f"{name}{{{','.join(f'{k}={v}' for k, v in labels)}}}" if labels else name
+
+        with self.lock:
+            histograms = {key(*k): h.summary() for k, h in self.histograms.items()}
+            counters = {key(*k): v for k, v in self.counters.items()}
+        return {"histograms": histograms, "counters": counters, "gauges": self.gauges()}
+
+    def render(self):
+        # Prometheus text exposition format
+        def fmt(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+            return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+        lines, typed = [], set()
+
+        def declare(name, kind):
+            # One TYPE line per metric family, however many label sets
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} {kind}")
+
+        with self.lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                declare(name, "counter")
+                lines.append(f"{name}{fmt(labels)} {value}")
+
+            for (name, labels), h in sorted(self.histograms.items()):
+                declare(name, "histogram")
+                cumulative = 0
+                for bound, n in zip(h.buckets, h.counts):
+                    cumulative += n
+                    lines.append(f"{name}_bucket{fmt(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{name}_bucket{fmt(labels, [('le', '+Inf')])} {h.count}")
+                lines.append(f"{name}_sum{fmt(labels)} {h.sum}")
+                lines.append(f"{name}_count{fmt(labels)} {h.count}")
+
+        for name, value in sorted(self.gauges().items()):
+            declare(name, "gauge")
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+metrics = Registry()
+
+# =========================================================
+# TRACES (per query / per ingestion)
+# =========================================================
+# A Trace collects timing spans and counts for one request. It is bound
+# to the current thread, so helpers deep in the pipeline can add spans
+# via span("stage") without passing it around; worker threads that
+# belong to the same request get it handed over explicitly.
+_local = threading.local()
+
+class Trace:
+    def __init__(self, kind, **attrs):
+        self.kind = kind
+        self.attrs = attrs
+        self.lock = threading.Lock()
+        self.spans = {}
+        self.counts = {}
+        self.status = "ok"
+        self.started = time.perf_counter()
+
+    def add(self, stage, seconds):
+        with self.lock:
+            self.spans[stage] = self.spans.get(stage, 0.0) + seconds
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + value
+
+    @contextmanager
+    def span(self, stage):
+        started = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.add(stage, time.perf_counter() - started)
+
+    def summary(self):
+        with self.lock:
+            spans = dict(self.spans)
+            spans["total"] = time.perf_counter() - self.started
+            return {
+                "kind": self.kind,
+                "status": self.status,
+                "attrs": self.attrs,
+                "spans": {k: round(v, 4) for k, v in spans.items()},
+                "counts": dict(self.counts)
+            }
+
+class NullTrace(Trace):
+    # Stand-in when no request is being traced
+    def add(self, stage, seconds):
+        pass
+
+    def count(self, name, value=1):
+        pass
+
+NULL_TRACE = NullTrace("none")
+
+def current_trace() -> Trace:
+    return getattr(_local, "trace", None) or NULL_TRACE
+
+def span(stage):
+    return current_trace().span(stage)
+
+def count(name, value=1):
+    current_trace().count(name, value)
+
+@contextmanager
+def traced(kind, record=True, **attrs):
+    # Binds a new Trace to this thread; on exit it is recorded into the
+    # local registry (record=False leaves that to the caller, e.g. when
+    # the summary is shipped back from the ingestion process)
+    trace = Trace(kind, **attrs)
+    previous = getattr(_local, "trace", None)
+    _local.trace = trace
+    try:
+        yield trace
+    except BaseException as e:
+        trace.status = "cancelled" if isinstance(e, GeneratorExit) else "error"
+        raise
+    finally:
+        _local.trace = previous
+        if record:
+            metrics.record(trace.summary())
+
+@contextmanager
+def bound(trace):
+    # Runs a worker thread's code under a trace owned by another thread
+    previous = getattr(_local, "trace", None)
+    _local.trace = trace
+    try:
+        yield trace
+    finally:
+        _local.trace = previous
+
+# =========================================================
+# HTTP ENDPOINT
+# =========================================================
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] == "/metrics":
+            body, ctype = metrics.render().encode(), "text/plain; version=0.0.4"
+        elif self.path.split("?")[0] == "/stats":
+            body, ctype = json.dumps(metrics.snapshot()).encode(), "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def serve_metrics(host=METRICS_HOST, port=METRICS_PORT):
+    if not port:
+        return None
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    print(f"📈 Metrics on http://{host}:{port}/metrics")
+    return server
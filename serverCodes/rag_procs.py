@@ -0,0 +1,34 @@
+import os
+import signal
+
+# =========================================================
+# WORKER PROCESS GROUPS
+# =========================================================
+# A file's extraction worker puts itself in its own process group, so
+# killing the group on a timeout also takes its OCR pool down. A worker
+# killed before its setpgrp() ran has no group yet: it (and the pool it
+# can't have started) is killed directly. Windows has no process groups,
+# there just the worker is killed. Shared by serverCodes/rag_load.py and
+# Local-RAG-with-Ollama/1_loading_pdfs.py.
+
+KILL_JOIN_SECONDS = float(os.getenv("KILL_JOIN_SECONDS", "5"))
+
+def own_process_group():
+    # First thing a worker does
+    if hasattr(os, "setpgrp"):
+        os.setpgrp()
+
+def kill_worker(proc, timeout=KILL_JOIN_SECONDS):
+    killed = False
+    if hasattr(os, "killpg"):
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+            killed = True
+        except ProcessLookupError:
+            pass
+    if not killed:
+        proc.kill()
+
+    proc.join(timeout)
+    if proc.is_alive():
+        print(f"⚠️ Worker {proc.pid} still alive {timeout}s after SIGKILL")
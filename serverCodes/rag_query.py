@@ -11,13 +11,24 @@ os.environ["HF_DATASETS_OFFLINE"] = "1"
 # IMPORTS
 # =========================================================
 import re
+import time
+IMPORT_STARTED = time.perf_counter()
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
-from langchain_community.vectorstores import FAISS
 from langchain_ollama import OllamaEmbeddings
-from langchain.chat_models import init_chat_model
-from langchain_core.messages import AIMessage, HumanMessage
-from sentence_transformers import CrossEncoder
+
+from rag_session import Conversation, sessions
+from embedding_cache import CachedEmbeddings
+from query_embedding import BatchedQueryEmbeddings
+from rag_lexical import rrf_fuse
+from rag_store import DEFAULT_PARTITION, PartitionRegistry
+from rag_answer_cache import answers, normalize
+from rag_rerank import Reranker
+from rag_context import build_context
+from rag_lazy import lazy, mark
+from rag_metrics import metrics, traced, span, count
 
 # =========================================================
 # ENV
@@ -27,40 +38,65 @@ load_dotenv()
 # =========================================================
 # VECTOR STORE
 # =========================================================
-embeddings = OllamaEmbeddings(
-    model=os.getenv("EMBEDDING_MODEL")
-)
-
-db = FAISS.load_local(
-    os.getenv("DATABASE_LOCATION"),
-    embeddings,
-    allow_dangerous_deserialization=True
-)
+# Query vectors: in-memory LRU + micro-batched calls across sessions,
+# on top of the on-disk embedding cache
+embeddings = BatchedQueryEmbeddings(CachedEmbeddings(
+    OllamaEmbeddings(model=os.getenv("EMBEDDING_MODEL")),
+    os.getenv("EMBEDDING_MODEL")
+))
+
+# Live index version per partition: memory-mapped FAISS index + chunk store
+# (INDEX_MMAP=0 falls back to the pickled docstore), tuned with IVF_NPROBE /
+# HNSW_EF_SEARCH, and the BM25 side of hybrid search. Loaded on first use,
+# swapped in place after each ingestion.
+partitions = PartitionRegistry(os.getenv("DATABASE_LOCATION", "faiss_db"), embeddings)
+
+# Everything heavy below is built on first use or by the server's
+# background warm-up (rag_lazy), never at import time. Queries on the
+# default partition go through `index`, and the registry shares one load
+# per partition, so a query never loads an index warm-up is loading.
+index = lazy("index", lambda: partitions.get(DEFAULT_PARTITION))
+
+def warm_embedder():
+    # One tiny request makes Ollama load the embedding model before the first user
+    embeddings.embed_query("warm up")
+    return embeddings
+
+embedder = lazy("embedder", warm_embedder)
+
+# Document filters over-fetch this many candidates per requested result
+FILTER_FETCH_FACTOR = int(os.getenv("FILTER_FETCH_FACTOR", "8"))
 
 # =========================================================
 # RERANKER (OFFLINE SAFE)
 # =========================================================
-reranker = CrossEncoder(
-    "/home/nomathematician/Aerothon26/models/ms-marco-MiniLM-L-6-v2",
-    device="cuda",           # change to "cuda" if needed
-    local_files_only=True
-)
+# Device picked automatically (RERANK_DEVICE), ONNX on CPU; pairs from
+# concurrent queries share forward passes and scores are cached
+# Only loaded when a query first needs reranking
+reranker = lazy("reranker", Reranker)
 
 # =========================================================
 # LLM (OLLAMA – OFFLINE SAFE)
 # =========================================================
-llm = init_chat_model(
-    os.getenv("CHAT_MODEL"),
-    model_provider=os.getenv("MODEL_PROVIDER"),
-    temperature=0.0
-)
+def make_llm():
+    from langchain.chat_models import init_chat_model
+    return init_chat_model(
+        os.getenv("CHAT_MODEL"),
+        model_provider=os.getenv("MODEL_PROVIDER"),
+        temperature=0.0
+    )
+
+llm = lazy("llm", make_llm)
 
 # =========================================================
-# CHAT STATE
+# METRICS
 # =========================================================
-messages = [
-    AIMessage("Ask questions strictly based on the uploaded document.")
-]
+# Cache and pipeline counters, read at scrape / stats time
+metrics.collect("answer_cache", answers.stats)
+metrics.collect("query_embedding", embeddings.stats)
+metrics.collect("embedding_cache", embeddings.underlying.stats)
+metrics.collect("rerank", lambda: reranker.get().stats() if reranker.ready else {})
+metrics.collect("rewrite", lambda: rewrite_stats())
 
 # =========================================================
 # GIBBERISH DETECTION
@@ -90,22 +126,71 @@ def is_gibberish(text: str) -> bool:
 # =========================================================
 # FOLLOW-UP HANDLING
 # =========================================================
+# Follow-ups are resolved locally first; the LLM rewrite only runs when
+# the question leans on something it does not name itself.
+FOLLOWUP_PREFIXES = (
+    "and", "then", "what about", "how about", "make it", "also", "same", "so"
+)
+FOLLOWUP_WORDS = {
+    "it", "its", "he", "him", "his", "she", "her", "hers", "they", "them",
+    "their", "theirs", "this", "that", "these", "those", "there", "same",
+    "one", "ones", "former", "latter", "above", "previous", "more", "else"
+}
+STOPWORDS = {
+    "a", "an", "the", "is", "are", "was", "were", "be", "what", "which",
+    "who", "whom", "when", "where", "why", "how", "do", "does", "did", "of",
+    "for", "to", "in", "on", "at", "by", "with", "about", "and", "or",
+    "can", "could", "please", "tell", "me", "give", "show", "any", "all"
+}
+
 def needs_rewrite(q: str) -> bool:
+    # Cheap first pass: could this question depend on the previous one?
     return (
         len(q.split()) <= 4 or
         q.lower().startswith(("and", "then", "what about", "make it"))
     )
 
-def rewrite_query_with_history(question: str):
-    user_questions = [
-        m.content for m in messages
-        if isinstance(m, HumanMessage)
-    ]
+def is_followup(q: str) -> bool:
+    # Second pass: a short question naming its own subject ("baggage
+    # allowance", "flight number") is standalone; one with pronouns,
+    # connectors or no content words ("why?", "and her seat") is not.
+    text = q.lower().strip()
+    if re.match(r"^(%s)\b" % "|".join(map(re.escape, FOLLOWUP_PREFIXES)), text):
+        return True
 
-    if not user_questions:
-        return question
+    words = re.findall(r"[a-z0-9']+", text)
+    if any(w in FOLLOWUP_WORDS for w in words):
+        return True
 
-    previous_question = user_questions[-1]
+    content = [w for w in words if w not in STOPWORDS and len(w) >= 3]
+    return not content
+
+REWRITE_KINDS = ("standalone", "local", "cached", "llm")
+rewrite_lock = threading.Lock()
+rewrite_counts = dict.fromkeys(REWRITE_KINDS, 0)
+rewrite_pool = ThreadPoolExecutor(
+    max_workers=int(os.getenv("REWRITE_WORKERS", "4")),
+    thread_name_prefix="rewrite"
+)
+
+def count_rewrite(kind):
+    with rewrite_lock:
+        rewrite_counts[kind] += 1
+    metrics.inc("rag_rewrite_total", kind=kind)
+
+def rewrite_stats():
+    # "local" = needs_rewrite fired but the heuristic avoided the LLM
+    with rewrite_lock:
+        stats = dict(rewrite_counts)
+    considered = stats["local"] + stats["cached"] + stats["llm"]
+    stats["llm_avoided_rate"] = (
+        round((stats["local"] + stats["cached"]) / considered, 3) if considered else 0.0
+    )
+    return stats
+
+def rewrite_query_with_history(question: str, previous_question: str):
+    if not previous_question:
+        return question
 
     prompt = f"""
 Rewrite the CURRENT QUESTION so it is fully self-contained.
@@ -125,7 +210,7 @@ CURRENT QUESTION:
 REWRITTEN QUESTION:
 """
 
-    rewritten = llm.invoke(prompt).content.strip()
+    rewritten = llm.get().invoke(prompt).content.strip()
     return rewritten if rewritten else question
 
 # =========================================================
@@ -141,55 +226,145 @@ def needs_rerank(query: str) -> bool:
 # =========================================================
 # RETRIEVAL
 # =========================================================
-def retrieve(query: str):
+class Scope:
+    # What one query searches: a partition's live index version, captured
+    # once so a reload mid-query can't mix indexes, optionally narrowed
+    # to some of its documents (file names)
+    def __init__(self, partition=DEFAULT_PARTITION, sources=None):
+        self.partition = partition
+        self.sources = frozenset(os.path.basename(s) for s in sources) if sources else None
+        if partition == DEFAULT_PARTITION:
+            # Waits for the warm-up's load instead of starting another
+            index.get()
+        self.version = partitions.current(partition)
+
+    def cache_key(self, role):
+        return (role, self.partition, tuple(sorted(self.sources or ())))
+
+    def version_key(self):
+        return self.version.folder if self.version else None
+
+    def allows(self, metadata):
+        return os.path.basename(metadata.get("source", "")) in self.sources
+
+def chunk_source(chunk_id):
+    # Ingest ids are "<file name>:<hash12>:<i>"
+    return chunk_id.rsplit(":", 2)[0]
+
+def hybrid_search(query: str, k: int, scope=None):
+    # Dense and BM25 rankings fused with reciprocal-rank fusion, so exact
+    # part numbers / ids / names surface even when embeddings miss them
+    scope = scope or Scope()
+    if scope.version is None:
+        print(f"⚠️ No index published for partition {scope.partition}")
+        return []
+    db, lexical = scope.version.db, scope.version.lexical
+
+    with span("embed"):
+        vector = embeddings.embed_query(query)
+
+    with span("dense_search"):
+        if scope.sources:
+            fetch_k = k * FILTER_FETCH_FACTOR
+            dense = db.similarity_search_by_vector(vector, k=k, filter=scope.allows, fetch_k=fetch_k)
+        else:
+            fetch_k = k
+            dense = db.similarity_search_by_vector(vector, k=k)
+    by_id = {d.id or d.page_content: d for d in dense}
+
+    try:
+        lexical_ids = []
+        if lexical is not None:
+            with span("lexical_search"):
+                lexical_ids = lexical.search(query, fetch_k)
+        if scope.sources:
+            lexical_ids = [i for i in lexical_ids if chunk_source(i) in scope.sources][:k]
+    except Exception as e:
+        print(f"⚠️ Lexical search unavailable: {e}")
+        lexical_ids = []
+
+    for i in lexical_ids:
+        if i not in by_id:
+            doc = db.docstore.search(i)
+            if not isinstance(doc, str):   # docstore returns a message if missing
+                by_id[i] = doc
+
+    fused = rrf_fuse(
+        [d.id or d.page_content for d in dense],
+        [i for i in lexical_ids if i in by_id]
+    )
+    count("candidates", min(len(fused), k))
+    return [by_id[i] for i in fused[:k]]
+
+def retrieve(query: str, scope=None):
     dense_k = 25 if len(query.split()) >= 5 else 35
-    dense = db.similarity_search(query, k=dense_k)
+    dense = hybrid_search(query, k=dense_k, scope=scope)
 
     if not needs_rerank(query) or len(query.split()) < 6:
         return dense[:8]
 
-    dense = dense[:15]
-    pairs = [[query, d.page_content] for d in dense]
-    scores = reranker.predict(pairs)
-
-    ranked = sorted(zip(scores, dense), key=lambda x: x[0], reverse=True)
-    return [d for _, d in ranked[:8]]
+    with span("rerank"):
+        count("reranked", len(dense[:15]))
+        return reranker.get().rerank(query, dense[:15], top_k=8)
 
 # =========================================================
-# MAIN QUERY HANDLER
+# PROMPT
 # =========================================================
-def answer_query(question: str, role="engineer", history=None) -> str:
-    if history is None:
-        history = []
-
-    messages.clear()
-    messages.append(AIMessage("Ask questions strictly based on the uploaded document."))
+INVALID_QUESTION = "Invalid or unclear question. Please rephrase."
 
-    for h in history:
-        messages.append(HumanMessage(h["question"]))
-        messages.append(AIMessage(h["answer"]))
-
-    if is_gibberish(question):
-        return "Invalid or unclear question. Please rephrase."
-
-    messages.append(HumanMessage(question))
-
-    safe_question = (
-        rewrite_query_with_history(question)
-        if needs_rewrite(question)
-        else question
+def get_conversation(history=None, session_id=None) -> Conversation:
+    # History lives in a per-session Conversation; `history` only seeds
+    # a session the store has not seen (or evicted) yet.
+    return (
+        sessions.get(session_id, history)
+        if session_id is not None
+        else Conversation.from_history(history)
     )
 
-    docs = retrieve(safe_question)
-
-    context = ""
-    for d in docs:
-        src = os.path.basename(d.metadata.get("source", ""))
-        page = d.metadata.get("page")
-        context += (
-            f"[{src} | Page {page + 1 if page is not None else '?'}]\n"
-            f"{d.page_content}\n\n"
-        )
+def resolve_question(question: str, conversation: Conversation, scope=None):
+    # Returns (standalone question, docs or None). When the LLM rewrite is
+    # needed, retrieval on the raw question runs alongside it and is
+    # reused if the rewrite comes back unchanged.
+    previous = conversation.last_question()
+
+    if not previous or not needs_rewrite(question):
+        count_rewrite("standalone")
+        return question, None
+
+    if not is_followup(question):
+        count_rewrite("local")
+        return question, None
+
+    cached = conversation.cached_rewrite(previous, question)
+    if cached is not None:
+        count_rewrite("cached")
+        return cached, None
+
+    count_rewrite("llm")
+    rewrite = rewrite_pool.submit(rewrite_query_with_history, question, previous)
+    try:
+        speculative = retrieve(question, scope)
+    except Exception as e:
+        print(f"⚠️ Speculative retrieval failed: {e}")
+        speculative = None
+
+    with span("rewrite_wait"):
+        safe_question = rewrite.result()
+    conversation.remember_rewrite(previous, question, safe_question)
+
+    if normalize(safe_question) == normalize(question):
+        return safe_question, speculative
+    return safe_question, None
+
+def build_prompt(question: str, safe_question: str, scope=None, docs=None):
+    if docs is None:
+        docs = retrieve(safe_question, scope)
+
+    # Neighbouring chunks stitched, repeats dropped, packed to CONTEXT_TOKEN_BUDGET
+    with span("context"):
+        context, citations, tokens = build_context(docs)
+    count("context_chunks", len(docs))
+    count("prompt_tokens", tokens)
 
     prompt = f"""
 You must answer strictly from the document excerpts.
@@ -202,6 +377,137 @@ QUESTION:
 
 ANSWER:
 """
+    return prompt, citations
 
-    response = llm.invoke(prompt)
-    return response.content.strip()
+# =========================================================
+# ANSWER CACHE
+# =========================================================
+def lookup_answer(safe_question: str, role, scope):
+    # Exact match first; the query embedding (served from the embedding
+    # cache on repeats) is only computed for the near-duplicate tier
+    with span("answer_cache"):
+        entry, tier, vector = _lookup_answer(safe_question, role, scope)
+    metrics.inc("rag_answer_cache_total", result=tier or "miss")
+    return entry, tier, vector
+
+def _lookup_answer(safe_question: str, role, scope):
+    def vector_fn():
+        try:
+            return embeddings.embed_query(safe_question)
+        except Exception as e:
+            print(f"⚠️ Answer cache lookup skipped: {e}")
+            return None
+
+    return answers.get(safe_question, scope.cache_key(role), scope.version_key(), vector_fn)
+
+def cache_hit(entry, tier, started):
+    answers.record_saving(entry, time.perf_counter() - started)
+    st = answers.stats()
+    print(f"⚡ Answer cache {tier} hit | hit rate: {st['hit_rate']} | saved: {st['saved_ms']} ms", flush=True)
+
+# =========================================================
+# MAIN QUERY HANDLER
+# =========================================================
+def answer_query(question: str, role="engineer", history=None, session_id=None,
+                 partition=DEFAULT_PARTITION, sources=None) -> str:
+    with traced("query", partition=partition, streaming=False):
+        begun = time.perf_counter()
+        conversation = get_conversation(history, session_id)
+
+        if is_gibberish(question):
+            return INVALID_QUESTION
+
+        scope = Scope(partition, sources)
+        with span("resolve"):
+            safe_question, docs = resolve_question(question, conversation, scope)
+
+        started = time.perf_counter()
+        entry, tier, vector = lookup_answer(safe_question, role, scope)
+        if entry is not None:
+            cache_hit(entry, tier, started)
+            conversation.add_turn(question, entry.answer)
+            return entry.answer
+
+        prompt, citations = build_prompt(question, safe_question, scope, docs)
+
+        with span("llm"):
+            answer = llm.get().invoke(prompt).content.strip()
+        conversation.add_turn(question, answer)
+        answers.put(safe_question, scope.cache_key(role), scope.version_key(), answer, citations,
+                    vector, time.perf_counter() - started)
+        mark("first_query", begun)
+        return answer
+
+# =========================================================
+# STREAMING QUERY HANDLER
+# =========================================================
+# Yields ("delta", text) while the model generates, then exactly one of
+# ("done", {...}) or ("cancelled", {...}). Setting `cancel` (a
+# threading.Event) closes the model stream, which drops the HTTP
+# connection to Ollama so it stops generating.
+def stream_answer(question: str, role="engineer", history=None, session_id=None, cancel=None,
+                  partition=DEFAULT_PARTITION, sources=None):
+    with traced("query", partition=partition, streaming=True) as trace:
+        started = time.perf_counter()
+        conversation = get_conversation(history, session_id)
+
+        if is_gibberish(question):
+            yield "done", {"answer": INVALID_QUESTION, "citations": [], "timing": {}}
+            return
+
+        scope = Scope(partition, sources)
+        with span("resolve"):
+            safe_question, docs = resolve_question(question, conversation, scope)
+
+        resolved = time.perf_counter()
+        entry, tier, vector = lookup_answer(safe_question, role, scope)
+        if entry is not None:
+            cache_hit(entry, tier, resolved)
+            conversation.add_turn(question, entry.answer)
+            yield "delta", entry.answer
+            elapsed = round((time.perf_counter() - started) * 1000)
+            timing = {"retrieval_ms": 0, "first_token_ms": elapsed, "total_ms": elapsed}
+            yield "done", {"answer": entry.answer, "citations": entry.citations, "timing": timing, "cached": tier}
+            return
+
+        prompt, citations = build_prompt(question, safe_question, scope, docs)
+        retrieved = time.perf_counter()
+
+        parts = []
+        first_token = None
+        stream = llm.get().stream(prompt)
+        try:
+            for chunk in stream:
+                if cancel is not None and cancel.is_set():
+                    break
+                if not chunk.content:
+                    continue
+                if first_token is None:
+                    first_token = time.perf_counter()
+                parts.append(chunk.content)
+                yield "delta", chunk.content
+        finally:
+            stream.close()
+
+        finished = time.perf_counter()
+        trace.add("llm", finished - retrieved)
+        trace.add("first_token", (first_token or finished) - retrieved)
+        timing = {
+            "retrieval_ms": round((retrieved - started) * 1000),
+            "first_token_ms": round(((first_token or finished) - started) * 1000),
+            "total_ms": round((finished - started) * 1000)
+        }
+
+        if cancel is not None and cancel.is_set():
+            trace.status = "cancelled"
+            yield "cancelled", {"timing": timing}
+            return
+
+        answer = "".join(parts).strip()
+        conversation.add_turn(question, answer)
+        answers.put(safe_question, scope.cache_key(role), scope.version_key(), answer, citations,
+                    vector, finished - resolved)
+        mark("first_query", started)
+        yield "done", {"answer": answer, "citations": citations, "timing": timing}
+
+mark("rag_query_import", IMPORT_STARTED)
@@ -0,0 +1,206 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+# =========================================================
+# CONFIG
+# =========================================================
+RERANK_MODEL = os.getenv(
+    "RERANK_MODEL",
+    "/home/nomathematician/Aerothon26/models/ms-marco-MiniLM-L-6-v2"
+)
+
+# auto | cuda | mps | cpu
+RERANK_DEVICE = os.getenv("RERANK_DEVICE", "auto")
+
+# auto (ONNX on CPU when available) | onnx | torch
+RERANK_BACKEND = os.getenv("RERANK_BACKEND", "auto")
+
+# ONNX file inside the model folder; the int8 export is preferred if present
+RERANK_ONNX_FILE = os.getenv("RERANK_ONNX_FILE", "")
+ONNX_CANDIDATES = [
+    "onnx/model_qint8_avx512_vnni.onnx",
+    "onnx/model_qint8_avx512.onnx",
+    "onnx/model_qint8_avx2.onnx",
+    "onnx/model_quint8_avx2.onnx",
+    "onnx/model.onnx",
+]
+
+RERANK_WINDOW_MS = float(os.getenv("RERANK_WINDOW_MS", "5"))
+RERANK_MAX_PAIRS = int(os.getenv("RERANK_MAX_PAIRS", "128"))
+RERANK_CACHE = int(os.getenv("RERANK_CACHE", "20000"))
+
+# =========================================================
+# MODEL LOADING
+# =========================================================
+def detect_device():
+    if RERANK_DEVICE != "auto":
+        return RERANK_DEVICE
+    try:
+        import torch
+        if torch.cuda.is_available():
+            return "cuda"
+        if getattr(torch.backends, "mps", None) and torch.backends.mps.is_available():
+            return "mps"
+    except ImportError:
+        pass
+    return "cpu"
+
+def onnx_file(model_path):
+    if RERANK_ONNX_FILE:
+        return RERANK_ONNX_FILE
+    for name in ONNX_CANDIDATES:
+        if os.path.exists(os.path.join(model_path, name)):
+            return name
+    return None
+
+def load_cross_encoder(model_path=RERANK_MODEL):
+    # Returns (model, description). GPU runs torch; CPU tries the ONNX
+    # backend (needs sentence-transformers>=4.1 + optimum[onnxruntime])
+    # and falls back to torch if it is missing.
+    from sentence_transformers import CrossEncoder
+
+    device = detect_device()
+    backend = RERANK_BACKEND
+    if backend == "auto":
+        backend = "onnx" if device == "cpu" else "torch"
+
+    if backend == "onnx":
+        file_name = onnx_file(model_path)
+        try:
+            model = CrossEncoder(
+                model_path,
+                device=device,
+                backend="onnx",
+                model_kwargs={"file_name": file_name} if file_name else {},
+                local_files_only=True
+            )
+            return model, f"{device} / onnx ({file_name or 'exported'})"
+        except Exception as e:
+            print(f"⚠️ ONNX reranker unavailable, using torch: {e}")
+
+    model = CrossEncoder(model_path, device=device, local_files_only=True)
+    return model, f"{device} / torch"
+
+# =========================================================
+# RERANKING SERVICE
+# =========================================================
+# Scores (query, chunk) pairs for every session through one model:
+#   - score cache keyed by (query, chunk id), so repeated questions and
+#     overlapping candidate lists skip the forward pass
+#   - uncached pairs from concurrent queries are pooled for up to
+#     RERANK_WINDOW_MS and scored in a single predict() call
+class Reranker:
+    def __init__(self, model=None, window_ms=RERANK_WINDOW_MS,
+                 max_pairs=RERANK_MAX_PAIRS, cache_size=RERANK_CACHE):
+        if model is None:
+            started = time.perf_counter()
+            model, desc = load_cross_encoder()
+            print(f"🎯 Reranker on {desc} (loaded in {time.perf_counter() - started:.1f}s)")
+        self.model = model
+        self.window = window_ms / 1000
+        self.max_pairs = max_pairs
+        self.cache_size = cache_size
+
+        self.lock = threading.Lock()
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.batches = 0
+        self.scored = 0
+
+        self.cond = threading.Condition()
+        self.pending = OrderedDict()      # (query, chunk id) -> (pair, Future)
+        self._worker = None
+
+    @staticmethod
+    def chunk_key(doc):
+        if doc.id:
+            return doc.id
+        return hashlib.sha1(doc.page_content.encode("utf-8")).hexdigest()
+
+    def score(self, query, docs):
+        keys = [(query, self.chunk_key(d)) for d in docs]
+        scores = [None] * len(docs)
+
+        with self.lock:
+            for i, k in enumerate(keys):
+                s = self.cache.get(k)
+                if s is not None:
+                    self.cache.move_to_end(k)
+                    scores[i] = s
+            missing = [i for i, s in enumerate(scores) if s is None]
+            self.hits += len(docs) - len(missing)
+            self.misses += len(missing)
+
+        futures = [(i, self.submit(keys[i], [query, docs[i].page_content])) for i in missing]
+        for i, future in futures:
+            scores[i] = future.result()
+
+        with self.lock:
+            for i, _ in futures:
+                self.cache[keys[i]] = scores[i]
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return scores
+
+    def rerank(self, query, docs, top_k):
+        scores = self.score(query, docs)
+        ranked = sorted(zip(scores, docs), key=lambda x: x[0], reverse=True)
+        return [d for _, d in ranked[:top_k]]
+
+    def submit(self, key, pair) -> Future:
+        # Identical pairs in flight share one slot
+        with self.cond:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self.run, name="rerank", daemon=True)
+                self._worker.start()
+            if key not in self.pending:
+                self.pending[key] = (pair, Future())
+                self.cond.notify()
+            return self.pending[key][1]
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.pending:
+                    self.cond.wait()
+
+                # Let concurrent queries add their pairs to this pass
+                deadline = time.monotonic() + self.window
+                while len(self.pending) < self.max_pairs:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.cond.wait(remaining)
+
+                batch = []
+                while self.pending and len(batch) < self.max_pairs:
+                    batch.append(self.pending.popitem(last=False)[1])
+
+            try:
+                scores = self.model.predict([p for p, _ in batch], batch_size=len(batch))
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            with self.lock:
+                self.batches += 1
+                self.scored += len(batch)
+            for (_, future), s in zip(batch, scores):
+                future.set_result(float(s))
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0,
+                "batches": self.batches,
+                "avg_batch": round(self.scored / self.batches, 2) if self.batches else 0.0
+            }
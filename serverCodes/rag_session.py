@@ -0,0 +1,95 @@
+import os
+import threading
+from collections import OrderedDict
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+# =========================================================
+# CONFIG
+# =========================================================
+MAX_SESSIONS = int(os.getenv("MAX_SESSIONS", "256"))
+MAX_TURNS = int(os.getenv("MAX_SESSION_TURNS", "20"))
+
+GREETING = "Ask questions strictly based on the uploaded document."
+
+# =========================================================
+# CONVERSATION
+# =========================================================
+class Conversation:
+    def __init__(self, max_turns=MAX_TURNS):
+        self.max_turns = max_turns
+        self.lock = threading.Lock()
+        self.messages = [AIMessage(GREETING)]
+        # (previous question, question) -> rewritten standalone question
+        self.rewrites = OrderedDict()
+
+    @classmethod
+    def from_history(cls, history):
+        conv = cls()
+        for h in history or []:
+            conv.add_turn(h["question"], h["answer"])
+        return conv
+
+    def add_turn(self, question, answer):
+        # Question and answer go in together, once the answer is complete:
+        # a cancelled or failed query leaves no unanswered question behind
+        # for the next follow-up rewrite
+        with self.lock:
+            self.messages.append(HumanMessage(question))
+            self.messages.append(AIMessage(answer))
+            self._trim()
+
+    def last_question(self):
+        with self.lock:
+            for m in reversed(self.messages):
+                if isinstance(m, HumanMessage):
+                    return m.content
+        return None
+
+    def cached_rewrite(self, previous, question):
+        with self.lock:
+            return self.rewrites.get((previous, question))
+
+    def remember_rewrite(self, previous, question, rewritten):
+        with self.lock:
+            self.rewrites[(previous, question)] = rewritten
+            while len(self.rewrites) > self.max_turns:
+                self.rewrites.popitem(last=False)
+
+    def _trim(self):
+        # Keep the greeting plus the last max_turns question/answer pairs
+        limit = 1 + 2 * self.max_turns
+        if len(self.messages) > limit:
+            del self.messages[1:len(self.messages) - limit + 1]
+
+# =========================================================
+# SESSION STORE (LRU)
+# =========================================================
+class SessionStore:
+    def __init__(self, max_sessions=MAX_SESSIONS):
+        self.max_sessions = max_sessions
+        self.lock = threading.Lock()
+        self.sessions = OrderedDict()
+
+    def get(self, session_id, history=None):
+        with self.lock:
+            conv = self.sessions.get(session_id)
+            if conv is not None:
+                self.sessions.move_to_end(session_id)
+                return conv
+
+            conv = Conversation.from_history(history)
+            self.sessions[session_id] = conv
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+            return conv
+
+    def drop(self, session_id):
+        with self.lock:
+            self.sessions.pop(session_id, None)
+
+    def __len__(self):
+        with self.lock:
+            return len(self.sessions)
+
+sessions = SessionStore()
@@ -0,0 +1,220 @@
+import os
+import re
+import time
+import shutil
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from rag_chunkstore import load_store
+from rag_index import tune_index
+from rag_lexical import LexicalIndex
+
+# =========================================================
+# VERSIONED INDEX LAYOUT
+# =========================================================
+#   faiss_db/CURRENT             name of the live version ("v000012")
+#   faiss_db/versions/v000012/   index.faiss, chunks.*, index.pkl,
+#                                lexical.sqlite, manifest.json
+#
+# Ingestion always writes a fresh version directory and then flips
+# CURRENT with an atomic rename. Readers load the new version in the
+# background and swap one reference; a query holds on to the version it
+# started with, so it finishes on the old files. A pre-versioning
+# faiss_db (index.faiss at the top level) is read as the current one.
+
+VERSIONS_DIR = "versions"
+CURRENT_FILE = "CURRENT"
+KEEP_VERSIONS = int(os.getenv("INDEX_KEEP_VERSIONS", "2"))
+POLL_SECONDS = float(os.getenv("INDEX_POLL_SECONDS", "5"))
+
+# =========================================================
+# PARTITIONS
+# =========================================================
+# Each partition (a user, team or workspace) has its own upload folder
+# and its own versioned index under <root>/partitions/<name>, so a query
+# only scans that tenant's vectors. The default partition is the root
+# itself, which keeps single-tenant setups exactly as they were.
+PARTITIONS_DIR = "partitions"
+DEFAULT_PARTITION = "shared"
+MAX_LOADED_PARTITIONS = int(os.getenv("MAX_LOADED_PARTITIONS", "8"))
+
+PARTITION_RE = re.compile(r"^[A-Za-z0-9_-][A-Za-z0-9_.-]{0,63}$")
+
+def partition_name(value):
+    if not value:
+        return DEFAULT_PARTITION
+    value = str(value)
+    if not PARTITION_RE.match(value):
+        raise ValueError(f"Invalid partition name: {value!r}")
+    return value
+
+def partition_root(root, partition=DEFAULT_PARTITION):
+    if partition == DEFAULT_PARTITION:
+        return root
+    return os.path.join(root, PARTITIONS_DIR, partition)
+
+VERSION_RE = re.compile(r"^v(\d+)$")
+
+def list_versions(root):
+    folder = os.path.join(root, VERSIONS_DIR)
+    if not os.path.isdir(folder):
+        return []
+    names = [n for n in os.listdir(folder) if VERSION_RE.match(n)]
+    return sorted(names, key=lambda n: int(VERSION_RE.match(n).group(1)))
+
+def current_version_dir(root):
+    try:
+        with open(os.path.join(root, CURRENT_FILE), encoding="utf-8") as f:
+            return os.path.join(root, VERSIONS_DIR, f.read().strip())
+    except FileNotFoundError:
+        if os.path.exists(os.path.join(root, "index.faiss")):
+            return root
+        return None
+
+def new_version_dir(root):
+    versions = list_versions(root)
+    n = int(VERSION_RE.match(versions[-1]).group(1)) + 1 if versions else 1
+    folder = os.path.join(root, VERSIONS_DIR, f"v{n:06d}")
+    os.makedirs(folder)
+    return folder
+
+def publish(root, folder):
+    tmp = os.path.join(root, CURRENT_FILE + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(os.path.basename(folder))
+    os.replace(tmp, os.path.join(root, CURRENT_FILE))
+    print(f"🔁 Published index version {os.path.basename(folder)}")
+
+def collect_garbage(root, keep=KEEP_VERSIONS):
+    # Keep the live version and the (keep - 1) before it; anything newer
+    # than CURRENT is a crashed, never-published build. Readers that still
+    # map deleted files keep their inodes until they let go.
+    live = os.path.basename(current_version_dir(root) or "")
+    versions = list_versions(root)
+    if live not in versions:
+        return
+
+    i = versions.index(live)
+    doomed = versions[:max(0, i - keep + 1)] + versions[i + 1:]
+    for name in doomed:
+        shutil.rmtree(os.path.join(root, VERSIONS_DIR, name), ignore_errors=True)
+    if doomed:
+        print(f"🧹 Removed index versions: {', '.join(doomed)}")
+
+# =========================================================
+# READER SIDE
+# =========================================================
+class IndexVersion:
+    def __init__(self, folder, embeddings):
+        self.folder = folder
+        self.name = os.path.basename(folder)
+        self.db = load_store(folder, embeddings)
+        tune_index(self.db.index)
+        # None for a version without one: dense-only retrieval
+        lexical = os.path.join(folder, "lexical.sqlite")
+        if os.path.exists(lexical):
+            self.lexical = LexicalIndex(lexical, readonly=True)
+        else:
+            self.lexical = None
+            print(f"⚠️ {folder} has no lexical index, serving dense-only results")
+
+class StoreManager:
+    def __init__(self, root, embeddings):
+        self.root = root
+        self.embeddings = embeddings
+        self.lock = threading.Lock()
+        self._current = None
+        self.refresh()
+
+    def current(self) -> IndexVersion:
+        return self._current
+
+    def refresh(self):
+        # Load outside of any query path, then swap a single reference
+        with self.lock:
+            folder = current_version_dir(self.root)
+            if folder is None:
+                return False
+            if self._current is not None and self._current.folder == folder:
+                return False
+
+            started = time.perf_counter()
+            version = IndexVersion(folder, self.embeddings)
+            self._current = version
+            print(f"🔁 Serving index {version.folder} (loaded in {time.perf_counter() - started:.2f}s)")
+            return True
+
+class PartitionRegistry:
+    # Lazily loaded StoreManager per partition, least recently used ones
+    # dropped past MAX_LOADED_PARTITIONS (their mmaps close once the last
+    # in-flight query lets go). One thread polls CURRENT for all of them.
+    # Concurrent first requests for a partition share one load: the first
+    # caller loads, the others wait on its future.
+    def __init__(self, root, embeddings, max_loaded=MAX_LOADED_PARTITIONS):
+        self.root = root
+        self.embeddings = embeddings
+        self.max_loaded = max_loaded
+        self.lock = threading.Lock()
+        self.loaded = OrderedDict()
+        self.loading = {}
+        self._watcher = None
+
+    def get(self, partition=DEFAULT_PARTITION) -> StoreManager:
+        with self.lock:
+            manager = self.loaded.get(partition)
+            if manager is not None:
+                self.loaded.move_to_end(partition)
+                return manager
+
+            future = self.loading.get(partition)
+            if future is None:
+                future = self.loading[partition] = Future()
+                owner = True
+            else:
+                owner = False
+
+        if not owner:
+            return future.result()
+
+        # Load outside the registry lock so other partitions keep serving
+        try:
+            manager = StoreManager(partition_root(self.root, partition), self.embeddings)
+        except BaseException as e:
+            with self.lock:
+                del self.loading[partition]
+            future.set_exception(e)
+            raise
+
+        with self.lock:
+            del self.loading[partition]
+            self.loaded[partition] = manager
+            while len(self.loaded) > self.max_loaded:
+                evicted, _ = self.loaded.popitem(last=False)
+                print(f"📤 Unloaded partition {evicted}")
+        future.set_result(manager)
+        return manager
+
+    def current(self, partition=DEFAULT_PARTITION) -> IndexVersion:
+        return self.get(partition).current()
+
+    def refresh(self, partition=DEFAULT_PARTITION):
+        return self.get(partition).refresh()
+
+    def watch(self, interval=POLL_SECONDS):
+        if self._watcher is not None:
+            return
+
+        def loop():
+            while True:
+                time.sleep(interval)
+                with self.lock:
+                    managers = list(self.loaded.items())
+                for partition, manager in managers:
+                    try:
+                        manager.refresh()
+                    except Exception as e:
+                        print(f"⚠️ Index reload failed ({partition}): {e}")
+
+        self._watcher = threading.Thread(target=loop, name="index-watch", daemon=True)
+        self._watcher.start()
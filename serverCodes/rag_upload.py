@@ -0,0 +1,179 @@
+import os
+import re
+import json
+import time
+import struct
+import hashlib
+
+# =========================================================
+# CONFIG
+# =========================================================
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(2 * 1024 ** 3)))
+UPLOAD_PROGRESS_BYTES = int(os.getenv("UPLOAD_PROGRESS_BYTES", str(4 * 1024 * 1024)))
+
+# Unfinished uploads are kept this long for a resume
+UPLOAD_PARTIAL_TTL = float(os.getenv("UPLOAD_PARTIAL_TTL", str(24 * 3600)))
+
+PARTIAL_DIR = ".partial"
+
+# =========================================================
+# CHUNKED UPLOADS
+# =========================================================
+#   → {"type": "file_meta", "chunked": true, "filename", "size", "sha256",
+#      "partition"?, "upload_id"?}
+#   ← {"type": "upload_ready", "upload_id", "channel", "offset", "chunk_size"}
+#   → binary frames: HEADER (channel, offset) + up to chunk_size bytes
+#   ← {"type": "upload_progress", "upload_id", "received", "size"}
+#   ← {"type": "status", "upload_id", ...} once verified and ingested
+#
+# Chunks are appended straight to <upload dir>/.partial/<upload_id>.part,
+# so memory stays at one chunk per upload, next to <upload_id>.json with
+# the declared file. The upload id is derived from partition / name /
+# size / hash, so sending the same file_meta after a reconnect resumes at
+# the returned offset; a .part whose .json declares another file (e.g. a
+# reused client-chosen upload_id) is started over. A chunk at the wrong
+# offset is dropped and answered with a fresh "upload_ready"; one larger
+# than chunk_size or past the declared size aborts the upload.
+HEADER = struct.Struct(">IQ")
+
+UPLOAD_ID_RE = re.compile(r"^[A-Za-z0-9_-]{8,64}$")
+SHA256_RE = re.compile(r"^[0-9a-f]{64}$")
+
+def make_upload_id(partition, filename, size, sha256):
+    key = f"{partition}/{filename}/{size}/{sha256}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+
+def parse_chunk(frame):
+    # Returns (channel, offset, payload) or None if too short for a header
+    if len(frame) < HEADER.size:
+        return None
+    channel, offset = HEADER.unpack_from(frame)
+    return channel, offset, memoryview(frame)[HEADER.size:]
+
+class Upload:
+    def __init__(self, folder, upload_id, filename, partition, size, sha256):
+        self.folder = folder
+        self.upload_id = upload_id
+        self.filename = filename
+        self.partition = partition
+        self.size = size
+        self.sha256 = sha256
+
+        partial = os.path.join(folder, PARTIAL_DIR)
+        os.makedirs(partial, exist_ok=True)
+        self.part_path = os.path.join(partial, f"{upload_id}.part")
+        self.meta_path = os.path.join(partial, f"{upload_id}.json")
+
+        meta = {"filename": filename, "partition": partition, "size": size, "sha256": sha256}
+        try:
+            with open(self.meta_path, encoding="utf-8") as f:
+                resumable = json.load(f) == meta
+        except (OSError, ValueError):
+            resumable = False
+
+        with open(self.meta_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+
+        self.file = open(self.part_path, "ab")
+        self.received = self.file.tell()
+        self.reported = self.received
+
+        # Only resume bytes of the same file, never past its declared size
+        if not resumable or self.received > size:
+            self.file.truncate(0)
+            self.file.seek(0)
+            self.received = self.reported = 0
+
+    @staticmethod
+    def parse_meta(data, partition):
+        # Validates a chunked file_meta frame into Upload kwargs; raises ValueError
+        filename = os.path.basename(data.get("filename") or "")
+        size = data.get("size")
+        sha256 = str(data.get("sha256") or "").lower()
+
+        if not filename:
+            raise ValueError("filename missing")
+        if not isinstance(size, int) or size < 0 or size > UPLOAD_MAX_BYTES:
+            raise ValueError(f"size must be an integer up to {UPLOAD_MAX_BYTES} bytes")
+        if not SHA256_RE.match(sha256):
+            raise ValueError("sha256 must be a hex SHA-256 digest")
+
+        upload_id = data.get("upload_id") or make_upload_id(partition, filename, size, sha256)
+        if not UPLOAD_ID_RE.match(upload_id):
+            raise ValueError("invalid upload_id")
+
+        return {
+            "upload_id": upload_id, "filename": filename, "partition": partition,
+            "size": size, "sha256": sha256
+        }
+
+    @property
+    def complete(self):
+        return self.received >= self.size
+
+    def write(self, offset, data):
+        # Returns False if the chunk is out of sequence (nothing written);
+        # raises ValueError for one no client may send
+        if len(data) > UPLOAD_CHUNK_SIZE:
+            raise ValueError(f"chunk of {len(data)} bytes exceeds chunk_size {UPLOAD_CHUNK_SIZE}")
+        if offset + len(data) > self.size:
+            raise ValueError(f"chunk at {offset}+{len(data)} runs past size {self.size}")
+        if offset != self.received:
+            return False
+        self.file.write(data)
+        self.received += len(data)
+        if self.complete:
+            self.file.flush()
+        return True
+
+    def progress_due(self):
+        if self.complete or self.received - self.reported >= UPLOAD_PROGRESS_BYTES:
+            self.reported = self.received
+            return True
+        return False
+
+    def verify(self):
+        self.file.close()
+        h = hashlib.sha256()
+        with open(self.part_path, "rb") as f:
+            for block in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""):
+                h.update(block)
+        return h.hexdigest() == self.sha256
+
+    def finish(self):
+        # Moves the verified file into the upload folder, returns its path
+        path = os.path.join(self.folder, self.filename)
+        os.replace(self.part_path, path)
+        self.discard()
+        return path
+
+    def close(self):
+        self.file.close()
+
+    def discard(self):
+        self.file.close()
+        for p in (self.part_path, self.meta_path):
+            try:
+                os.remove(p)
+            except FileNotFoundError:
+                pass
+
+def purge_stale(folder, ttl=UPLOAD_PARTIAL_TTL):
+    # Drops abandoned partial uploads under folder (and its partitions);
+    # a .part and its .json go together, once neither changed within ttl
+    cutoff = time.time() - ttl
+    removed = 0
+    for root, dirs, files in os.walk(folder):
+        if os.path.basename(root) != PARTIAL_DIR:
+            continue
+        groups = {}
+        for name in files:
+            groups.setdefault(os.path.splitext(name)[0], []).append(os.path.join(root, name))
+        for paths in groups.values():
+            if max(os.path.getmtime(p) for p in paths) < cutoff:
+                for p in paths:
+                    os.remove(p)
+                removed += 1
+    if removed:
+        print(f"🧹 Removed {removed} stale partial uploads")
@@ -2,20 +2,399 @@ import asyncio
 import websockets
 import json
 import os
+import time
+import queue
+import itertools
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
 
 from websockets.exceptions import ConnectionClosedOK, ConnectionClosedError
 
-from rag_load import load_documents
-from rag_ingest import ingest_documents
-from rag_query import answer_query
+# First, so the startup profile covers the imports below
+from rag_lazy import warm_up, startup_report, mark
 
-UPLOAD_DIR = "/home/nomathematician/Aerothon26/Local-RAG-with-Ollama/pdfs/engineering"
+from rag_load import PDF_FOLDER
+from rag_jobs import JobQueue, QueueFull, INTERACTIVE, BULK, INGEST_COALESCE_MS, init_worker, run_batch
+from rag_query import answer_query, stream_answer, partitions
+from rag_store import partition_name, partition_root
+from rag_upload import Upload, UPLOAD_CHUNK_SIZE, parse_chunk, purge_stale
+from rag_session import sessions
+from rag_metrics import metrics, serve_metrics
+
+mark("server_imports")
+
+UPLOAD_DIR = PDF_FOLDER
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
+# =========================================================
+# WORKER POOLS
+# =========================================================
+# Queries run in a bounded thread pool (LLM / embedding calls are I/O
+# bound on Ollama). Ingestion runs in its own process so parsing, OCR
+# and chunking never hold the GIL the event loop and queries need.
+# There is exactly one ingestion process: it is the single writer of
+# faiss_db and its manifest, fed by the job queue below. It is started
+# from a fresh interpreter (forkserver, spawn where that is missing),
+# never forked from the threaded server, so it can't inherit a lock
+# some query thread held at the time; it imports this module, so
+# nothing here may start work at import.
+QUERY_WORKERS = int(os.getenv("QUERY_WORKERS", "4"))
+MAX_PENDING_QUERIES = int(os.getenv("MAX_PENDING_QUERIES", "32"))
+
+query_pool = ThreadPoolExecutor(max_workers=QUERY_WORKERS, thread_name_prefix="rag-query")
+ingest_pool = None
+progress_events = None
+
+INGEST_CONTEXT = multiprocessing.get_context(
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+
+pending = {"query": 0}
+LIMITS = {"query": MAX_PENDING_QUERIES}
+
+metrics.collect("pending", lambda: dict(pending))
+
+def timed_call(submitted, fn, *args, **kwargs):
+    # Runs in the worker; also reports how long the job sat in the queue
+    waited = time.time() - submitted
+    return fn(*args, **kwargs), waited
+
+async def run_limited(kind, pool, fn, *args, **kwargs):
+    if pending[kind] >= LIMITS[kind]:
+        return None, False
+
+    pending[kind] += 1
+    try:
+        loop = asyncio.get_running_loop()
+        result, waited = await loop.run_in_executor(
+            pool, partial(timed_call, time.time(), fn, *args, **kwargs)
+        )
+        metrics.observe("rag_queue_wait_seconds", waited, pool=kind)
+        return result, True
+    finally:
+        pending[kind] -= 1
+
+# =========================================================
+# STREAMING ANSWERS
+# =========================================================
+# Client sends {"type": "query", "stream": true, "query_id": ...} and
+# receives "answer_delta" frames followed by one final "answer" frame
+# (with citations and timing) or a "cancelled" frame. {"type": "cancel"}
+# stops one query_id, or every stream of the connection if omitted.
+
+def pump_stream(loop, queue, cancel, **kwargs):
+    # Runs in a query worker thread, hands events to the event loop
+    try:
+        for event in stream_answer(cancel=cancel, **kwargs):
+            loop.call_soon_threadsafe(queue.put_nowait, event)
+    except Exception as e:
+        loop.call_soon_threadsafe(queue.put_nowait, ("error", {"message": str(e)}))
+
+async def stream_query(ws, query_id, cancel, **kwargs):
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+
+    worker = asyncio.ensure_future(
+        run_limited("query", query_pool, pump_stream, loop, queue, cancel, **kwargs)
+    )
+    # The worker's last event is queued before the executor future resolves
+    worker.add_done_callback(lambda _: queue.put_nowait(None))
+
+    try:
+        while (event := await queue.get()) is not None:
+            kind, payload = event
+
+            if kind == "delta":
+                await ws.send(json.dumps({
+                    "type": "answer_delta",
+                    "query_id": query_id,
+                    "delta": payload
+                }))
+            elif kind == "done":
+                await ws.send(json.dumps({
+                    "type": "answer",
+                    "query_id": query_id,
+                    **payload
+                }))
+                print(f"✅ Streamed answer {query_id} | {payload['timing']}", flush=True)
+            elif kind == "cancelled":
+                await ws.send(json.dumps({
+                    "type": "cancelled",
+                    "query_id": query_id
+                }))
+                print(f"⏹️ Cancelled {query_id}", flush=True)
+            else:
+                await ws.send(json.dumps({
+                    "type": "error",
+                    "query_id": query_id,
+                    **payload
+                }))
+
+        _, accepted = worker.result()
+        if not accepted:
+            await ws.send(json.dumps({
+                "type": "error",
+                "query_id": query_id,
+                "message": "Server busy, please retry"
+            }))
+
+    except (ConnectionClosedOK, ConnectionClosedError):
+        cancel.set()
+
+# =========================================================
+# UPLOADS
+# =========================================================
+# Legacy clients send file_meta then the whole file as one binary frame.
+# file_meta with "chunked": true switches to the resumable protocol in
+# rag_upload (sequenced chunks streamed to disk, sha256-verified).
+WS_MAX_MESSAGE = int(os.getenv("WS_MAX_MESSAGE", str(500 * 1024 * 1024)))
+
+# upload_id -> connection currently writing it (one writer per .part file)
+active_uploads = {}
+background = set()
+
+async def send_ready(ws, channel, upload):
+    await ws.send(json.dumps({
+        "type": "upload_ready",
+        "upload_id": upload.upload_id,
+        "channel": channel,
+        "offset": upload.received,
+        "chunk_size": UPLOAD_CHUNK_SIZE
+    }))
+
+async def handle_chunk(ws, uploads, frame):
+    parsed = parse_chunk(frame)
+    if parsed is None or parsed[0] not in uploads:
+        await ws.send(json.dumps({"type": "error", "message": "Unknown upload channel"}))
+        return
+
+    channel, offset, payload = parsed
+    upload = uploads[channel]
+
+    try:
+        written = await asyncio.to_thread(upload.write, offset, payload)
+    except ValueError as e:
+        # Resending it would never succeed: drop the upload, the client starts over
+        uploads.pop(channel)
+        active_uploads.pop(upload.upload_id, None)
+        await asyncio.to_thread(upload.discard)
+        await ws.send(json.dumps({
+            "type": "error",
+            "upload_id": upload.upload_id,
+            "message": f"Upload aborted: {e}"
+        }))
+        return
+
+    if not written:
+        # Out of sequence (e.g. resent after a reconnect): resync the client
+        await send_ready(ws, channel, upload)
+        return
+
+    if upload.progress_due():
+        await ws.send(json.dumps({
+            "type": "upload_progress",
+            "upload_id": upload.upload_id,
+            "received": upload.received,
+            "size": upload.size
+        }))
+
+    if upload.complete:
+        await complete_upload(ws, uploads, channel)
+
+async def complete_upload(ws, uploads, channel):
+    upload = uploads.pop(channel)
+    active_uploads.pop(upload.upload_id, None)
+
+    if not await asyncio.to_thread(upload.verify):
+        upload.discard()
+        await ws.send(json.dumps({
+            "type": "error",
+            "upload_id": upload.upload_id,
+            "message": "Checksum mismatch, upload discarded"
+        }))
+        return
+
+    path = await asyncio.to_thread(upload.finish)
+    print(f"📥 Received {os.path.basename(path)} ({upload.size} bytes, verified)")
+
+    await enqueue_ingest(ws, upload.partition, path, upload.upload_id)
+
+# =========================================================
+# INGESTION QUEUE
+# =========================================================
+# Uploads become jobs in rag_jobs.JobQueue; one dispatcher hands batches
+# to the ingestion process. Every connection that enqueued (or was
+# merged into) a job gets its events:
+#   ← {"type": "ingest_queued", "job_id", "merged"}
+#   ← {"type": "ingest_started", "job_id", "jobs", "mode"}
+#   ← {"type": "ingest_progress", "job_id", "stage", ...}  (ocr / extracted / embed / save)
+#   ← {"type": "status", "job_id", ...} or {"type": "error", "job_id", ...}
+# {"type": "reindex"} queues a bulk rebuild of the partition behind all
+# uploads; {"type": "job_status", "job_id"} returns a job's record.
+# If the ingestion process dies mid-batch (OOM during OCR, segfault) a
+# new one is started and the batch queued again:
+#   ← {"type": "ingest_queued", "job_id", "retry": true}
+ingest_jobs = None
+
+# job id -> {(connection, upload_id)}, batch id -> job ids,
+# batch id -> Event set once all its progress events were forwarded
+job_watchers = {}
+running_batches = {}
+drained_batches = {}
+ingest_wakeup = None
+
+# Longest wait for a finished batch's last progress events
+PROGRESS_DRAIN_SECONDS = 5
+
+async def notify(job_id, message):
+    for ws, upload_id in list(job_watchers.get(job_id, ())):
+        extra = {"upload_id": upload_id} if upload_id else {}
+        try:
+            await ws.send(json.dumps({**message, "job_id": job_id, **extra}))
+        except (ConnectionClosedOK, ConnectionClosedError):
+            job_watchers.get(job_id, set()).discard((ws, upload_id))
+
+async def enqueue_ingest(ws, partition, path=None, upload_id=None, priority=INTERACTIVE):
+    extra = {"upload_id": upload_id} if upload_id else {}
+    try:
+        job, created = await asyncio.to_thread(ingest_jobs.enqueue, partition, path, priority)
+    except QueueFull as e:
+        await ws.send(json.dumps({"type": "error", "message": f"Ingestion queue full: {e}", **extra}))
+        return
+
+    job_watchers.setdefault(job["id"], set()).add((ws, upload_id))
+    await ws.send(json.dumps({
+        "type": "ingest_queued", "job_id": job["id"], "status": job["status"],
+        "merged": not created, **extra
+    }))
+    ingest_wakeup.set()
+
+async def drain_progress(batch):
+    # run_batch's last progress events can still be in the queue when its
+    # result arrives; the final status must not overtake them
+    try:
+        await asyncio.wait_for(drained_batches[batch].wait(), PROGRESS_DRAIN_SECONDS)
+    except asyncio.TimeoutError:
+        pass
+
+async def run_in_ingest_process(batch, partition, mode):
+    loop = asyncio.get_running_loop()
+    try:
+        summary = await loop.run_in_executor(ingest_pool, run_batch, batch, partition, mode)
+    except BrokenProcessPool:
+        # Nothing more is coming from a dead process
+        raise
+    except Exception:
+        await drain_progress(batch)
+        raise
+    await drain_progress(batch)
+    return summary
+
+async def run_ingest_batch(batch, partition, mode, jobs):
+    ids = [j["id"] for j in jobs]
+    running_batches[batch] = ids
+    drained_batches[batch] = asyncio.Event()
+    print(f"📚 Running ingestion pipeline ({partition}, {mode}) for {len(ids)} job(s)...")
+    for j in jobs:
+        metrics.observe("rag_queue_wait_seconds", j["started"] - j["created"], pool="ingest")
+        await notify(j["id"], {"type": "ingest_started", "jobs": len(ids), "mode": mode})
+
+    error = None
+    try:
+        summary = await run_in_ingest_process(batch, partition, mode)
+        # The ingestion process ships its trace back; fold it in here
+        metrics.record(summary)
+
+        # Swap in the new version now instead of waiting for the poll;
+        # queries already running finish on the old one
+        await asyncio.get_running_loop().run_in_executor(None, partitions.refresh, partition)
+        await asyncio.to_thread(ingest_jobs.finish, batch, None)
+    except BrokenProcessPool:
+        # The ingestion process died (OOM during OCR, segfault): every
+        # later batch would fail too, so start a new one and run this
+        # batch again, unless it keeps taking the process down
+        error = "ingestion process died"
+        print(f"💥 Ingestion process died ({partition}), starting a new one")
+        await asyncio.to_thread(restart_ingest_pool)
+        if await asyncio.to_thread(ingest_jobs.retry, batch, error):
+            running_batches.pop(batch, None)
+            drained_batches.pop(batch, None)
+            for i in ids:
+                await notify(i, {"type": "ingest_queued", "status": "queued", "retry": True})
+            return
+    except Exception as e:
+        error = str(e) or type(e).__name__
+        print(f"❌ Ingestion failed ({partition}): {error}")
+        await asyncio.to_thread(ingest_jobs.finish, batch, error)
+
+    running_batches.pop(batch, None)
+    drained_batches.pop(batch, None)
+
+    for i in ids:
+        if error:
+            await notify(i, {"type": "error", "message": f"Ingestion failed: {error}"})
+        else:
+            await notify(i, {"type": "status", "message": "Document ingested successfully"})
+        job_watchers.pop(i, None)
+
+async def run_ingest_queue():
+    # The single writer: one batch at a time, until the queue is empty
+    while True:
+        await ingest_wakeup.wait()
+        ingest_wakeup.clear()
+        # Let a burst of uploads land in the same batch
+        await asyncio.sleep(INGEST_COALESCE_MS / 1000)
+        while (batch := await asyncio.to_thread(ingest_jobs.next_batch)) is not None:
+            await run_ingest_batch(*batch)
+
+def forward_progress(loop):
+    # Thread: ingestion process events → the batch's watchers
+    def send(batch, event):
+        if event is None:
+            if batch in drained_batches:
+                drained_batches[batch].set()
+            return
+        for job_id in running_batches.get(batch, ()):
+            task = asyncio.create_task(notify(job_id, {"type": "ingest_progress", **event}))
+            background.add(task)
+            task.add_done_callback(background.discard)
+
+    while True:
+        # Re-read each time: a restarted pool comes with a new queue
+        events = progress_events
+        try:
+            batch, event = events.get(timeout=1)
+        except queue.Empty:
+            continue
+        loop.call_soon_threadsafe(send, batch, event)
+
+def start_ingest_queue():
+    # Call from the running event loop, after start_ingest_pool. Opening
+    # the job queue re-queues interrupted jobs, so it happens here and
+    # not at import (the ingestion process imports this module too)
+    global ingest_jobs, ingest_wakeup
+    ingest_jobs = JobQueue()
+    metrics.collect("ingest_jobs", ingest_jobs.stats)
+    ingest_wakeup = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    threading.Thread(target=forward_progress, args=(loop,), name="ingest-progress", daemon=True).start()
+    task = loop.create_task(run_ingest_queue())
+    background.add(task)
+    # Jobs left over from before a restart
+    ingest_wakeup.set()
+
 async def handler(ws):
     print("🟢 Client connected")
     current_filename = None
-    chat_history = []
+    current_partition = None
+    uploads = {}
+    upload_seq = itertools.count(1)
+    connection_id = f"conn-{id(ws)}"
+    streams = {}
+    query_seq = itertools.count(1)
 
     try:
         async for message in ws:
@@ -24,15 +403,81 @@ async def handler(ws):
             if isinstance(message, str):
                 data = json.loads(message)
 
+                # Optional "partition" (user / team / workspace) keeps
+                # uploads and searches inside that tenant's own index
+                try:
+                    partition = partition_name(data.get("partition"))
+                except ValueError as e:
+                    await ws.send(json.dumps({"type": "error", "message": str(e)}))
+                    continue
+
+                # ---------- HEALTH ----------
+                # Readiness of the warm-up components plus the startup profile
+                if data.get("type") == "health":
+                    await ws.send(json.dumps({"type": "health", **startup_report()}))
+
+                # ---------- STATS ----------
+                # Per-stage latency percentiles, counters and pool gauges
+                elif data.get("type") == "stats":
+                    await ws.send(json.dumps({"type": "stats", **metrics.snapshot()}))
+
+                # ---------- INGESTION JOBS ----------
+                elif data.get("type") == "reindex":
+                    await enqueue_ingest(ws, partition, priority=BULK)
+
+                elif data.get("type") == "job_status":
+                    job = await asyncio.to_thread(ingest_jobs.get, str(data.get("job_id")))
+                    if job is None:
+                        await ws.send(json.dumps({"type": "error", "message": "Unknown job"}))
+                    else:
+                        await ws.send(json.dumps({"type": "job_status", **job}))
+
+                # ---------- CHUNKED FILE META ----------
+                elif data.get("type") == "file_meta" and data.get("chunked"):
+                    try:
+                        meta = Upload.parse_meta(data, partition)
+                    except ValueError as e:
+                        await ws.send(json.dumps({"type": "error", "message": f"Upload rejected: {e}"}))
+                        continue
+
+                    # Re-announced on this socket: the new channel replaces the old
+                    for c, u in list(uploads.items()):
+                        if u.upload_id == meta["upload_id"]:
+                            uploads.pop(c).close()
+                            active_uploads.pop(u.upload_id, None)
+
+                    if meta["upload_id"] in active_uploads:
+                        await ws.send(json.dumps({
+                            "type": "error",
+                            "upload_id": meta["upload_id"],
+                            "message": "Upload already in progress on another connection"
+                        }))
+                        continue
+
+                    folder = partition_root(UPLOAD_DIR, partition)
+                    upload = await asyncio.to_thread(Upload, folder, **meta)
+
+                    channel = next(upload_seq)
+                    uploads[channel] = upload
+                    active_uploads[upload.upload_id] = ws
+                    print(f"📄 Receiving {upload.filename} ({partition}) | {upload.received}/{upload.size} bytes")
+
+                    await send_ready(ws, channel, upload)
+                    if upload.complete:
+                        # Everything arrived before a disconnect: verify now
+                        await complete_upload(ws, uploads, channel)
+
                 # ---------- FILE META ----------
-                if data.get("type") == "file_meta":
-                    current_filename = data.get("filename")
-                    print(f"📄 Expecting file: {current_filename}")
+                elif data.get("type") == "file_meta":
+                    current_filename = os.path.basename(data.get("filename") or "") or None
+                    current_partition = partition
+                    print(f"📄 Expecting file: {current_filename} ({partition})")
 
                 # ---------- QUERY ----------
                 elif data.get("type") == "query":
                     question = data.get("question")
                     role = data.get("role", "engineer")
+                    session_id = data.get("thread_id") or connection_id
 
                     if not question:
                         await ws.send(json.dumps({
@@ -41,49 +486,78 @@ async def handler(ws):
                         }))
                         continue
 
-                    print(f"❓ Query: {question}")
+                    # Optional "documents": [file names] narrows the search
+                    sources = data.get("documents") or None
+
+                    print(f"❓ Query: {question} ({partition})")
+
+                    if data.get("stream"):
+                        query_id = data.get("query_id") or f"q{next(query_seq)}"
+                        cancel = threading.Event()
+                        task = asyncio.create_task(stream_query(
+                            ws, query_id, cancel,
+                            question=question,
+                            role=role,
+                            session_id=session_id,
+                            partition=partition,
+                            sources=sources
+                        ))
+                        streams[query_id] = (task, cancel)
+                        task.add_done_callback(lambda _, q=query_id: streams.pop(q, None))
+                        continue
+
                     print("🤖 LLM is generating answer...", flush=True)
 
-                    answer = answer_query(
-                    question=question,
-                    role=role,
-                    history=chat_history
+                    answer, accepted = await run_limited(
+                        "query", query_pool, answer_query,
+                        question=question,
+                        role=role,
+                        session_id=session_id,
+                        partition=partition,
+                        sources=sources
                     )
 
+                    if not accepted:
+                        await ws.send(json.dumps({
+                            "type": "error",
+                            "message": "Server busy, please retry"
+                        }))
+                        continue
+
                     print("✅ Answer generated", flush=True)
                     print("📝 Answer:\n" + "-" * 40)
                     print(answer)
                     print("-" * 40, flush=True)
 
-
-                    chat_history.append({
-                        "question": question,
-                        "answer": answer
-                    })
-
                     await ws.send(json.dumps({
                         "type": "answer",
                         "answer": answer
                     }))
 
+                # ---------- CANCEL ----------
+                elif data.get("type") == "cancel":
+                    query_id = data.get("query_id")
+                    for q, (_, cancel) in list(streams.items()):
+                        if query_id is None or q == query_id:
+                            cancel.set()
+
             # ================= BINARY =================
             elif isinstance(message, bytes) and current_filename:
-                file_path = os.path.join(UPLOAD_DIR, current_filename)
+                folder = partition_root(UPLOAD_DIR, current_partition)
+                os.makedirs(folder, exist_ok=True)
+                file_path = os.path.join(folder, current_filename)
 
-                with open(file_path, "wb") as f:
-                    f.write(message)
+                def write_file():
+                    with open(file_path, "wb") as f:
+                        f.write(message)
 
-                print("📚 Running ingestion pipeline...")
+                await asyncio.to_thread(write_file)
+                current_filename = None
 
-                load_documents()
-                ingest_documents()
+                await enqueue_ingest(ws, current_partition, file_path)
 
-                await ws.send(json.dumps({
-                    "type": "status",
-                    "message": "Document ingested successfully"
-                }))
-
-                current_filename = None
+            elif isinstance(message, bytes):
+                await handle_chunk(ws, uploads, message)
 
     except ConnectionClosedOK:
         print("🔵 Client disconnected")
@@ -94,15 +568,66 @@ async def handler(ws):
     except Exception as e:
         print(f"❌ Server error: {e}")
 
+    finally:
+        # Stop generating for a client that is gone
+        for _, cancel in streams.values():
+            cancel.set()
+
+        # Thread-keyed sessions outlive the socket; connection ones do not
+        sessions.drop(connection_id)
+
+        # Partial uploads stay on disk for a resume
+        for upload in uploads.values():
+            upload.close()
+            active_uploads.pop(upload.upload_id, None)
+
+        # Its jobs still run, nobody is told about them
+        for watchers in job_watchers.values():
+            for w in [w for w in watchers if w[0] is ws]:
+                watchers.discard(w)
+
+def start_ingest_pool():
+    global ingest_pool, progress_events
+
+    # A new queue per process: a worker killed mid-put can leave the old
+    # one's write lock held
+    progress_events = INGEST_CONTEXT.Queue()
+    ingest_pool = ProcessPoolExecutor(
+        max_workers=1,
+        mp_context=INGEST_CONTEXT,
+        initializer=init_worker,
+        initargs=(progress_events,)
+    )
+    # Start the process (and its imports) in the background now rather
+    # than on the first upload
+    ingest_pool.submit(os.getpid)
+
+def restart_ingest_pool():
+    # Replaces a broken pool
+    old = ingest_pool
+    start_ingest_pool()
+    old.shutdown(wait=False, cancel_futures=True)
+
 async def main():
+    start_ingest_pool()
+    start_ingest_queue()
+    serve_metrics()
+    purge_stale(UPLOAD_DIR)
+    # Also picks up versions published by a standalone rag_ingest run
+    partitions.watch()
+    print(f"⚙️ Query workers: {QUERY_WORKERS} | pending limit: {MAX_PENDING_QUERIES}")
     print("🚀 RAG Server running on ws://0.0.0.0:8000")
     async with websockets.serve(  handler,
     "0.0.0.0",
     8000,
-    max_size=500 * 1024 * 1024,  # 500 MB
+    max_size=WS_MAX_MESSAGE,      # legacy single-frame uploads (500 MB)
     read_limit=2**20,             # 1 MB read buffer
     write_limit=2**20             # 1 MB write buffer
     ):
+        # Port is open; index / models load in the background and queries
+        # that arrive first simply wait for the piece they need
+        mark("port_bound")
+        warm_up()
         await asyncio.Future()
 
 if __name__ == "__main__":
@@ -0,0 +1,70 @@
+import sqlite3
+
+import pytest
+
+from rag_lexical import LexicalIndex, rrf_fuse
+
+@pytest.fixture
+def lexical(tmp_path):
+    index = LexicalIndex(str(tmp_path / "lexical.sqlite"))
+    index.add(
+        ["a", "b", "c", "d"],
+        [
+            "See ticket TKT-5567.",
+            "Passenger boarded flight AI-202. Bags weighed 20 kg.",
+            "Firmware v2.1 fixes part AB-123/4, see docs/setup.",
+            "Unrelated text about coolant pressure"
+        ]
+    )
+    yield index
+    index.close()
+
+@pytest.mark.parametrize("query, expected", [
+    ("TKT-5567", "a"),
+    ("status of TKT-5567?", "a"),
+    ("TKT-5567.", "a"),
+    ("AI-202", "b"),
+    ("kg", "b"),
+    ("v2.1", "c"),
+    ("AB-123/4", "c"),
+    ("setup", "c")
+])
+def test_ids_at_end_of_sentence(lexical, query, expected):
+    assert lexical.search(query, 4)[:1] == [expected]
+
+def test_punctuation_only_query(lexical):
+    assert lexical.search("... / .", 4) == []
+
+def test_copy_retokenizes_old_index(tmp_path):
+    old = tmp_path / "old.sqlite"
+    conn = sqlite3.connect(old)
+    conn.execute("CREATE TABLE chunk_ids (rowid INTEGER PRIMARY KEY AUTOINCREMENT, id TEXT UNIQUE)")
+    conn.execute("CREATE VIRTUAL TABLE chunks USING fts5(text, tokenize = \"unicode61 tokenchars '-_./'\")")
+    conn.execute("INSERT INTO chunk_ids (id) VALUES ('a')")
+    conn.execute("INSERT INTO chunks (rowid, text) VALUES (1, 'See ticket TKT-5567.')")
+    conn.commit()
+    conn.close()
+
+    source = LexicalIndex(str(old))
+    assert source.search("TKT-5567", 4) == []
+    source.copy_to(str(tmp_path / "new.sqlite"))
+    source.close()
+
+    copy = LexicalIndex(str(tmp_path / "new.sqlite"))
+    assert copy.search("TKT-5567", 4) == ["a"]
+    copy.close()
+
+def test_rrf_fuse_prefers_ids_ranked_by_both():
+    assert rrf_fuse(["x", "y", "z"], ["y", "q"])[0] == "y"
+
+def test_readonly_reader_leaves_version_untouched(tmp_path, lexical):
+    lexical.close()
+    before = sorted(p.name for p in tmp_path.iterdir())
+
+    reader = LexicalIndex(str(tmp_path / "lexical.sqlite"), readonly=True)
+    assert reader.search("TKT-5567", 4) == ["a"]
+    with pytest.raises(sqlite3.OperationalError):
+        reader.add(["e"], ["more text"])
+    reader.close()
+
+    assert sorted(p.name for p in tmp_path.iterdir()) == before